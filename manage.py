@@ -1,24 +1,42 @@
 # manage.py
 
 import datetime
+import io
 import os
+import sys
+import time
 import unittest
 import coverage
 
 from flask.ext.script import Manager
 from flask.ext.migrate import Migrate, MigrateCommand
 
-from project import app, db
-from project.models import (
-    User,
-    EducationalInstitutionType,
-    Gender,
-    PatentOffice,
-    PatentStatus,
-    PublicationCategory,
-    PresentationRole,
-    ResearchRole
+from flask.ext.mail import Message
+from sqlalchemy import inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from project import app, db, mail
+from project.models import User, RECORD_DATE_COLUMNS, record_index_name
+from project.email import (
+    run_worker,
+    deliver_confirmations,
+    mail_pool,
+    RateLimiter
 )
+from project.passwords import tune_cost
+from project.search import rebuild_index
+from project.profiles import rebuild_profiles as rebuild_documents
+from project.assets import build as build_assets
+from project.export import export_cv, EXPORT_FORMATS
+from project.bibliography import (
+    detect_format,
+    import_publications as import_entries,
+    FORMATS as IMPORT_FORMATS
+)
+from project.seed import seed_lookup_tables
+from project.records import _after, _record_query
+from project.avatars import avatar_url
 
 app.config.from_object(os.environ['APP_SETTINGS'])
 
@@ -28,6 +46,10 @@ manager = Manager(app)
 # migrations
 manager.add_command('db', MigrateCommand)
 
+# static assets
+assets = Manager(usage='Build the static asset bundles')
+manager.add_command('assets', assets)
+
 
 @manager.command
 def test():
@@ -86,275 +108,322 @@ def create_admin():
 
 @manager.command
 def insert_lookup_data():
-    # EducationalInstitutionType
-    db.session.add(EducationalInstitutionType(description='High School'))
-    db.session.add(EducationalInstitutionType(description='University'))
-    db.session.add(EducationalInstitutionType(
-        description='Technikons / Universities of Technology'))
-    db.session.commit()
-
-    # Gender
-    db.session.add(Gender(gender='Female'))
-    db.session.add(Gender(gender='Male'))
-    db.session.commit()
-
-
-    # PublicationCategory
-    db.session.add(PublicationCategory(category='Peer-reviewed publications',
-                                       description='reports of original '
-                                                   'investigations; clinical '
-                                                   'reports; letters to the '
-                                                   'editor'))
-
-    db.session.add(PublicationCategory(category='Books - authoured',
-                                       description='books authoured/written'))
-
-    db.session.add(PublicationCategory(category='Books - edited',
-                                       description='books edited'))
-
-    db.session.add(PublicationCategory(category='Monographs - authoured',
-                                       description='Monographs authoured'))
-
-    db.session.add(PublicationCategory(category='Monographs - edited',
-                                       description='Monographs edited'))
-
-    db.session.add(PublicationCategory(category='Works in progress',
-                                       description='Complete articles published '
-                                                   'in conference proceedings, '
-                                                   'chapters in books; review '
-                                                   'articles; editorials.'))
-
-    db.session.add(PublicationCategory(category='Development of educational materials',
-                                       description='e.g. teaching cases'))
+    """Loads the lookup tables from project/seeds, upserting changed rows."""
+    for table, inserted, updated in seed_lookup_tables():
+        print('%-30s %5d inserted %5d updated' % (table, inserted, updated))
 
-    db.session.add(PublicationCategory(category='Development of publication materials',
-                                       description='e.g. teaching cases'))
 
-    db.session.add(PublicationCategory(category='Non-print materials',
-                                       description='film strips, films, videotapes and '
-                                                   'computer software relevant to '
-                                                   'academic field'))
-    db.session.commit()
-
-    # PatentOffice
-    db.session.add(PatentOffice(name='Albania'))
-    db.session.add(PatentOffice(name='Algeria'))
-    db.session.add(PatentOffice(name='Andorra'))
-    db.session.add(PatentOffice(name='Angola'))
-    db.session.add(PatentOffice(name='Antigua and Barbuda'))
-    db.session.add(PatentOffice(name='Argentina'))
-    db.session.add(PatentOffice(name='Armenia'))
-    db.session.add(PatentOffice(name='Australia'))
-    db.session.add(PatentOffice(name='Austria'))
-    db.session.add(PatentOffice(name='Azerbaijan'))
-    db.session.add(PatentOffice(name='Bahamas'))
-    db.session.add(PatentOffice(name='Bahrain'))
-    db.session.add(PatentOffice(name='Bangladesh'))
-    db.session.add(PatentOffice(name='Barbados'))
-    db.session.add(PatentOffice(name='Belarus'))
-    db.session.add(PatentOffice(name='Belgium'))
-    db.session.add(PatentOffice(name='Belize'))
-    db.session.add(PatentOffice(name='Benin'))
-    db.session.add(PatentOffice(name='Bhutan'))
-    db.session.add(PatentOffice(name='Bolivia (Plurinational State of)'))
-    db.session.add(PatentOffice(name='Bosnia and Herzegovina'))
-    db.session.add(PatentOffice(name='Botswana'))
-    db.session.add(PatentOffice(name='Brazil'))
-    db.session.add(PatentOffice(name='Brunei Darussalam'))
-    db.session.add(PatentOffice(name='Bulgaria'))
-    db.session.add(PatentOffice(name='Burkina Faso'))
-    db.session.add(PatentOffice(name='Burundi'))
-    db.session.add(PatentOffice(name='Cabo Verde'))
-    db.session.add(PatentOffice(name='Cambodia'))
-    db.session.add(PatentOffice(name='Cameroon'))
-    db.session.add(PatentOffice(name='Canada'))
-    db.session.add(PatentOffice(name='Central African Republic'))
-    db.session.add(PatentOffice(name='Chad'))
-    db.session.add(PatentOffice(name='Chile'))
-    db.session.add(PatentOffice(name='China'))
-    db.session.add(PatentOffice(name='Colombia'))
-    db.session.add(PatentOffice(name='Comoros'))
-    db.session.add(PatentOffice(name='Congo'))
-    db.session.add(PatentOffice(name='Costa Rica'))
-    db.session.add(PatentOffice(name="Cote d'Ivoire"))
-    db.session.add(PatentOffice(name='Croatia'))
-    db.session.add(PatentOffice(name='Cuba'))
-    db.session.add(PatentOffice(name='Cyprus'))
-    db.session.add(PatentOffice(name='Czech Republic'))
-    db.session.add(PatentOffice(name="Democratic People's Republic of Korea"))
-    db.session.add(PatentOffice(name='Democratic Republic of the Congo'))
-    db.session.add(PatentOffice(name='Denmark'))
-    db.session.add(PatentOffice(name='Djibouti'))
-    db.session.add(PatentOffice(name='Dominica'))
-    db.session.add(PatentOffice(name='Dominican Republic'))
-    db.session.add(PatentOffice(name='Ecuador'))
-    db.session.add(PatentOffice(name='Egypt'))
-    db.session.add(PatentOffice(name='El Salvador'))
-    db.session.add(PatentOffice(name='Equatorial Guinea'))
-    db.session.add(PatentOffice(name='Eritrea'))
-    db.session.add(PatentOffice(name='Estonia'))
-    db.session.add(PatentOffice(name='Ethiopia'))
-    db.session.add(PatentOffice(name='Fiji'))
-    db.session.add(PatentOffice(name='Finland'))
-    db.session.add(PatentOffice(name='France'))
-    db.session.add(PatentOffice(name='Gabon'))
-    db.session.add(PatentOffice(name='Gambia'))
-    db.session.add(PatentOffice(name='Georgia'))
-    db.session.add(PatentOffice(name='Germany'))
-    db.session.add(PatentOffice(name='Ghana'))
-    db.session.add(PatentOffice(name='Greece'))
-    db.session.add(PatentOffice(name='Grenada'))
-    db.session.add(PatentOffice(name='Guatemala'))
-    db.session.add(PatentOffice(name='Guinea'))
-    db.session.add(PatentOffice(name='Guinea-Bissau'))
-    db.session.add(PatentOffice(name='Guyana'))
-    db.session.add(PatentOffice(name='Haiti'))
-    db.session.add(PatentOffice(name='Holy See'))
-    db.session.add(PatentOffice(name='Honduras'))
-    db.session.add(PatentOffice(name='Hungary'))
-    db.session.add(PatentOffice(name='Iceland'))
-    db.session.add(PatentOffice(name='India'))
-    db.session.add(PatentOffice(name='Indonesia'))
-    db.session.add(PatentOffice(name='Iran (Islamic Republic of)'))
-    db.session.add(PatentOffice(name='Iraq'))
-    db.session.add(PatentOffice(name='Ireland'))
-    db.session.add(PatentOffice(name='Israel'))
-    db.session.add(PatentOffice(name='Italy'))
-    db.session.add(PatentOffice(name='Jamaica'))
-    db.session.add(PatentOffice(name='Japan'))
-    db.session.add(PatentOffice(name='Jordan'))
-    db.session.add(PatentOffice(name='Kazakhstan'))
-    db.session.add(PatentOffice(name='Kenya'))
-    db.session.add(PatentOffice(name='Kiribati'))
-    db.session.add(PatentOffice(name='Kuwait'))
-    db.session.add(PatentOffice(name='Kyrgyzstan'))
-    db.session.add(PatentOffice(name='Lao People\'s Democratic Republic'))
-    db.session.add(PatentOffice(name='Latvia'))
-    db.session.add(PatentOffice(name='Lebanon'))
-    db.session.add(PatentOffice(name='Lesotho'))
-    db.session.add(PatentOffice(name='Liberia'))
-    db.session.add(PatentOffice(name='Libya'))
-    db.session.add(PatentOffice(name='Liechtenstein'))
-    db.session.add(PatentOffice(name='Lithuania'))
-    db.session.add(PatentOffice(name='Luxembourg'))
-    db.session.add(PatentOffice(name='Madagascar'))
-    db.session.add(PatentOffice(name='Malawi'))
-    db.session.add(PatentOffice(name='Malaysia'))
-    db.session.add(PatentOffice(name='Maldives'))
-    db.session.add(PatentOffice(name='Mali'))
-    db.session.add(PatentOffice(name='Malta'))
-    db.session.add(PatentOffice(name='Mauritania'))
-    db.session.add(PatentOffice(name='Mauritius'))
-    db.session.add(PatentOffice(name='Mexico'))
-    db.session.add(PatentOffice(name='Monaco'))
-    db.session.add(PatentOffice(name='Mongolia'))
-    db.session.add(PatentOffice(name='Montenegro'))
-    db.session.add(PatentOffice(name='Morocco'))
-    db.session.add(PatentOffice(name='Mozambique'))
-    db.session.add(PatentOffice(name='Myanmar'))
-    db.session.add(PatentOffice(name='Namibia'))
-    db.session.add(PatentOffice(name='Nauru'))
-    db.session.add(PatentOffice(name='Nepal'))
-    db.session.add(PatentOffice(name='Netherlands'))
-    db.session.add(PatentOffice(name='New Zealand'))
-    db.session.add(PatentOffice(name='Nicaragua'))
-    db.session.add(PatentOffice(name='Niger'))
-    db.session.add(PatentOffice(name='Nigeria'))
-    db.session.add(PatentOffice(name='Niue'))
-    db.session.add(PatentOffice(name='Norway'))
-    db.session.add(PatentOffice(name='Oman'))
-    db.session.add(PatentOffice(name='Pakistan'))
-    db.session.add(PatentOffice(name='Palau'))
-    db.session.add(PatentOffice(name='Panama'))
-    db.session.add(PatentOffice(name='Papua New Guinea'))
-    db.session.add(PatentOffice(name='Paraguay'))
-    db.session.add(PatentOffice(name='Peru'))
-    db.session.add(PatentOffice(name='Philippines'))
-    db.session.add(PatentOffice(name='Poland'))
-    db.session.add(PatentOffice(name='Portugal'))
-    db.session.add(PatentOffice(name='Qatar'))
-    db.session.add(PatentOffice(name='Republic of Korea'))
-    db.session.add(PatentOffice(name='Republic of Moldova'))
-    db.session.add(PatentOffice(name='Romania'))
-    db.session.add(PatentOffice(name='Russian Federation'))
-    db.session.add(PatentOffice(name='Rwanda'))
-    db.session.add(PatentOffice(name='Saint Kitts and Nevis'))
-    db.session.add(PatentOffice(name='Saint Lucia'))
-    db.session.add(PatentOffice(name='Saint Vincent and the Grenadines'))
-    db.session.add(PatentOffice(name='Samoa'))
-    db.session.add(PatentOffice(name='San Marino'))
-    db.session.add(PatentOffice(name='Sao Tome and Principe'))
-    db.session.add(PatentOffice(name='Saudi Arabia'))
-    db.session.add(PatentOffice(name='Senegal'))
-    db.session.add(PatentOffice(name='Serbia'))
-    db.session.add(PatentOffice(name='Seychelles'))
-    db.session.add(PatentOffice(name='Sierra Leone'))
-    db.session.add(PatentOffice(name='Singapore'))
-    db.session.add(PatentOffice(name='Slovakia'))
-    db.session.add(PatentOffice(name='Slovenia'))
-    db.session.add(PatentOffice(name='Solomon Islands'))
-    db.session.add(PatentOffice(name='Somalia'))
-    db.session.add(PatentOffice(name='South Africa'))
-    db.session.add(PatentOffice(name='Spain'))
-    db.session.add(PatentOffice(name='Sri Lanka'))
-    db.session.add(PatentOffice(name='Sudan'))
-    db.session.add(PatentOffice(name='Suriname'))
-    db.session.add(PatentOffice(name='Swaziland'))
-    db.session.add(PatentOffice(name='Sweden'))
-    db.session.add(PatentOffice(name='Switzerland'))
-    db.session.add(PatentOffice(name='Syrian Arab Republic'))
-    db.session.add(PatentOffice(name='Tajikistan'))
-    db.session.add(PatentOffice(name='Thailand'))
-    db.session.add(PatentOffice(name='the former Yugoslav Republic of Macedonia'))
-    db.session.add(PatentOffice(name='Timor-Leste'))
-    db.session.add(PatentOffice(name='Togo'))
-    db.session.add(PatentOffice(name='Tonga'))
-    db.session.add(PatentOffice(name='Trinidad and Tobago'))
-    db.session.add(PatentOffice(name='Tunisia'))
-    db.session.add(PatentOffice(name='Turkey'))
-    db.session.add(PatentOffice(name='Turkmenistan'))
-    db.session.add(PatentOffice(name='Tuvalu'))
-    db.session.add(PatentOffice(name='Uganda'))
-    db.session.add(PatentOffice(name='Ukraine'))
-    db.session.add(PatentOffice(name='United Arab Emirates'))
-    db.session.add(PatentOffice(name='United Kingdom'))
-    db.session.add(PatentOffice(name='United Republic of Tanzania'))
-    db.session.add(PatentOffice(name='United States of America'))
-    db.session.add(PatentOffice(name='Uruguay'))
-    db.session.add(PatentOffice(name='Uzbekistan'))
-    db.session.add(PatentOffice(name='Vanuatu'))
-    db.session.add(PatentOffice(name='Venezuela (Bolivarian Republic of)'))
-    db.session.add(PatentOffice(name='Viet Nam'))
-    db.session.add(PatentOffice(name='Yemen'))
-    db.session.add(PatentOffice(name='Zambia'))
-    db.session.add(PatentOffice(name='Zimbabwe'))
-    db.session.add(PatentOffice(name='OAPI'))
-    db.session.add(PatentOffice(name='ARIPO'))
-    db.session.add(PatentOffice(name='ASBU'))
-    db.session.add(PatentOffice(name='BOIP'))
-    db.session.add(PatentOffice(name='EAPO'))
-    db.session.add(PatentOffice(name='EPO'))
-    db.session.add(PatentOffice(name='EUIPO'))
-    db.session.add(PatentOffice(name='UPOV'))
-    db.session.add(PatentOffice(name='ICPIP'))
-    db.session.add(PatentOffice(name='GCC Patent Office'))
-    db.session.commit()
+@manager.command
+def rebuild_search_index():
+    """Re-indexes every searchable record from scratch."""
+    started = time.time()
+    for record_type, count in rebuild_index().items():
+        print('%-15s %8d indexed' % (record_type, count))
+    print('done in %.1fs' % (time.time() - started))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=500, help='users rebuilt per round trip')
+def rebuild_profiles(batch_size):
+    """Rebuilds every user's profile document in PROFILE_STORE_URL."""
+    if not app.config['PROFILE_STORE_URL']:
+        print('PROFILE_STORE_URL is not set')
+        return 1
+    started = time.time()
+    count = rebuild_documents(batch_size)
+    print('%d profiles written in %.1fs' % (count, time.time() - started))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=500, help='users updated per round trip')
+def backfill_avatar_urls(batch_size):
+    """Stores the identicon URL of users created before it was stored."""
+    count = 0
+    while True:
+        users = User.query.filter(User.avatar_url.is_(None)) \
+            .order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+        for user in users:
+            user.avatar_url = avatar_url(user.email)
+        db.session.commit()
+        count += len(users)
+    print('%d avatar URLs stored' % count)
+
+
+@assets.command
+def build():
+    """Minifies, bundles and fingerprints the static files into
+    project/static/dist, with .gz and .br copies."""
+    for name, path in build_assets().items():
+        print('%-25s %s' % (name, path))
+
+
+@manager.option('-u', '--user', dest='human_id', type=int, required=True,
+                help='id of the user to export')
+@manager.option('-f', '--format', dest='format', default='jsonl',
+                choices=sorted(EXPORT_FORMATS),
+                help='jsonl, csv or html (default jsonl)')
+@manager.option('-o', '--output', dest='output', default=None,
+                help='file to write to instead of stdout')
+def export_user_cv(human_id, format, output):
+    """Streams a user's records out as a CV."""
+    chunks = export_cv(human_id, format)
+    if chunks is None:
+        print('no user with id %d' % human_id)
+        return 1
+    out = io.open(output, 'w', encoding='utf-8') if output else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+
+
+@manager.option('-u', '--user', dest='human_id', type=int, required=True,
+                help='id of the user the publications belong to')
+@manager.option('-f', '--file', dest='path', required=True,
+                help='BibTeX or RIS file to read')
+@manager.option('--format', dest='format', default=None,
+                choices=sorted(IMPORT_FORMATS),
+                help='bibtex or ris (default: from the file)')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None, help='entries per transaction')
+def import_publications(human_id, path, format, batch_size):
+    """Imports a user's publications from a BibTeX or RIS file."""
+    if User.query.get(human_id) is None:
+        print('no user with id %d' % human_id)
+        return 1
+    with io.open(path, encoding='utf-8', errors='replace') as f:
+        format = format or detect_format(path, f.readline())
+        if format is None:
+            print('cannot tell whether %s is BibTeX or RIS; use --format'
+                  % path)
+            return 1
+        f.seek(0)
+        report = import_entries(human_id, f, format, batch_size)
+    print('imported %d, skipped %d duplicates and %d without a title' % (
+        report.imported, report.duplicates, report.invalid))
+    if report.error:
+        print('stopped at a malformed entry: %s' % report.error)
+        return 1
 
-    # PatentStatus
-    db.session.add(PatentStatus(status='Patent Issued'))
-    db.session.add(PatentStatus(status='Patent Pending'))
-    db.session.commit()
 
-    db.session.add(PresentationRole(description='Presenter'))
-    db.session.add(PresentationRole(description='Panelist'))
-    db.session.add(PresentationRole(description='Keynote Speaker'))
-    db.session.commit()
+@manager.command
+def create_record_indexes():
+    """Builds the record list indexes without blocking writes, ahead of
+    `db upgrade` on a large database, and drops the ones they replace."""
+    postgres = db.engine.dialect.name == 'postgresql'
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    connection = db.engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT') if postgres else db.engine.connect()
+    try:
+        for model, date in RECORD_DATE_COLUMNS:
+            table = model.__tablename__
+            name = record_index_name(model, date)
+            # the earlier (human_id, date DESC) index, without the id
+            superseded = 'ix_%s_human_id_%s' % (table, date.key)
+            if postgres:
+                # a build that failed part way leaves an invalid index
+                valid = connection.execute(
+                    'SELECT i.indisvalid FROM pg_index i JOIN pg_class c '
+                    'ON c.oid = i.indexrelid WHERE c.relname = %s',
+                    (name,)).scalar()
+                if valid:
+                    print('%s exists' % name)
+                else:
+                    if valid is not None:
+                        connection.execute(
+                            'DROP INDEX CONCURRENTLY %s' % name)
+                    connection.execute(
+                        'CREATE INDEX CONCURRENTLY %s ON %s '
+                        '(human_id, %s DESC, id DESC)'
+                        % (name, table, date.key))
+                    print('%s created' % name)
+                connection.execute(
+                    'DROP INDEX CONCURRENTLY IF EXISTS %s' % superseded)
+            else:
+                existing = set(index['name'] for index in
+                               inspect(db.engine).get_indexes(table))
+                if name in existing:
+                    print('%s exists' % name)
+                else:
+                    index, = [index for index in model.__table__.indexes
+                              if index.name == name]
+                    index.create(connection)
+                    print('%s created' % name)
+                if superseded in existing and \
+                        db.engine.dialect.name == 'mysql':
+                    connection.execute('DROP INDEX %s ON %s'
+                                       % (superseded, table))
+                elif superseded in existing:
+                    connection.execute('DROP INDEX %s' % superseded)
+    finally:
+        connection.close()
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN `prefix` followed by `statement`, whose parameters are
+    bound as usual; on SQLite `table` is read NOT INDEXED if given."""
+
+    def __init__(self, prefix, statement, not_indexed=None):
+        self.prefix = prefix
+        self.statement = statement
+        self.not_indexed = not_indexed
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kw):
+    sql = compiler.process(element.statement, **kw)
+    if element.not_indexed:
+        sql = sql.replace('FROM %s' % element.not_indexed,
+                          'FROM %s NOT INDEXED' % element.not_indexed, 1)
+    return element.prefix + ' ' + sql
+
+
+def _explain(query, table, use_indexes=True):
+    """The database's plan for `query` on `table`, one line per row of
+    output.
+
+    With use_indexes=False the plan is produced as if the record indexes
+    did not exist, for comparison with the indexed plan.
+    """
+    dialect = db.engine.dialect
+    with db.engine.begin() as connection:
+        if dialect.name == 'postgresql':
+            if not use_indexes:
+                for setting in ('enable_indexscan', 'enable_indexonlyscan',
+                                'enable_bitmapscan'):
+                    connection.execute('SET LOCAL %s = off' % setting)
+            explain = _Explain('EXPLAIN', query.statement)
+        elif dialect.name == 'sqlite':
+            explain = _Explain('EXPLAIN QUERY PLAN', query.statement,
+                               None if use_indexes else table)
+        else:
+            explain = _Explain('EXPLAIN', query.statement)
+        rows = connection.execute(explain)
+        return [' '.join(str(column) for column in row) for row in rows]
+
+
+@manager.option('-u', '--user', dest='human_id', type=int, default=1,
+                help='id of the user whose record lists are explained')
+def explain_list_queries(human_id):
+    """Prints the plans of the first and a later page of every record
+    list, as record_page runs them, without and with indexes."""
+    per_page = app.config['RECORDS_PER_PAGE']
+    for model, date in RECORD_DATE_COLUMNS:
+        table = model.__tablename__
+        query = _record_query(model, human_id)
+        # the page after the user's first, or one starting now if they
+        # have no more records than fit on it
+        last = query.offset(per_page - 1).first()
+        cursor = (getattr(last, date.key), last.id) if last is not None \
+            else (datetime.datetime.utcnow(), 0)
+        pages = [
+            ('first page', query.limit(per_page + 1)),
+            ('later page', query.filter(_after(model, date, *cursor))
+             .limit(per_page + 1)),
+        ]
+        print('== %s ==' % table)
+        for page, page_query in pages:
+            print('-- %s without indexes' % page)
+            for line in _explain(page_query, table, use_indexes=False):
+                print(line)
+            print('-- %s with indexes' % page)
+            for line in _explain(page_query, table):
+                print(line)
+        print('')
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None, help='messages claimed per batch')
+@manager.option('-i', '--interval', dest='poll_interval', type=float,
+                default=None, help='seconds to wait when the outbox is empty')
+@manager.option('--once', dest='once', action='store_true', default=False,
+                help='exit once no messages are due instead of polling')
+@manager.option('-r', '--rate', dest='rate', type=float, default=None,
+                help='maximum messages sent per second')
+def mail_worker(batch_size, poll_interval, once, rate):
+    """Delivers queued emails from the outbox."""
+    limiter = RateLimiter(rate)
+    for report in run_worker(batch_size, poll_interval, once, limiter):
+        print('%d sent %d retrying %d failed' % report)
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None, help='messages queued and sent per batch')
+@manager.option('-r', '--rate', dest='rate', type=float, default=None,
+                help='maximum messages sent per second')
+@manager.option('-u', '--base-url', dest='base_url', default=None,
+                help='site the confirmation links point at')
+def resend_confirmations(batch_size, rate, base_url):
+    """Re-sends the activation email to every unconfirmed user."""
+    emails = [email for email, in db.session.query(User.email)
+              .filter_by(confirmed=False).order_by(User.id)]
+    started = time.time()
+    totals = [0, 0, 0]
+    with app.test_request_context(base_url=base_url or app.config['BASE_URL']):
+        for report in deliver_confirmations(emails, batch_size,
+                                            RateLimiter(rate)):
+            totals = [total + count for total, count in zip(totals, report)]
+            print('%d sent %d retrying %d failed' % report)
+    print('%d users: %d sent %d retrying %d failed in %.1fs' % tuple(
+        [len(emails)] + totals + [time.time() - started]))
+    print('SMTP connections: %(opened)d opened, %(reused)d reused'
+          % mail_pool.stats())
+
+
+@manager.option('-t', '--target', dest='target', type=float, default=None,
+                help='seconds one password check should take')
+@manager.option('-s', '--samples', dest='samples', type=int, default=3,
+                help='timings taken per cost')
+def tune_bcrypt(target, samples):
+    """Benchmarks bcrypt here and suggests BCRYPT_LOG_ROUNDS."""
+    target = target or app.config['BCRYPT_TARGET_SECONDS']
+    cost, timings = tune_cost(target, app.config['BCRYPT_MIN_LOG_ROUNDS'],
+                              samples)
+    for timed_cost, seconds in timings:
+        print('cost %2d %8.3fs' % (timed_cost, seconds))
+    print('')
+    print('Target %.3fs per check; current cost %d.'
+          % (target, app.config['BCRYPT_LOG_ROUNDS']))
+    print('export BCRYPT_LOG_ROUNDS=%d' % cost)
+
+
+def _send_timed(count, connection, to):
+    started = time.time()
+    for i in range(count):
+        with connection() as conn:
+            conn.send(Message('Benchmark %d' % i, recipients=[to],
+                              html='<p>benchmark</p>',
+                              sender=app.config['MAIL_DEFAULT_SENDER']))
+    return time.time() - started
+
+
+@manager.option('-n', '--count', dest='count', type=int, default=200,
+                help='messages sent per run')
+@manager.option('--to', dest='to', default=None,
+                help='send to this address through the configured MAIL_* '
+                     'server instead of an in-process SMTP server')
+def mail_benchmark(count, to):
+    """Times sending with a new SMTP session per message vs the pool."""
+    from project.util import LocalSMTPServer
+
+    def run():
+        for name, connection in (('new session per message', mail.connect),
+                                 ('pooled sessions', mail_pool.connection)):
+            elapsed = _send_timed(count, connection,
+                                  to or 'benchmark@example.com')
+            print('%-24s %6.2fs %8.1f msg/s' % (name, elapsed,
+                                                count / elapsed))
+
+    if to:
+        run()
+    else:
+        with LocalSMTPServer():
+            run()
 
-    db.session.add(ResearchRole(description='Head Researcher'))
-    db.session.add(ResearchRole(description='Research Assistant'))
-    db.session.add(ResearchRole(description='Data Collection'))
-    db.session.add(ResearchRole(description='Experimentation'))
-    db.session.commit()
 
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,56 @@
+"""composite (human_id, date DESC, id DESC) indexes on record tables
+
+Revision ID: 3f2a9c1d7b4e
+Revises: None
+Create Date: 2026-10-18 11:16:53.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b4e'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Databases that ran this revision before the id column was added to
+# the indexes are brought up to date by e6c2a8f41b93.
+INDEXES = [
+    ('ix_employment_human_id_start_date_id', 'employment', 'start_date'),
+    ('ix_education_human_id_start_date_id', 'education', 'start_date'),
+    ('ix_publication_human_id_publication_date_id', 'publication',
+     'publication_date'),
+    ('ix_patent_human_id_issue_date_id', 'patent', 'issue_date'),
+    ('ix_certification_human_id_issue_date_id', 'certification',
+     'issue_date'),
+    ('ix_presentation_human_id_presentation_date_id', 'presentation',
+     'presentation_date'),
+    ('ix_research_human_id_start_date_id', 'research', 'start_date'),
+]
+
+
+def _existing(table):
+    # Indexes already built, e.g. without locking the table by
+    # `manage.py create_record_indexes` ahead of the upgrade.
+    inspector = sa.inspect(op.get_bind())
+    return set(index['name'] for index in inspector.get_indexes(table))
+
+
+def upgrade():
+    # Building an index here blocks writes to its table until the
+    # transaction commits; on large Postgres tables build them with
+    # `manage.py create_record_indexes` first.
+    for name, table, column in INDEXES:
+        if name not in _existing(table):
+            op.execute('CREATE INDEX %s ON %s (human_id, %s DESC, id DESC)'
+                       % (name, table, column))
+
+
+def downgrade():
+    for name, table, column in INDEXES:
+        # the (human_id, date DESC) index e6c2a8f41b93 puts back on the
+        # way down, if this revision had built that one
+        for index in (name, 'ix_%s_human_id_%s' % (table, column)):
+            if index in _existing(table):
+                op.drop_index(index, table)
@@ -0,0 +1,40 @@
+"""email outbox
+
+Revision ID: 52b8e0f4a6c1
+Revises: 3f2a9c1d7b4e
+Create Date: 2016-06-20 09:41:07.113582
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52b8e0f4a6c1'
+down_revision = '3f2a9c1d7b4e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=254), nullable=False),
+        sa.Column('sender', sa.String(length=254), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=False),
+        sa.Column('html', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.String(length=400), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_email_outbox_status_next_attempt_at', 'email_outbox',
+                    ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_status_next_attempt_at',
+                  table_name='email_outbox')
+    op.drop_table('email_outbox')
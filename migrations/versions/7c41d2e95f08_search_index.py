@@ -0,0 +1,53 @@
+"""full-text search index
+
+Revision ID: 7c41d2e95f08
+Revises: 52b8e0f4a6c1
+Create Date: 2016-06-27 14:03:52.671920
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c41d2e95f08'
+down_revision = '52b8e0f4a6c1'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table(
+        'search_document',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('record_type', sa.String(length=20), nullable=False),
+        sa.Column('record_id', sa.Integer(), nullable=False),
+        sa.Column('human_id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=200), nullable=True),
+        sa.Column('tsv', sa.Text().with_variant(postgresql.TSVECTOR(),
+                                                'postgresql'),
+                  nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('record_type', 'record_id',
+                            name='uq_search_document_record')
+    )
+    op.create_index('ix_search_document_human_id', 'search_document',
+                    ['human_id'])
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX ix_search_document_tsv ON search_document '
+                   'USING gin (tsv)')
+
+    op.create_table(
+        'search_posting',
+        sa.Column('term', sa.String(length=64), nullable=False),
+        sa.Column('record_type', sa.String(length=20), nullable=False),
+        sa.Column('record_id', sa.Integer(), nullable=False),
+        sa.Column('weight', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('term', 'record_type', 'record_id')
+    )
+    op.create_index('ix_search_posting_record', 'search_posting',
+                    ['record_type', 'record_id'])
+
+
+def downgrade():
+    op.drop_table('search_posting')
+    op.drop_table('search_document')
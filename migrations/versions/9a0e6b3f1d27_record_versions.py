@@ -0,0 +1,35 @@
+"""updated_at on record tables and per-user record versions
+
+Revision ID: 9a0e6b3f1d27
+Revises: 7c41d2e95f08
+Create Date: 2016-07-04 11:26:40.982114
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9a0e6b3f1d27'
+down_revision = '7c41d2e95f08'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+RECORD_TABLES = ['employment', 'education', 'publication', 'patent',
+                 'certification', 'presentation', 'research']
+
+
+def upgrade():
+    for table in RECORD_TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       nullable=True))
+    op.add_column('human', sa.Column('records_version', sa.Integer(),
+                                     nullable=False, server_default='0'))
+    op.add_column('human', sa.Column('records_updated_at', sa.DateTime(),
+                                     nullable=True))
+
+
+def downgrade():
+    op.drop_column('human', 'records_updated_at')
+    op.drop_column('human', 'records_version')
+    for table in RECORD_TABLES:
+        op.drop_column(table, 'updated_at')
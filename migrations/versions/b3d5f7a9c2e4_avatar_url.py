@@ -0,0 +1,28 @@
+"""stored identicon url per user
+
+Revision ID: b3d5f7a9c2e4
+Revises: 9a0e6b3f1d27
+Create Date: 2026-10-18 11:45:14.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b3d5f7a9c2e4'
+down_revision = '9a0e6b3f1d27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('human', sa.Column('avatar_url', sa.String(length=60),
+                                     nullable=True))
+    op.create_index('ix_human_avatar_url', 'human', ['avatar_url'])
+
+    # existing users get theirs from `python manage.py backfill_avatar_urls`,
+    # as it is keyed with the app's SECRET_KEY
+
+
+def downgrade():
+    op.drop_index('ix_human_avatar_url', 'human')
+    op.drop_column('human', 'avatar_url')
@@ -0,0 +1,61 @@
+"""add id DESC to the record list indexes
+
+Revision ID: e6c2a8f41b93
+Revises: b3d5f7a9c2e4
+Create Date: 2026-10-18 12:32:07.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e6c2a8f41b93'
+down_revision = 'b3d5f7a9c2e4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# (table, date column) of every record list; the indexes were
+# ix_<table>_human_id_<date> on (human_id, <date> DESC) and are rebuilt
+# as ix_<table>_human_id_<date>_id, ending in the id tiebreak too
+RECORD_DATES = [
+    ('employment', 'start_date'),
+    ('education', 'start_date'),
+    ('publication', 'publication_date'),
+    ('patent', 'issue_date'),
+    ('certification', 'issue_date'),
+    ('presentation', 'presentation_date'),
+    ('research', 'start_date'),
+]
+
+
+def _existing(table):
+    # Indexes already built, e.g. without locking the table by
+    # `manage.py create_record_indexes` ahead of the upgrade.
+    inspector = sa.inspect(op.get_bind())
+    return set(index['name'] for index in inspector.get_indexes(table))
+
+
+def upgrade():
+    # As in 3f2a9c1d7b4e, build them with `manage.py
+    # create_record_indexes` first on large Postgres tables.
+    for table, column in RECORD_DATES:
+        old = 'ix_%s_human_id_%s' % (table, column)
+        new = old + '_id'
+        existing = _existing(table)
+        if new not in existing:
+            op.execute('CREATE INDEX %s ON %s (human_id, %s DESC, id DESC)'
+                       % (new, table, column))
+        if old in existing:
+            op.drop_index(old, table)
+
+
+def downgrade():
+    for table, column in RECORD_DATES:
+        old = 'ix_%s_human_id_%s' % (table, column)
+        new = old + '_id'
+        existing = _existing(table)
+        if old not in existing:
+            op.execute('CREATE INDEX %s ON %s (human_id, %s DESC)'
+                       % (old, table, column))
+        if new in existing:
+            op.drop_index(new, table)
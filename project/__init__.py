@@ -12,7 +12,8 @@ from flask.ext.login import LoginManager
 from flask.ext.bcrypt import Bcrypt
 from flask_mail import Mail
 from flask.ext.debugtoolbar import DebugToolbarExtension
-from flask.ext.sqlalchemy import SQLAlchemy
+
+from project.routing import RoutingSQLAlchemy, forget_replica
 
 ################
 #### config ####
@@ -31,7 +32,7 @@ login_manager.init_app(app)
 bcrypt = Bcrypt(app)
 mail = Mail(app)
 toolbar = DebugToolbarExtension(app)
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 
 
 ####################
@@ -44,11 +45,80 @@ app.register_blueprint(main_blueprint)
 app.register_blueprint(user_blueprint)
 
 
+###################
+#### templates ####
+###################
+
+from project.cache import lookup_label
+
+app.jinja_env.globals['lookup_label'] = lookup_label
+
+
+################
+#### assets ####
+################
+
+from project.assets import fingerprint_url, bundle_urls, send_static_file
+
+app.url_defaults(fingerprint_url)
+app.view_functions['static'] = send_static_file
+app.jinja_env.globals['bundle_urls'] = bundle_urls
+
+
+#################
+#### routing ####
+#################
+
+app.teardown_request(forget_replica)
+
+
+##################
+#### profiles ####
+##################
+
+from project.profiles import forget_profile_documents
+
+app.teardown_request(forget_profile_documents)
+
+
+#####################
+#### compression ####
+#####################
+
+from project.compression import CompressionMiddleware
+
+app.wsgi_app = CompressionMiddleware(app)
+
+
+#################
+#### metrics ####
+#################
+
+from project.metrics import MetricsMiddleware, TimedTemplate, note_endpoint
+
+app.jinja_env.template_class = TimedTemplate
+app.before_request(note_endpoint)
+app.wsgi_app = MetricsMiddleware(app)
+
+
+#################
+#### queries ####
+#################
+
+from project.queries import start_request_log, check_request_queries
+
+app.before_request(start_request_log)
+app.after_request(check_request_queries)
+
+
 ####################
 #### flask-login ####
 ####################
 
-from project.models import User
+from project.cache import get_cached_user, user_cache
+
+user_cache.maxsize = app.config['USER_CACHE_SIZE']
+user_cache.ttl = app.config['USER_CACHE_TTL']
 
 login_manager.login_view = "user.login"
 login_manager.login_message_category = "danger"
@@ -56,7 +126,7 @@ login_manager.login_message_category = "danger"
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.filter(User.id == int(user_id)).first()
+    return get_cached_user(id=int(user_id))
 
 
 ########################
@@ -76,3 +146,12 @@ def page_not_found(error):
 @app.errorhandler(500)
 def server_error_page(error):
     return render_template("errors/500.html"), 500
+
+
+from project.passwords import PasswordHashBusy
+
+
+@app.errorhandler(PasswordHashBusy)
+def password_hash_busy(error):
+    return render_template("errors/503.html"), 503, {
+        'Retry-After': str(error.retry_after)}
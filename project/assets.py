@@ -0,0 +1,348 @@
+# project/assets.py
+
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # .br files are only written when brotli is installed
+    brotli = None
+
+
+# bundle name -> static files concatenated into it, in load order
+BUNDLES = OrderedDict([
+    ('app.css', ['main.css', 'bootstrap-editable.css']),
+    ('app.js', ['bootstrap-editable.js', 'main.js']),
+])
+
+# built files live in this subfolder of the static folder, with the
+# manifest mapping each logical name to its fingerprinted file
+DIST_FOLDER = 'dist'
+MANIFEST = 'manifest.json'
+
+# precompressed siblings, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+##################
+#### minifiers ###
+##################
+
+def _is_word(char):
+    return char.isalnum() or char in '_$\\' or ord(char) > 126
+
+
+# after one of these characters (or keywords) a '/' starts a regex
+# literal rather than a division
+_REGEX_AFTER = set('(,=:[!&|?{};~+-*%<>^\n')
+_REGEX_KEYWORDS = frozenset([
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new',
+    'void', 'delete', 'throw'])
+_LAST_WORD = re.compile(r'[\w$]+$')
+
+# a line break between these is kept, since automatic semicolon
+# insertion may depend on it
+_BREAK_BEFORE = set('}])+-"\'`')
+_BREAK_AFTER = set('{[(+-!~"\'`/')
+
+
+def _quoted(source, start, quote):
+    # end of the string or regex literal opened at `start`
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if quote == '/' and char == '[':
+            in_class = True
+        elif quote == '/' and char == ']':
+            in_class = False
+        elif char == quote and not in_class:
+            return i + 1
+        elif char == '\n' and quote != '`':
+            raise ValueError('unterminated literal at offset %d' % start)
+        i += 1
+    raise ValueError('unterminated literal at offset %d' % start)
+
+
+def minify_js(source):
+    """Strip comments and redundant whitespace from JavaScript.
+
+    A conservative jsmin-style pass: string and regex literals are copied
+    untouched, line breaks that automatic semicolon insertion may rely
+    on are kept, and /*! license comments survive.
+    """
+    out = []
+    pending = None
+    i = 0
+    length = len(source)
+
+    def last():
+        return out[-1][-1] if out else ''
+
+    def emit(token):
+        if pending is not None and out:
+            a, b = last(), token[0]
+            if pending == '\n' and (_is_word(a) or a in _BREAK_BEFORE) and \
+                    (_is_word(b) or b in _BREAK_AFTER):
+                out.append('\n')
+            elif (_is_word(a) and _is_word(b)) or \
+                    (a in '+-' and b in '+-') or (a == '/' and b in '/*'):
+                out.append(' ')
+        out.append(token)
+
+    while i < length:
+        char = source[i]
+        if char in u' \t\r\n\f\v\xa0\ufeff':
+            if char == '\n':
+                pending = '\n'
+            elif pending is None:
+                pending = ' '
+            i += 1
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            end = length if end == -1 else end
+            if source.startswith('//!', i):
+                emit(source[i:end])
+                out.append('\n')
+                pending = None
+            i = end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end == -1:
+                raise ValueError('unterminated comment at offset %d' % i)
+            comment = source[i:end + 2]
+            if comment.startswith('/*!'):
+                emit(comment)
+                out.append('\n')
+                pending = None
+            elif pending != '\n':
+                pending = '\n' if '\n' in comment else ' '
+            i = end + 2
+        elif char in '"\'`':
+            end = _quoted(source, i, char)
+            emit(source[i:end])
+            pending = None
+            i = end
+        elif char == '/' and (
+                not out or last() in _REGEX_AFTER or
+                (_LAST_WORD.search(out[-1]) and
+                 _LAST_WORD.search(out[-1]).group() in _REGEX_KEYWORDS)):
+            end = _quoted(source, i, '/')
+            while end < length and _is_word(source[end]):
+                end += 1
+            emit(source[i:end])
+            pending = None
+            i = end
+        else:
+            start = i
+            if _is_word(char):
+                while i < length and _is_word(source[i]):
+                    i += 1
+            else:
+                i += 1
+            emit(source[start:i])
+            pending = None
+    return ''.join(out)
+
+
+def minify_css(source):
+    """Strip comments and redundant whitespace from a stylesheet."""
+    out = []
+    pending = False
+    i = 0
+    length = len(source)
+    while i < length:
+        char = source[i]
+        if char.isspace():
+            pending = True
+            i += 1
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            if source.startswith('/*!', i):
+                out.append(source[i:end] + '\n')
+            pending = True
+            i = end
+            continue
+
+        if char in '"\'':
+            end = _quoted(source, i, char)
+        else:
+            end = i + 1
+        last = out[-1][-1] if out else '{'
+        if char == '}' and last == ';':
+            out.pop()
+        elif pending and last not in '{};,:\n' and char not in '{};,':
+            out.append(' ')
+        out.append(source[i:end])
+        pending = False
+        i = end
+    return ''.join(out) + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+###############
+#### build ####
+###############
+
+def _write(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    # mtime=0 keeps the output identical between builds
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _publish(dist, name, text):
+    """Write `text` under a content-hashed version of `name`, plus its
+    precompressed siblings, returning the path relative to dist."""
+    data = text.encode('utf-8')
+    base, ext = os.path.splitext(name)
+    digest = hashlib.sha1(data).hexdigest()[:12]
+    filename = '%s.%s%s' % (base, digest, ext)
+    path = os.path.join(dist, filename)
+    if not os.path.exists(path):
+        _write(path, data)
+    if not os.path.exists(path + '.gz'):
+        _write(path + '.gz', _gzip(data))
+    if brotli is not None and not os.path.exists(path + '.br'):
+        _write(path + '.br', brotli.compress(data, quality=11))
+    return filename
+
+
+def build(static_folder=None):
+    """Minify every bundle and its source files into the dist folder.
+
+    Returns the new manifest, logical name -> path in the static folder,
+    which is also written to dist/manifest.json.  Files from earlier
+    builds are left in place so pages rendered before a deploy keep
+    working.
+    """
+    static_folder = static_folder or current_app.static_folder
+    dist = os.path.join(static_folder, DIST_FOLDER)
+    if not os.path.isdir(dist):
+        os.makedirs(dist)
+
+    minified = {}
+    manifest = OrderedDict()
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            if source not in minified:
+                with io.open(os.path.join(static_folder, source),
+                             encoding='utf-8') as f:
+                    text = f.read()
+                minify = MINIFIERS[os.path.splitext(source)[1]]
+                minified[source] = minify(text)
+                manifest[source] = DIST_FOLDER + '/' + _publish(
+                    dist, source, minified[source])
+            parts.append(minified[source])
+        # ';' guards scripts that do not end their last statement
+        separator = ';\n' if bundle.endswith('.js') else '\n'
+        manifest[bundle] = DIST_FOLDER + '/' + _publish(
+            dist, bundle, separator.join(parts))
+
+    _write(os.path.join(dist, MANIFEST),
+           json.dumps(manifest, indent=2).encode('utf-8'))
+    manifest_cache.reset()
+    return manifest
+
+
+#################
+#### serving ####
+#################
+
+class ManifestCache(object):
+    """The built manifest, read once per process; empty when the assets
+    have not been built, in which case the source files are served."""
+
+    def __init__(self):
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._entries is None:
+            path = os.path.join(current_app.static_folder, DIST_FOLDER,
+                                MANIFEST)
+            try:
+                with io.open(path, encoding='utf-8') as f:
+                    entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                entries = {}
+            with self._lock:
+                self._entries = entries
+        return self._entries
+
+    def reset(self):
+        with self._lock:
+            self._entries = None
+
+
+manifest_cache = ManifestCache()
+
+
+def fingerprint_url(endpoint, values):
+    """url_defaults hook pointing url_for('static', filename=...) at the
+    built file for that name, when there is one."""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = manifest_cache.get().get(
+            values['filename'], values['filename'])
+
+
+def bundle_urls(name):
+    """URLs to load bundle `name`: the built bundle, or its source files
+    one by one before the assets have been built."""
+    if name in manifest_cache.get():
+        return [url_for('static', filename=name)]
+    return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+
+def send_static_file(filename):
+    """Static view serving built files with far-future caching and the
+    best precompressed sibling the client accepts."""
+    if not filename.startswith(DIST_FOLDER + '/'):
+        return current_app.send_static_file(filename)
+
+    max_age = current_app.config['ASSETS_MAX_AGE']
+    mimetype = mimetypes.guess_type(filename)[0] or \
+        'application/octet-stream'
+    folder = current_app.static_folder
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and \
+                os.path.isfile(os.path.join(folder, filename + suffix)):
+            response = send_from_directory(folder, filename + suffix,
+                                           mimetype=mimetype,
+                                           cache_timeout=max_age)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(folder, filename,
+                                       cache_timeout=max_age)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = \
+        'public, max-age=%d, immutable' % max_age
+    return response
@@ -0,0 +1,151 @@
+# project/avatars.py
+
+
+import binascii
+import colorsys
+import hashlib
+import hmac
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+from flask import current_app, send_from_directory, url_for
+
+
+# grid of the identicon; the left columns are mirrored onto the right
+GRID = 5
+
+# bumped if the drawing changes, so old cached images are not reused
+IDENTICON_VERSION = 1
+
+BACKGROUND = (240, 240, 240)
+
+# where the avatar view is mounted; part of the URL stored per user
+URL_PREFIX = '/avatar'
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{20}$')
+
+# static image shown for users whose URL has not been stored yet
+PLACEHOLDER = 'avatar-placeholder.png'
+
+
+def avatar_key(email):
+    """Identifier of a user's identicon.
+
+    Keyed with SECRET_KEY, so unlike a Gravatar hash it cannot be used
+    to confirm a guessed email address.
+    """
+    secret = current_app.config['SECRET_KEY'].encode('utf-8')
+    message = ('%d:%s' % (IDENTICON_VERSION, email.strip().lower()))
+    return hmac.new(secret, message.encode('utf-8'),
+                    hashlib.sha1).hexdigest()[:20]
+
+
+def avatar_url(email):
+    """The URL stored for a user; avatar_size() picks the image in it."""
+    return '%s/%s' % (URL_PREFIX, avatar_key(email))
+
+
+def placeholder_url():
+    """The placeholder shown until `manage.py backfill_avatar_urls` has
+    stored a user's URL; their identicon is only served once it has."""
+    return url_for('static', filename=PLACEHOLDER)
+
+
+def avatar_size(size):
+    """The smallest of AVATAR_SIZES that is at least `size` pixels."""
+    sizes = current_app.config['AVATAR_SIZES']
+    for available in sorted(sizes):
+        if available >= size:
+            return available
+    return max(sizes)
+
+
+#################
+#### drawing ####
+#################
+
+def _png(width, height, rows):
+    """A truecolour PNG of `rows`, each a bytes object of RGB triples."""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    raw = b''.join(b'\x00' + row for row in rows)
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                       8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 9)) +
+            chunk(b'IEND', b''))
+
+
+def identicon(key, size):
+    """A `size` pixel square PNG drawn from the hex digest `key`.
+
+    The first 15 bits of the key fill the left half of a 5x5 grid,
+    which is mirrored, and the last bytes choose the colour.
+    """
+    digest = bytearray(binascii.unhexlify(key))
+    half = (GRID + 1) // 2
+    cells = [[False] * GRID for row in range(GRID)]
+    for column in range(half):
+        for row in range(GRID):
+            bit = column * GRID + row
+            if digest[bit // 8] >> (bit % 8) & 1:
+                cells[row][column] = cells[row][GRID - 1 - column] = True
+
+    hue = ((digest[-2] << 8) | digest[-1]) / 65535.0
+    colour = tuple(int(value * 255) for value in
+                   colorsys.hls_to_rgb(hue, 0.45, 0.65))
+
+    cell = size // (GRID + 1)
+    margin = (size - cell * GRID) // 2
+    pixels = [bytearray(BACKGROUND) * size for row in range(size)]
+    for row in range(GRID):
+        for column in range(GRID):
+            if not cells[row][column]:
+                continue
+            x = margin + column * cell
+            for y in range(margin + row * cell, margin + (row + 1) * cell):
+                pixels[y][x * 3:(x + cell) * 3] = bytearray(colour) * cell
+    return _png(size, size, [bytes(row) for row in pixels])
+
+
+#################
+#### serving ####
+#################
+
+def avatar_path(key, size):
+    """Path of the cached image, whether or not it has been generated.
+
+    Images are named after everything that determines their content
+    (the key, the size and IDENTICON_VERSION), so a file once written
+    never changes and workers can share the directory.
+    """
+    name = '%s-%d-v%d.png' % (key, size, IDENTICON_VERSION)
+    return os.path.join(current_app.config['AVATAR_DIR'], name)
+
+
+def send_avatar(key, size):
+    """Response with the image, generated and cached on first use, that
+    browsers may cache for good."""
+    path = avatar_path(key, size)
+    if not os.path.exists(path):
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(identicon(key, size))
+        os.rename(tmp, path)
+
+    max_age = current_app.config['ASSETS_MAX_AGE']
+    response = send_from_directory(os.path.dirname(path),
+                                   os.path.basename(path),
+                                   mimetype='image/png',
+                                   cache_timeout=max_age)
+    response.headers['Cache-Control'] = \
+        'public, max-age=%d, immutable' % max_age
+    return response
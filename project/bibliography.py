@@ -0,0 +1,433 @@
+# project/bibliography.py
+
+
+import datetime
+import re
+import unicodedata
+from collections import namedtuple
+
+from flask import current_app
+
+from project import db
+from project.cache import lookup_rows
+from project.models import Publication
+
+
+# What an import did; `error` describes the malformed entry that stopped
+# it early, if one did.
+ImportReport = namedtuple('ImportReport', [
+    'imported', 'duplicates', 'invalid', 'error'])
+
+MONTHS = dict((name, number) for number, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct',
+     'nov', 'dec'], 1))
+
+
+#################
+#### parsing ####
+#################
+
+# LaTeX accent commands -> combining characters
+_ACCENTS = {
+    "'": u'\u0301', '`': u'\u0300', '^': u'\u0302', '"': u'\u0308',
+    '~': u'\u0303', '=': u'\u0304', '.': u'\u0307', 'c': u'\u0327',
+    'v': u'\u030c', 'u': u'\u0306', 'H': u'\u030b',
+}
+_ACCENT = re.compile(r'\\([\'`^"~=.cvuH])\s*\{?\s*([A-Za-z])\}?')
+_ESCAPE = re.compile(r'\\([&%$#_{}])')
+_COMMAND = re.compile(r'\\[A-Za-z]+\s*')
+
+
+def latex_to_text(value):
+    """Plain text of a BibTeX field: accents resolved, braces and other
+    commands dropped, whitespace collapsed."""
+    value = _ACCENT.sub(lambda m: m.group(2) + _ACCENTS[m.group(1)], value)
+    value = _ESCAPE.sub(r'\1', value)
+    value = _COMMAND.sub('', value)
+    value = value.replace('{', '').replace('}', '').replace('~', ' ')
+    return unicodedata.normalize('NFC', u' '.join(value.split()))
+
+
+def _chars(lines):
+    for line in lines:
+        for char in line:
+            yield char
+
+
+class _BibTeXReader(object):
+    """Character-level reader for parse_bibtex, one entry in memory at a
+    time."""
+
+    def __init__(self, lines):
+        self._chars = _chars(lines)
+        self._peeked = None
+        self.strings = dict((name, str(number))
+                            for name, number in MONTHS.items())
+
+    def next(self):
+        if self._peeked is not None:
+            char, self._peeked = self._peeked, None
+            return char
+        return next(self._chars, '')
+
+    def peek(self):
+        if self._peeked is None:
+            self._peeked = next(self._chars, '')
+        return self._peeked
+
+    def skip_space(self):
+        while self.peek() and self.peek().isspace():
+            self.next()
+
+    def word(self):
+        chars = []
+        while self.peek() and (self.peek().isalnum() or
+                               self.peek() in '_-:.+/\''):
+            chars.append(self.next())
+        return ''.join(chars)
+
+    def braced(self):
+        # the opening brace has been read
+        depth = 1
+        chars = []
+        while depth:
+            char = self.next()
+            if not char:
+                raise ValueError('unexpected end of file')
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if not depth:
+                    break
+            chars.append(char)
+        return ''.join(chars)
+
+    def quoted(self):
+        # the opening quote has been read; quotes inside braces are text
+        depth = 0
+        chars = []
+        while True:
+            char = self.next()
+            if not char:
+                raise ValueError('unexpected end of file')
+            if char == '"' and not depth:
+                return ''.join(chars)
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            chars.append(char)
+
+    def value(self):
+        # one or more parts joined with '#'
+        parts = []
+        while True:
+            self.skip_space()
+            char = self.peek()
+            if char == '{':
+                self.next()
+                parts.append(self.braced())
+            elif char == '"':
+                self.next()
+                parts.append(self.quoted())
+            else:
+                word = self.word()
+                parts.append(self.strings.get(word.lower(), word))
+            self.skip_space()
+            if self.peek() != '#':
+                return ''.join(parts)
+            self.next()
+
+    def fields(self, close):
+        fields = {}
+        while True:
+            self.skip_space()
+            if self.peek() in (close, ''):
+                self.next()
+                return fields
+            if self.peek() == ',':
+                self.next()
+                continue
+            name = self.word().lower()
+            self.skip_space()
+            if not name or self.next() != '=':
+                raise ValueError('expected "=" after field %r' % name)
+            fields[name] = self.value()
+
+
+def parse_bibtex(lines):
+    """Entries of a BibTeX file as (entry type, fields) pairs.
+
+    `lines` may be any iterable of text, such as an open file; only the
+    entry being read is held in memory.  @string macros are expanded,
+    @comment and @preamble blocks are skipped and field values are
+    converted to plain text.
+    """
+    reader = _BibTeXReader(lines)
+    while True:
+        char = reader.next()
+        if not char:
+            return
+        if char != '@':
+            continue
+        kind = reader.word().lower()
+        reader.skip_space()
+        opening = reader.next()
+        if opening not in '{(':
+            continue
+        close = '}' if opening == '{' else ')'
+
+        if kind in ('comment', 'preamble'):
+            if opening == '{':
+                reader.braced()
+            continue
+        if kind == 'string':
+            for name, value in reader.fields(close).items():
+                reader.strings[name] = value
+            continue
+
+        reader.skip_space()
+        reader.word()  # the citation key
+        reader.skip_space()
+        yield kind, dict((name, latex_to_text(value)) for name, value
+                         in reader.fields(close).items())
+
+
+_RIS_LINE = re.compile(r'^([A-Z][A-Z0-9])  -( (.*))?$')
+
+# RIS tags that may repeat; their values are collected in lists
+_RIS_LISTS = frozenset(['AU', 'A1', 'A2', 'ED', 'KW'])
+
+
+def parse_ris(lines):
+    """Entries of an RIS file as (TY value, fields) pairs, where repeated
+    tags such as AU hold lists.  Lines that are not tagged continue the
+    previous field."""
+    kind = None
+    fields = {}
+    last = None
+    for line in lines:
+        line = line.rstrip('\r\n').lstrip(u'\ufeff')
+        match = _RIS_LINE.match(line)
+        if match is None:
+            if kind is not None and last is not None and line.strip():
+                if last in _RIS_LISTS:
+                    fields[last][-1] += ' ' + line.strip()
+                else:
+                    fields[last] += ' ' + line.strip()
+            continue
+        tag, value = match.group(1), (match.group(3) or '').strip()
+        if tag == 'TY':
+            kind, fields, last = value.upper(), {}, None
+        elif tag == 'ER':
+            if kind is not None:
+                yield kind, fields
+            kind, fields, last = None, {}, None
+        elif kind is not None:
+            if tag in _RIS_LISTS:
+                fields.setdefault(tag, []).append(value)
+            elif tag not in fields:
+                fields[tag] = value
+            last = tag
+
+
+#################
+#### mapping ####
+#################
+
+# entry types -> PublicationCategory.category
+BIBTEX_CATEGORIES = {
+    'article': 'Peer-reviewed publications',
+    'book': 'Books - authoured',
+    'inproceedings': 'Works in progress',
+    'conference': 'Works in progress',
+    'incollection': 'Works in progress',
+    'inbook': 'Works in progress',
+}
+
+RIS_CATEGORIES = {
+    'JOUR': 'Peer-reviewed publications',
+    'JFULL': 'Peer-reviewed publications',
+    'BOOK': 'Books - authoured',
+    'EDBOOK': 'Books - edited',
+    'CHAP': 'Works in progress',
+    'CONF': 'Works in progress',
+    'CPAPER': 'Works in progress',
+    'VIDEO': 'Non-print materials',
+    'COMP': 'Non-print materials',
+}
+
+
+def _date(year, month=None, day=None):
+    try:
+        year = int(re.match(r'\s*(\d{4})', year or '').group(1))
+    except AttributeError:
+        return None
+    month = (month or '').strip().lower()
+    month = MONTHS.get(month[:3]) or (int(month) if month.isdigit() else 1)
+    day = int(day) if day and day.isdigit() else 1
+    try:
+        return datetime.datetime(year, month, day)
+    except ValueError:
+        return datetime.datetime(year, 1, 1)
+
+
+def _url(url, doi):
+    if url:
+        return url
+    if doi:
+        return 'https://doi.org/' + re.sub(r'^https?://(dx\.)?doi\.org/',
+                                           '', doi)
+    return None
+
+
+def _clip(value, length):
+    return value[:length] if value else None
+
+
+def _publication(title, authors, date, publisher, url, description,
+                 category):
+    return dict(
+        title=_clip(title, 100),
+        authors=_clip(authors, 250),
+        publication_date=date,
+        publisher=_clip(publisher, 250),
+        publication_url=_clip(url, 100),
+        description=_clip(description, 250),
+        category=category,
+    )
+
+
+def from_bibtex(kind, fields):
+    """Publication column values for a parsed BibTeX entry."""
+    authors = fields.get('author') or fields.get('editor')
+    if authors:
+        authors = ', '.join(name.strip() for name in
+                            re.split(r'\s+and\s+', authors))
+    category = BIBTEX_CATEGORIES.get(kind)
+    if kind == 'book' and not fields.get('author') and fields.get('editor'):
+        category = 'Books - edited'
+    return _publication(
+        title=fields.get('title'),
+        authors=authors or None,
+        date=_date(fields.get('year'), fields.get('month')),
+        publisher=(fields.get('journal') or fields.get('booktitle') or
+                   fields.get('publisher')),
+        url=_url(fields.get('url'), fields.get('doi')),
+        description=fields.get('abstract'),
+        category=category,
+    )
+
+
+def from_ris(kind, fields):
+    """Publication column values for a parsed RIS entry."""
+    authors = fields.get('AU') or fields.get('A1') or fields.get('ED')
+    date = (fields.get('PY') or fields.get('DA') or fields.get('Y1') or '')
+    parts = (date.split('/') + ['', ''])[:3]
+    return _publication(
+        title=fields.get('TI') or fields.get('T1') or fields.get('CT'),
+        authors=', '.join(authors) if authors else None,
+        date=_date(*parts),
+        publisher=(fields.get('JO') or fields.get('JF') or fields.get('T2') or
+                   fields.get('PB')),
+        url=_url(fields.get('UR'), fields.get('DO')),
+        description=fields.get('AB') or fields.get('N2'),
+        category=RIS_CATEGORIES.get(kind),
+    )
+
+
+FORMATS = {
+    'bibtex': (parse_bibtex, from_bibtex),
+    'ris': (parse_ris, from_ris),
+}
+
+
+def detect_format(filename, first_line=''):
+    """'bibtex' or 'ris' from the file name, else from its first line;
+    None if it is neither."""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in ('bib', 'bibtex'):
+        return 'bibtex'
+    if extension == 'ris':
+        return 'ris'
+    first_line = first_line.lstrip(u'\ufeff \t\r\n')
+    if first_line.startswith('@'):
+        return 'bibtex'
+    if first_line.startswith('TY  -'):
+        return 'ris'
+    return None
+
+
+###################
+#### importing ####
+###################
+
+def title_key(title, date):
+    """What two publications of one user must share to be duplicates: the
+    title without case, accents or punctuation, and the year."""
+    text = unicodedata.normalize('NFKD', title or u'')
+    text = u''.join(char for char in text
+                    if not unicodedata.combining(char)).lower()
+    words = u' '.join(re.findall(r'\w+', text, re.UNICODE))
+    return words, date.year if date else None
+
+
+def _insert(human_id, batch):
+    db.session.add_all([Publication(human_id=human_id, **values)
+                        for values in batch])
+    db.session.commit()
+
+
+def import_publications(human_id, lines, format, batch_size=None):
+    """Add the publications in `lines` to user `human_id`.
+
+    Entries are parsed and inserted as they are read, `batch_size` per
+    transaction, through the ORM so the search index and record versions
+    stay in step.  Entries without a title are counted as invalid, and
+    those whose title_key matches one of the user's publications (or an
+    earlier entry) as duplicates.  A malformed entry ends the import,
+    keeping the entries before it.
+    """
+    parse, convert = FORMATS[format]
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    categories = dict((row.label, row.id)
+                      for row in lookup_rows('publication_category'))
+    seen = set(title_key(title, date) for title, date in db.session.query(
+        Publication.title, Publication.publication_date)
+        .filter(Publication.human_id == human_id))
+
+    imported = duplicates = invalid = 0
+    error = None
+    batch = []
+    entries = parse(lines)
+    while True:
+        try:
+            kind, fields = next(entries)
+        except StopIteration:
+            break
+        except ValueError as e:
+            error = str(e)
+            break
+
+        values = convert(kind, fields)
+        if not values['title']:
+            invalid += 1
+            continue
+        key = title_key(values['title'], values['publication_date'])
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+
+        values['publication_category_id'] = categories.get(
+            values.pop('category'))
+        batch.append(values)
+        if len(batch) >= batch_size:
+            _insert(human_id, batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        _insert(human_id, batch)
+        imported += len(batch)
+    return ImportReport(imported, duplicates, invalid, error)
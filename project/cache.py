@@ -0,0 +1,295 @@
+# project/cache.py
+
+
+import hashlib
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from flask import current_app
+from sqlalchemy import event, literal, select, union_all
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class TTLCache(object):
+    """Thread-safe in-process cache whose entries expire after `ttl` seconds.
+
+    Values are produced by the `loader` passed to `get`, so callers never
+    have to handle a miss themselves.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, ttl=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+#######################
+#### lookup tables ####
+#######################
+
+# Lookup rows are cached as plain tuples rather than ORM instances so they
+# can be shared between requests without being bound to any one session.
+LookupRow = namedtuple('LookupRow', ['id', 'label'])
+LookupRow.__str__ = lambda self: self.label
+
+lookup_cache = TTLCache()
+
+
+def _lookup_tables():
+    from project.models import (
+        EducationalInstitutionType,
+        Gender,
+        PatentOffice,
+        PatentStatus,
+        PublicationCategory,
+        PresentationRole,
+        ResearchRole
+    )
+    return {
+        'educational_institution_type': (EducationalInstitutionType,
+                                         'description'),
+        'gender': (Gender, 'gender'),
+        'patent_office': (PatentOffice, 'name'),
+        'patent_status': (PatentStatus, 'status'),
+        'publication_category': (PublicationCategory, 'category'),
+        'presentation_role': (PresentationRole, 'description'),
+        'research_role': (ResearchRole, 'description'),
+    }
+
+
+def lookup_rows(table):
+    """All rows of lookup `table` as LookupRow tuples, ordered by id."""
+    def load():
+        model, label = _lookup_tables()[table]
+        column = getattr(model, label)
+        return tuple(LookupRow(*row) for row in
+                     model.query.with_entities(model.id, column)
+                     .order_by(model.id))
+
+    return lookup_cache.get(table, load,
+                            ttl=current_app.config['LOOKUP_CACHE_TTL'])
+
+
+def lookup_labels(table):
+    """Display labels of lookup `table` by row id.
+
+    Code labelling many rows should fetch this once rather than call
+    lookup_label per row, which reads the table again on every cache
+    miss.
+    """
+    return lookup_cache.get(table + ':labels',
+                            lambda: dict(lookup_rows(table)),
+                            ttl=current_app.config['LOOKUP_CACHE_TTL'])
+
+
+def lookup_label(table, id):
+    """Display label of lookup `table` row `id`, or '' if there is none."""
+    if id is None:
+        return ''
+    return lookup_labels(table).get(id, '')
+
+
+def lookups_version():
+    """Digest of every lookup table's labels, for cache keys of anything
+    showing them.  It is read with a single statement and cached like the
+    tables, so all workers agree on it within LOOKUP_CACHE_TTL of an
+    edit."""
+    from project import db
+
+    def load():
+        tables = _lookup_tables()
+        query = union_all(*[
+            select([literal(table), model.id, getattr(model, label)])
+            for table, (model, label) in sorted(tables.items())])
+        digest = hashlib.sha1()
+        for row in sorted(tuple(row) for row in db.session.execute(query)):
+            digest.update(repr(row).encode('utf-8'))
+        return digest.hexdigest()[:12]
+
+    return lookup_cache.get(':version', load,
+                            ttl=current_app.config['LOOKUP_CACHE_TTL'])
+
+
+def invalidate_lookups(table=None):
+    """Drop cached rows for `table`, or for every lookup table."""
+    if table is None:
+        lookup_cache.invalidate()
+    else:
+        lookup_cache.invalidate(table)
+        lookup_cache.invalidate(table + ':labels')
+        lookup_cache.invalidate(':version')
+
+
+###############
+#### users ####
+###############
+
+# User columns never served from the cache: writes in other processes
+# only reach this one's cache when an entry expires, and these decide
+# who may log in and what they may do.
+AUTH_FIELDS = ('password', 'admin', 'confirmed', 'confirmed_on')
+
+
+class IdentityCache(object):
+    """Bounded LRU cache of User column values keyed by id, whose entries
+    expire after `ttl` seconds.
+
+    Entries can also be found by email or username through secondary
+    indexes that are kept in step with the LRU order.  Writes invalidate
+    entries only in the process that made them; the ttl bounds how long
+    the other workers can serve an old copy.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_id = OrderedDict()
+        self._ids = {'email': {}, 'username': {}}
+        self._lock = threading.Lock()
+
+    def get(self, key, value):
+        with self._lock:
+            user_id = value if key == 'id' else self._ids[key].get(value)
+            entry = self._by_id.pop(user_id, None)
+            if entry is not None and entry[0] <= time.time():
+                self._discard_indexes(user_id, entry[1])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._by_id[user_id] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, values):
+        with self._lock:
+            self._discard(values['id'])
+            self._by_id[values['id']] = (time.time() + self.ttl, values)
+            for key, index in self._ids.items():
+                if values[key] is not None:
+                    index[values[key]] = values['id']
+            while len(self._by_id) > self.maxsize:
+                self._discard(next(iter(self._by_id)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def clear(self):
+        with self._lock:
+            self.hits = self.misses = 0
+            self._by_id.clear()
+            for index in self._ids.values():
+                index.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._by_id),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def _discard(self, user_id):
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None:
+            self._discard_indexes(user_id, entry[1])
+
+    def _discard_indexes(self, user_id, values):
+        for key, index in self._ids.items():
+            if index.get(values[key]) == user_id:
+                del index[values[key]]
+
+
+user_cache = IdentityCache()
+
+
+def get_cached_user(**criteria):
+    """The User matching one of `id`, `email` or `username`, or None.
+
+    Cached users are rebuilt from their column values and merged into the
+    current session without touching the database.  Their AUTH_FIELDS
+    are left expired, so reading one loads them fresh.
+    """
+    from project import db
+    from project.models import User
+
+    (key, value), = criteria.items()
+    values = user_cache.get(key, value)
+    if values is None:
+        user = User.query.filter(getattr(User, key) == value).first()
+        if user is not None:
+            user_cache.put(dict((attr.key, getattr(user, attr.key))
+                                for attr in User.__mapper__.column_attrs
+                                if attr.key not in AUTH_FIELDS))
+        return user
+
+    user = User.__mapper__.class_manager.new_instance()
+    for name, column_value in values.items():
+        set_committed_value(user, name, column_value)
+    make_transient_to_detached(user)
+    user = db.session.merge(user, load=False)
+    db.session.expire(user, AUTH_FIELDS)
+    return user
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_user_writes(session, flush_context):
+    from project.models import User
+
+    written = [obj.id for obj in session.dirty | session.deleted
+               if isinstance(obj, User)]
+    for user_id in written:
+        user_cache.invalidate(user_id)
+    session.info.setdefault('written_user_ids', set()).update(written)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written_users(session):
+    # Drop the users again in case another request re-cached them between
+    # the flush and the commit.
+    for user_id in session.info.pop('written_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written_users(session):
+    session.info.pop('written_user_ids', None)
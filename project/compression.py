@@ -0,0 +1,158 @@
+# project/compression.py
+
+
+import itertools
+import threading
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_options_header
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # responses are only gzipped without brotli
+    brotli = None
+
+
+class CompressionStats(object):
+    """Counters of what the compression middleware did in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.compressed = {}
+            self.skipped = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def record(self, encoding, bytes_in, bytes_out):
+        with self._lock:
+            self.compressed[encoding] = self.compressed.get(encoding, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'compressed': dict(self.compressed),
+                'skipped': self.skipped,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved': self.bytes_in - self.bytes_out,
+            }
+
+
+compression_stats = CompressionStats()
+
+
+def _gzip(data, level):
+    # wbits 16 + MAX_WBITS makes zlib write the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware compressing responses for clients that accept it.
+
+    Only complete 2xx responses with a Content-Length of at least
+    COMPRESS_MIN_SIZE and a COMPRESS_MIMETYPES content type are
+    compressed, with brotli when it is installed and accepted and gzip
+    otherwise.  Streamed responses (no Content-Length), responses that
+    already carry a Content-Encoding and ones marked no-transform pass
+    through untouched.  Settings are read from the app's config on each
+    request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+
+    def _compressible(self, environ, status, headers):
+        config = self.app.config
+        code = int(status.split(None, 1)[0])
+        length = headers.get('Content-Length', type=int)
+        return (environ.get('REQUEST_METHOD') != 'HEAD' and
+                200 <= code < 300 and code not in (204, 206) and
+                'Content-Encoding' not in headers and
+                'no-transform' not in headers.get('Cache-Control', '') and
+                parse_options_header(headers.get('Content-Type', ''))[0]
+                in config['COMPRESS_MIMETYPES'] and
+                length is not None and length >= config['COMPRESS_MIN_SIZE'])
+
+    def _encoding(self, environ):
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        config = self.app.config
+        if brotli is not None and accepted['br']:
+            return 'br', _brotli, config['COMPRESS_BROTLI_QUALITY']
+        if accepted['gzip']:
+            return 'gzip', _gzip, config['COMPRESS_LEVEL']
+        return None, None, None
+
+    def _pass(self, start_response, status, headers, exc_info, written,
+              app_iter):
+        # Send the body as the app produces it, so streams keep streaming.
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return ClosingIterator(itertools.chain(written, app_iter),
+                               getattr(app_iter, 'close', None))
+
+    def __call__(self, environ, start_response):
+        started = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            started[:] = [status, headers, exc_info]
+            return written.append
+
+        # Flask starts the response before handing back its body, so the
+        # headers are known here without consuming the body.
+        app_iter = self.wsgi_app(environ, capture)
+        status, headers, exc_info = started
+        headers = Headers(headers)
+
+        if not self._compressible(environ, status, headers):
+            compression_stats.skip()
+            return self._pass(start_response, status, headers, exc_info,
+                              written, app_iter)
+
+        # Whether this is compressed depends on Accept-Encoding, so
+        # caches must key on it either way.
+        vary = [value.strip() for value in headers.get('Vary', '').split(',')
+                if value.strip()]
+        if 'accept-encoding' not in [value.lower() for value in vary]:
+            headers['Vary'] = ', '.join(vary + ['Accept-Encoding'])
+
+        encoding, compress, level = self._encoding(environ)
+        if encoding is None:
+            compression_stats.skip()
+            return self._pass(start_response, status, headers, exc_info,
+                              written, app_iter)
+
+        try:
+            body = b''.join(written + list(app_iter))
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        data = compress(body, level)
+        compression_stats.record(encoding, len(body), len(data))
+
+        headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(len(data))
+        # The compressed bytes differ from the uncompressed ones, so an
+        # ETag for them can only be weak.
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return [data]
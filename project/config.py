@@ -3,16 +3,107 @@
 import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+
+def _int_env(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
 class BaseConfig(object):
     """Base configuration."""
     SECRET_KEY = 'bestSecretKeyEver'
     SECURITY_PASSWORD_SALT = 'bestSecurityPasswordSaltEver'
     DEBUG = True
-    BCRYPT_LOG_ROUNDS = 13
+    # bcrypt cost for new hashes; login rehashes passwords stored at any
+    # other cost.  `manage.py tune_bcrypt` suggests a value for this host
+    # that verifies in about BCRYPT_TARGET_SECONDS, but never below
+    # BCRYPT_MIN_LOG_ROUNDS.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 13))
+    BCRYPT_MIN_LOG_ROUNDS = 10
+    BCRYPT_TARGET_SECONDS = 0.25
+
+    # bcrypt runs on a process pool of this many processes (None: one per
+    # CPU) with up to PASSWORD_POOL_QUEUE more jobs waiting; beyond that,
+    # or after PASSWORD_HASH_TIMEOUT seconds, requests get a 503 asking the
+    # client to retry after PASSWORD_RETRY_AFTER seconds
+    PASSWORD_POOL_PROCESSES = None
+    PASSWORD_POOL_QUEUE = 16
+    PASSWORD_HASH_TIMEOUT = 5
+    PASSWORD_RETRY_AFTER = 1
     WTF_CSRF_ENABLED = True
     DEBUG_TB_ENABLED = False
     DEBUG_TB_INTERCEPT_REDIRECTS = False
 
+    # seconds lookup tables (gender, patent office, ...) stay cached
+    LOOKUP_CACHE_TTL = 3600
+
+    # users kept in the in-process identity cache, and seconds before one
+    # is re-read (writes in other processes show up after at most this)
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60
+
+    # record list pagination
+    RECORDS_PER_PAGE = 25
+    RECORDS_MAX_PER_PAGE = 100
+
+    # rendered record list fragments: in-process budget in bytes, plus an
+    # optional directory shared by the workers on a host and its budget
+    FRAGMENT_CACHE_BYTES = 32 * 1024 * 1024
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR')
+    FRAGMENT_CACHE_DIR_BYTES = 256 * 1024 * 1024
+
+    # seconds browsers may cache fingerprinted assets from `assets build`
+    ASSETS_MAX_AGE = 365 * 24 * 3600
+
+    # response compression: smallest body worth compressing, content
+    # types to compress and the gzip (1-9) and brotli (0-11) levels
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/plain',
+                          'application/json', 'application/javascript']
+    COMPRESS_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+
+    # identicon sizes in pixels, and where generated images are kept
+    AVATAR_SIZES = [32, 50, 64, 128, 256]
+    AVATAR_DIR = os.environ.get('AVATAR_DIR',
+                                os.path.join(basedir, 'avatars'))
+
+    # optional read model holding one document per user with their
+    # records embedded (project.profiles): a mongodb:// URL naming the
+    # database, 'memory://' to keep it in process, or unset to read
+    # everything from SQL
+    PROFILE_STORE_URL = os.environ.get('PROFILE_STORE_URL')
+
+    # publications inserted per transaction by the BibTeX/RIS import
+    IMPORT_BATCH_SIZE = 200
+
+    # records fetched per round trip when streaming a CV export
+    EXPORT_BATCH_SIZE = 500
+
+    # full-text search: Postgres text search configuration and page sizes
+    SEARCH_LANGUAGE = 'english'
+    SEARCH_PER_PAGE = 20
+    SEARCH_MAX_PER_PAGE = 100
+
+    # request metrics served at /metrics (project.metrics): a directory
+    # the workers of a host share their counters through (unset: each
+    # process serves its own), seconds between a worker's writes there,
+    # and the token Prometheus must send as a bearer token (unset: the
+    # endpoint is disabled)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # N+1 query detector (project.queries): 'off', 'warn' to warn of
+    # statements a request runs more than QUERY_REPEAT_LIMIT times and of
+    # views over their query_budget, or 'raise' to also fail requests
+    # over budget
+    QUERY_DETECTOR = os.environ.get('QUERY_DETECTOR', 'off')
+    QUERY_REPEAT_LIMIT = 2
+
+    # where links in emails sent outside a request (manage.py) point
+    BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5000')
+
     # mail settings
     MAIL_SERVER = os.environ['MAILGUN_SMTP_SERVER']
     MAIL_PORT = os.environ['MAILGUN_SMTP_PORT']
@@ -21,16 +112,63 @@ class BaseConfig(object):
     MAIL_PASSWORD = os.environ['MAILGUN_SMTP_PASSWORD']
     MAIL_DEFAULT_SENDER = os.environ['MAILGUN_SMTP_LOGIN']
 
+    # email outbox worker (manage.py mail_worker); times in seconds
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8
+    MAIL_OUTBOX_BACKOFF = 30
+    MAIL_OUTBOX_BACKOFF_MAX = 3600
+    MAIL_OUTBOX_LEASE = 300
+    MAIL_OUTBOX_POLL_INTERVAL = 5
+
+    # open SMTP connections kept for reuse, and seconds one may sit idle
+    # before it is checked with NOOP
+    MAIL_POOL_SIZE = 2
+    MAIL_POOL_MAX_IDLE = 60
+
     # db connection
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+    # connection pool (project.pool): connections kept open (None: the
+    # driver's default; SQLite files then get no pool) and extra ones
+    # allowed under load, seconds to wait for one before giving up,
+    # seconds after which one is replaced, whether each is checked with
+    # a SELECT 1 as it is handed out, and whether workers log their pool
+    # counters when they exit
+    SQLALCHEMY_POOL_SIZE = _int_env('DB_POOL_SIZE')
+    SQLALCHEMY_MAX_OVERFLOW = _int_env('DB_MAX_OVERFLOW')
+    SQLALCHEMY_POOL_TIMEOUT = _int_env('DB_POOL_TIMEOUT', 10)
+    SQLALCHEMY_POOL_RECYCLE = _int_env('DB_POOL_RECYCLE', 1800)
+    SQLALCHEMY_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+    SQLALCHEMY_POOL_REPORT_AT_EXIT = True
+    # read replicas for the read-only views (project.routing), as comma
+    # separated URLs in DATABASE_REPLICA_URLS.  A client reads from the
+    # primary for READ_YOUR_WRITES_SECONDS after it writes, and replicas
+    # more than REPLICA_MAX_LAG seconds behind, checked at most every
+    # REPLICA_LAG_CHECK_INTERVAL seconds, are skipped.
+    SQLALCHEMY_REPLICA_URIS = [
+        url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if url]
+    READ_YOUR_WRITES_SECONDS = 10
+    REPLICA_MAX_LAG = 5
+    REPLICA_LAG_CHECK_INTERVAL = 5
     # SQLALCHEMY_ECHO=True
 
+class DevelopmentConfig(BaseConfig):
+    """Development configuration."""
+    QUERY_DETECTOR = 'warn'
+
 class TestingConfig(BaseConfig):
     """Testing configuration."""
     TESTING = True
     DEBUG = True
     BCRYPT_LOG_ROUNDS = 1
     WTF_CSRF_ENABLED = False
+    LOOKUP_CACHE_TTL = 0
+    PROFILE_STORE_URL = None
+    SQLALCHEMY_REPLICA_URIS = []
+    SQLALCHEMY_POOL_REPORT_AT_EXIT = False
+    METRICS_DIR = None
+    METRICS_TOKEN = None
+    QUERY_DETECTOR = 'raise'
 
 class ProductionConfig(BaseConfig):
     """Production configuration."""
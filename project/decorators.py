@@ -1,10 +1,26 @@
 # project/decorators.py
 
+import datetime
+import hashlib
+import os
 from functools import wraps
 
-from flask import flash, redirect, url_for
+from flask import (
+    flash,
+    redirect,
+    url_for,
+    abort,
+    request,
+    session,
+    current_app,
+    g,
+    make_response
+)
 from flask.ext.login import current_user
 
+from project.records import page_stamps
+from project.routing import route_reads_to_replica
+
 
 def check_confirmed(func):
     @wraps(func)
@@ -14,4 +30,109 @@ def check_confirmed(func):
             return redirect(url_for('user.unconfirmed'))
         return func(*args, **kwargs)
 
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def check_admin(func):
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        if not current_user.admin:
+            abort(403)
+        return func(*args, **kwargs)
+
+    return decorated_function
+
+
+def read_replica(func):
+    """Serve GETs of the decorated read-only view from a read replica,
+    unless the client has just written; see project.routing."""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        if request.method == 'GET':
+            route_reads_to_replica()
+        return func(*args, **kwargs)
+
+    return decorated_function
+
+
+def query_budget(limit):
+    """Declare that the decorated view runs at most `limit` statements.
+
+    Checked by project.queries when QUERY_DETECTOR is on; the budget
+    covers what runs before the response is returned, not the body of a
+    streamed response.
+    """
+    def decorator(func):
+        func.query_budget = limit
+        return func
+
+    return decorator
+
+
+_templates_stamp = []
+
+
+def templates_stamp():
+    """Digest and newest modification time of the app's templates, so a
+    deploy that changes how pages render also changes their validators."""
+    if not _templates_stamp:
+        digest = hashlib.sha1()
+        newest = 0
+        folder = os.path.join(current_app.root_path,
+                              current_app.template_folder)
+        for root, dirs, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+                newest = max(newest, os.path.getmtime(path))
+        _templates_stamp.extend([digest.hexdigest(),
+                                 datetime.datetime.utcfromtimestamp(newest)])
+    return _templates_stamp
+
+
+def conditional_page(key, arg):
+    """Answer a GET of the decorated page with 304 while it is unchanged.
+
+    The page belongs to the user whose `key` column equals the view
+    argument `arg`.  Its strong ETag covers that user's version stamp,
+    the viewer's (the navigation shows their details), the URL and the
+    templates, so it is checked with one small query and without
+    loading any records.  Pages carrying flashed messages are always
+    rendered.  The owner's stamp is left in `g.page_owner` for the view.
+    """
+    def decorator(func):
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            owner, viewer = page_stamps(key, kwargs[arg], current_user.id)
+            g.page_owner = owner
+            if owner is None or viewer is None or session.get('_flashes'):
+                return func(*args, **kwargs)
+
+            digest, templates_modified = templates_stamp()
+            etag = hashlib.sha1('|'.join(str(part) for part in (
+                digest, request.full_path, owner.id, owner.version,
+                viewer.id, viewer.version)).encode('utf-8')).hexdigest()
+            last_modified = max(stamp for stamp in (
+                owner.updated_at, viewer.updated_at, templates_modified)
+                if stamp is not None).replace(microsecond=0)
+
+            if 'If-None-Match' in request.headers:
+                unchanged = request.if_none_match.contains_weak(etag)
+            else:
+                unchanged = (request.if_modified_since is not None and
+                             last_modified <= request.if_modified_since)
+            if unchanged:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return decorated_function
+
+    return decorator
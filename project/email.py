@@ -1,14 +1,299 @@
 # project/email.py
-from flask.ext.mail import Message
-from project import app, mail
-
-def send_email(to, subject, template):
-    msg = Message(
-        subject,
-        recipients=[to],
-        html=template,
-        sender=app.config['MAIL_DEFAULT_SENDER']
-    )
-
-    with app.app_context():
-        mail.send(msg)
+
+
+import datetime
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import current_app, render_template, url_for
+from flask.ext.mail import Message, BadHeaderError
+
+from project import app, db, mail
+from project.models import OutboxMessage
+from project.token import generate_confirmation_token
+
+
+def send_email(to, subject, template, commit=True):
+    """Queue an email in the outbox; `manage.py mail_worker` delivers it."""
+    db.session.add(OutboxMessage(
+        recipient=to,
+        sender=app.config['MAIL_DEFAULT_SENDER'],
+        subject=subject,
+        html=template
+    ))
+    if commit:
+        db.session.commit()
+
+
+def send_confirmation(email, commit=True):
+    """Queue the account activation email for `email`."""
+    token = generate_confirmation_token(email)
+    confirm_url = url_for('user.confirm_email', token=token, _external=True)
+    html = render_template('user/activate.html', confirm_url=confirm_url)
+    send_email(email, "Please confirm your email", html, commit=commit)
+
+
+###################
+#### transport ####
+###################
+
+# Errors that condemn one message but leave the SMTP session usable;
+# anything else is treated as a broken connection.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException,
+                  BadHeaderError, AssertionError)
+
+
+class SMTPPool(object):
+    """Thread-safe pool of open, authenticated Flask-Mail connections.
+
+    Connections are handed out by `connection()` and put back afterwards,
+    so consecutive batches skip the TCP/TLS handshake and login.  At most
+    `size` idle connections are kept; one idle for longer than `max_idle`
+    seconds is checked with NOOP before it is reused.  Both default to the
+    MAIL_POOL_SIZE and MAIL_POOL_MAX_IDLE settings.
+    """
+
+    def __init__(self, size=None, max_idle=None):
+        self._size = size
+        self._max_idle = max_idle
+        self.opened = 0
+        self.reused = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        if self._size is None:
+            return current_app.config['MAIL_POOL_SIZE']
+        return self._size
+
+    @property
+    def max_idle(self):
+        if self._max_idle is None:
+            return current_app.config['MAIL_POOL_MAX_IDLE']
+        return self._max_idle
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.opened += 1
+                    break
+                connection, last_used = self._idle.pop()
+            if time.time() - last_used < self.max_idle or \
+                    self._alive(connection):
+                with self._lock:
+                    self.reused += 1
+                return connection
+            self._close(connection)
+        return mail.connect().__enter__()
+
+    def _alive(self, connection):
+        if connection.host is None:
+            return True
+        try:
+            return connection.host.noop()[0] == 250
+        except (smtplib.SMTPException, IOError):
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, IOError):
+            pass
+
+    @contextmanager
+    def connection(self):
+        connection = self._checkout()
+        try:
+            yield connection
+        except Exception:
+            self._close(connection)
+            raise
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.time()))
+                return
+        self._close(connection)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, last_used in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'opened': self.opened,
+                'reused': self.reused,
+            }
+
+
+mail_pool = SMTPPool()
+
+
+class RateLimiter(object):
+    """Blocks in `wait()` so callers proceed at most `rate` times a second.
+
+    Shared between threads; a rate of None or 0 means no limit.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+################
+#### worker ####
+################
+
+# What one pass over the outbox did with the messages it claimed.
+DeliveryReport = namedtuple('DeliveryReport', ['sent', 'retrying', 'failed'])
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a message that failed `attempts`
+    times."""
+    config = current_app.config
+    return min(config['MAIL_OUTBOX_BACKOFF'] * 2 ** (attempts - 1),
+               config['MAIL_OUTBOX_BACKOFF_MAX'])
+
+
+def claim_batch(batch_size):
+    """Mark up to `batch_size` due messages as SENDING and return them.
+
+    A message is claimed with a conditional update on the next_attempt_at
+    value it was read with, so when several workers race for the same row
+    only one of them gets it.  The claim is a lease: if the worker dies
+    mid-send the message becomes due again once the lease runs out.
+    """
+    now = datetime.datetime.utcnow()
+    lease_until = now + datetime.timedelta(
+        seconds=current_app.config['MAIL_OUTBOX_LEASE'])
+    active = OutboxMessage.status.in_([OutboxMessage.PENDING,
+                                       OutboxMessage.SENDING])
+
+    due = db.session.query(OutboxMessage.id, OutboxMessage.next_attempt_at) \
+        .filter(active, OutboxMessage.next_attempt_at <= now) \
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id) \
+        .limit(batch_size).all()
+
+    claimed = []
+    for message_id, due_at in due:
+        count = OutboxMessage.query.filter(
+            OutboxMessage.id == message_id,
+            OutboxMessage.next_attempt_at == due_at,
+            active
+        ).update({
+            OutboxMessage.status: OutboxMessage.SENDING,
+            OutboxMessage.next_attempt_at: lease_until,
+            OutboxMessage.attempts: OutboxMessage.attempts + 1
+        }, synchronize_session=False)
+        if count:
+            claimed.append(message_id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(claimed)) \
+        .order_by(OutboxMessage.id).all()
+
+
+def _failed(message, error):
+    message.last_error = str(error)[:400]
+    if message.attempts >= current_app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+        message.status = OutboxMessage.FAILED
+    else:
+        message.status = OutboxMessage.PENDING
+        message.next_attempt_at = datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=backoff(message.attempts))
+
+
+def deliver_batch(batch_size=None, limiter=None):
+    """Claim one batch of due messages and send them over one connection.
+
+    The connection comes from `mail_pool`, and `limiter` (a RateLimiter)
+    paces the individual sends.
+    """
+    messages = claim_batch(
+        batch_size or current_app.config['MAIL_OUTBOX_BATCH_SIZE'])
+    if not messages:
+        return DeliveryReport(0, 0, 0)
+
+    try:
+        with mail_pool.connection() as connection:
+            for message in messages:
+                if limiter is not None:
+                    limiter.wait()
+                try:
+                    connection.send(Message(
+                        message.subject,
+                        recipients=[message.recipient],
+                        html=message.html,
+                        sender=message.sender
+                    ))
+                except MESSAGE_ERRORS as e:
+                    _failed(message, e)
+                else:
+                    message.status = OutboxMessage.SENT
+                    message.sent_at = datetime.datetime.utcnow()
+                    message.last_error = None
+    except Exception as e:
+        # Connecting (or the connection dropping) failed the whole batch;
+        # anything not yet settled goes back in the queue.
+        for message in messages:
+            if message.status == OutboxMessage.SENDING:
+                _failed(message, e)
+    db.session.commit()
+
+    statuses = [message.status for message in messages]
+    return DeliveryReport(statuses.count(OutboxMessage.SENT),
+                          statuses.count(OutboxMessage.PENDING),
+                          statuses.count(OutboxMessage.FAILED))
+
+
+def run_worker(batch_size=None, poll_interval=None, once=False, limiter=None):
+    """Deliver outbox messages until interrupted, or until none are due."""
+    if poll_interval is None:
+        poll_interval = current_app.config['MAIL_OUTBOX_POLL_INTERVAL']
+    while True:
+        report = deliver_batch(batch_size, limiter)
+        if any(report):
+            yield report
+        elif once:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
+def deliver_confirmations(emails, batch_size=None, limiter=None):
+    """Queue and deliver activation emails for `emails`, a batch at a time.
+
+    Each batch is queued and delivered before the next is queued, so the
+    confirmation tokens are still fresh when the mail is sent even when
+    `limiter` spreads the run over hours.  Yields a DeliveryReport per pass.
+    """
+    batch_size = batch_size or current_app.config['MAIL_OUTBOX_BATCH_SIZE']
+    for start in range(0, len(emails), batch_size):
+        for email in emails[start:start + batch_size]:
+            send_confirmation(email, commit=False)
+        db.session.commit()
+        yield deliver_batch(batch_size, limiter)
+    for report in run_worker(batch_size, once=True, limiter=limiter):
+        yield report
@@ -0,0 +1,104 @@
+# project/export.py
+
+
+import csv
+import datetime
+import json
+from collections import OrderedDict
+
+import six
+from flask import current_app
+
+from project.models import User, Employment, Education, Publication, Patent
+from project.records import RECORD_ROWS, iter_record_rows
+
+
+# section name -> model, in the order a CV lists them
+EXPORT_SECTIONS = OrderedDict([
+    ('employment', Employment),
+    ('education', Education),
+    ('publication', Publication),
+    ('patent', Patent),
+])
+
+USER_FIELDS = ('id', 'email', 'firstname', 'surname')
+
+# every field of every section, for the CSV header
+CSV_FIELDS = ['section'] + list(OrderedDict(
+    (field, None) for model in EXPORT_SECTIONS.values()
+    for field in RECORD_ROWS[model][0]._fields))
+
+
+def _value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _sections(human_id):
+    # (section, rows) pairs whose rows are only fetched when iterated
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    for section, model in EXPORT_SECTIONS.items():
+        yield section, iter_record_rows(model, human_id, batch_size)
+
+
+def export_jsonl(user):
+    """The user, then one JSON object per record, one per line."""
+    yield json.dumps(dict(
+        [('section', 'user')] +
+        [(field, getattr(user, field)) for field in USER_FIELDS])) + '\n'
+    for section, rows in _sections(user.id):
+        for row in rows:
+            yield json.dumps(dict(
+                [('section', section)] +
+                [(field, _value(value))
+                 for field, value in row._asdict().items()])) + '\n'
+
+
+def _csv_line(values):
+    buf = six.StringIO()
+    writer = csv.writer(buf)
+    if six.PY2:
+        writer.writerow([value.encode('utf-8')
+                         if isinstance(value, six.text_type) else value
+                         for value in values])
+        return buf.getvalue().decode('utf-8')
+    writer.writerow(values)
+    return buf.getvalue()
+
+
+def export_csv(user):
+    """One CSV row per record, with a column for every section's fields."""
+    yield _csv_line(CSV_FIELDS)
+    for section, rows in _sections(user.id):
+        for row in rows:
+            values = row._asdict()
+            yield _csv_line([section] + [
+                _value(values.get(field)) for field in CSV_FIELDS[1:]])
+
+
+def export_html(user):
+    """A standalone HTML CV, rendered as the records stream in."""
+    template = current_app.jinja_env.get_template('user/cv.html')
+    return template.generate(user=user, sections=_sections(user.id))
+
+
+# format -> (generator of text chunks, mimetype)
+EXPORT_FORMATS = {
+    'jsonl': (export_jsonl, 'application/x-ndjson'),
+    'csv': (export_csv, 'text/csv'),
+    'html': (export_html, 'text/html'),
+}
+
+
+def export_cv(human_id, format):
+    """Chunks of text making up the CV of user `human_id` in `format`.
+
+    Records are read section by section through server-side cursors and
+    written out as they arrive, so memory use does not grow with the
+    number of records.  Returns None if there is no such user.
+    """
+    user = User.query.get(human_id)
+    if user is None:
+        return None
+    return EXPORT_FORMATS[format][0](user)
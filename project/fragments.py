@@ -0,0 +1,297 @@
+# project/fragments.py
+
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, render_template
+from jinja2 import Markup
+
+from project import db
+from project.cache import lookups_version
+from project.models import User
+
+
+def _size(value):
+    return len(value.encode('utf-8'))
+
+
+class MemoryStore(object):
+    """In-process LRU of rendered fragments, bounded by their total size.
+
+    Keys are (template, human_id, version, variant) tuples.  Storing a
+    fragment drops any older version of the same (template, human_id,
+    variant), so superseded renders do not sit in the budget until they
+    age out.  Sizes are counted in UTF-8 bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        template, human_id, version, variant = key
+        with self._lock:
+            older = self._versions.get((template, human_id, variant))
+            if older is not None:
+                self._discard((template, human_id, older, variant))
+            self._discard(key)
+            self._entries[key] = value
+            self._versions[(template, human_id, variant)] = version
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        value = self._entries.pop(key, None)
+        if value is None:
+            return
+        self.bytes -= _size(value)
+        template, human_id, version, variant = key
+        if self._versions.get((template, human_id, variant)) == version:
+            del self._versions[(template, human_id, variant)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+
+class DiskStore(object):
+    """Fragments as files in `directory`, shared by every worker on a host.
+
+    Files are written to a temporary name and renamed into place, so
+    readers never see a partial fragment.  Once the directory grows past
+    `max_bytes` the least recently read files are removed until it is
+    back under 90% of the budget.
+    """
+
+    # re-measure the directory after this many writes, to account for
+    # what the other workers have written
+    RESCAN_EVERY = 100
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._bytes = None
+        self._writes = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.html')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                value = f.read()
+            os.utime(path, None)
+            return value
+        except (IOError, OSError):
+            return None
+
+    def put(self, key, value):
+        data = value.encode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, self._path(key))
+
+        with self._lock:
+            self._writes += 1
+            if self._bytes is None or self._writes % self.RESCAN_EVERY == 0:
+                self._bytes = self._scan()[1]
+            else:
+                self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.html'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        return files, total
+
+    def _evict(self):
+        files, total = self._scan()
+        for mtime, size, name in sorted(files):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.html'):
+                os.remove(os.path.join(self.directory, name))
+        with self._lock:
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bytes': self._bytes or 0,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+
+class FragmentCache(object):
+    """Rendered template fragments keyed by (template, human_id, version,
+    variant), where version is the owner's records_version and the
+    lookups_version of the labels shown.
+
+    Any write to a user's records, or edit of a lookup table, changes the
+    version, so stale fragments are never looked up again and simply age
+    out of the stores.  The
+    memory store is always used; FRAGMENT_CACHE_DIR adds a disk store
+    shared between workers behind it.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory = None
+        self.disk = None
+        self._lock = threading.Lock()
+
+    def _configure(self):
+        config = current_app.config
+        self.memory = MemoryStore(config['FRAGMENT_CACHE_BYTES'])
+        if config['FRAGMENT_CACHE_DIR']:
+            self.disk = DiskStore(config['FRAGMENT_CACHE_DIR'],
+                                  config['FRAGMENT_CACHE_DIR_BYTES'])
+
+    def get(self, key, render):
+        """The fragment for `key`, from a store or else from `render()`."""
+        if self.memory is None:
+            self._configure()
+
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self.memory.put(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        value = render()
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+        return value
+
+    def clear(self):
+        """Empty the stores and reset the counters."""
+        with self._lock:
+            self.hits = self.disk_hits = self.misses = 0
+        if self.memory is not None:
+            self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def reset(self):
+        """Forget the stores so the next use rebuilds them from config."""
+        self.clear()
+        self.memory = self.disk = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (float(self.hits + self.disk_hits) / lookups
+                             if lookups else 0.0),
+            }
+        if self.memory is not None:
+            stats['memory'] = self.memory.stats()
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+
+fragment_cache = FragmentCache()
+
+
+def records_version(human_id):
+    """The records_version of `human_id`, reusing the stamp conditional_page
+    already read for this request when there is one."""
+    stamp = getattr(g, 'page_owner', None)
+    if stamp is not None and stamp.id == human_id:
+        return stamp.version
+    return db.session.query(User.records_version) \
+        .filter_by(id=human_id).scalar()
+
+
+def render_fragment(template, human_id, variant='', load=None):
+    """Render `template` for `human_id` through the fragment cache.
+
+    `variant` tells apart renders of the same data, such as different
+    pages of a list.  `load` returns the template context and is only
+    called on a miss, so a hit costs no record queries at all.
+    """
+    version = '%s:%s' % (records_version(human_id), lookups_version())
+    key = (template, human_id, version, variant)
+
+    def render():
+        context = load() if load is not None else {}
+        return render_template(template, human_id=human_id, **context)
+
+    return Markup(fragment_cache.get(key, render))
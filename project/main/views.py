@@ -5,9 +5,39 @@
 #### imports ####
 #################
 
-from flask import render_template, Blueprint
+import hmac
+import os
+
+from flask import (
+    render_template,
+    Blueprint,
+    jsonify,
+    abort,
+    current_app,
+    request,
+    Response
+)
 from flask.ext.login import login_required
 
+from project import db
+from project.avatars import (
+    URL_PREFIX,
+    KEY_PATTERN,
+    avatar_path,
+    send_avatar
+)
+from project.cache import lookup_cache, user_cache
+from project.decorators import check_admin
+from project.compression import compression_stats
+from project.email import mail_pool
+from project.fragments import fragment_cache
+from project.metrics import collect, render
+from project.models import User
+from project.passwords import password_pool
+from project.pool import pool_stats
+from project.profiles import profile_store
+from project.routing import replica_set
+
 
 ################
 #### config ####
@@ -24,3 +54,51 @@ main_blueprint = Blueprint('main', __name__,)
 @login_required
 def home():
     return render_template('main/index.html')
+
+
+@main_blueprint.route(URL_PREFIX + '/<key>/<int:size>.png')
+def avatar(key, size):
+    if not KEY_PATTERN.match(key) or \
+            size not in current_app.config['AVATAR_SIZES']:
+        abort(404)
+    # only images of actual users are generated, so the cache cannot be
+    # filled with arbitrary keys
+    if not os.path.exists(avatar_path(key, size)) and not db.session.query(
+            User.query.filter_by(avatar_url=URL_PREFIX + '/' + key)
+            .exists()).scalar():
+        abort(404)
+    return send_avatar(key, size)
+
+
+@main_blueprint.route('/stats')
+@login_required
+@check_admin
+def stats():
+    """Counters of this process's caches and pools, as JSON."""
+    return jsonify(
+        lookup_cache=lookup_cache.stats(),
+        user_cache=user_cache.stats(),
+        fragment_cache=fragment_cache.stats(),
+        mail_pool=mail_pool.stats(),
+        compression=compression_stats.stats(),
+        password_pool=password_pool.stats(),
+        profile_store=profile_store.stats(),
+        replicas=replica_set.stats(),
+        db_pool=pool_stats.stats()
+    )
+
+
+@main_blueprint.route('/metrics')
+def metrics():
+    """Request and replica metrics of every worker, in the Prometheus text
+    format."""
+    # nothing is served until a token is configured
+    token = current_app.config['METRICS_TOKEN']
+    if not token or not hmac.compare_digest(
+            request.headers.get('Authorization', ''), 'Bearer ' + token):
+        abort(403)
+    samples = collect(current_app.config['METRICS_DIR'])
+    # a gauge, so this worker's measurement rather than a sum over them
+    samples.update(replica_set.lag_samples())
+    return Response(render(samples),
+                    mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,422 @@
+# project/metrics.py
+
+
+import atexit
+import errno
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# where the middleware keeps the current request's counters
+ENVIRON_KEY = 'project.metrics'
+
+# upper bounds of the histogram buckets, in seconds and bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# metric family -> (type, help), in the order they are exported
+FAMILIES = OrderedDict([
+    ('flaskdocstore_http_requests_total', (
+        'counter', 'Requests handled, by endpoint, method and status.')),
+    ('flaskdocstore_http_request_duration_seconds', (
+        'histogram', 'Time from receiving a request to sending the last '
+                     'byte of its response.')),
+    ('flaskdocstore_http_response_size_bytes', (
+        'histogram', 'Bytes of response body sent, after compression.')),
+    ('flaskdocstore_sql_statements_total', (
+        'counter', 'SQL statements executed while handling requests.')),
+    ('flaskdocstore_sql_seconds_total', (
+        'counter', 'Time spent executing SQL statements while handling '
+                   'requests.')),
+    ('flaskdocstore_template_render_seconds_total', (
+        'counter', 'Time spent rendering Jinja templates while handling '
+                   'requests, including any queries they ran.')),
+    ('flaskdocstore_replica_lag_seconds', (
+        'gauge', 'How far each read replica was behind the primary when '
+                 'the scraped worker last measured it; absent while '
+                 'unknown.')),
+    ('flaskdocstore_replica_reads_total', (
+        'counter', 'Requests whose reads were routed to each replica.')),
+    ('flaskdocstore_replica_errors_total', (
+        'counter', 'Failed attempts to measure the lag of each replica.')),
+    ('flaskdocstore_replica_sticky_total', (
+        'counter', 'Requests read from the primary because the client '
+                   'wrote within READ_YOUR_WRITES_SECONDS.')),
+    ('flaskdocstore_replica_unavailable_total', (
+        'counter', 'Requests read from the primary because no replica was '
+                   'close enough to it.')),
+])
+
+# sample name suffixes of a histogram, in export order
+_SUFFIXES = ('_bucket', '_sum', '_count')
+
+
+class RequestMetrics(object):
+    """Counters of the requests this process handled, as Prometheus
+    samples keyed by (family, suffix, labels).
+
+    Every sample only ever grows, so the samples of several workers are
+    combined by adding them up (see collect).  Counters inherited from a
+    parent process when a worker forks are dropped on its first request,
+    so they are not counted twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._started = time.time()
+        self._samples = {}
+        self._flushed_at = 0
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def _add(self, family, suffix, labels, amount):
+        key = (family, suffix, tuple(sorted(labels.items())))
+        self._samples[key] = self._samples.get(key, 0) + amount
+
+    def _observe(self, family, labels, value, buckets):
+        for bound in buckets:
+            if value <= bound:
+                self._add(family, '_bucket', dict(labels, le=repr(bound)), 1)
+        self._add(family, '_bucket', dict(labels, le='+Inf'), 1)
+        self._add(family, '_sum', labels, value)
+        self._add(family, '_count', labels, 1)
+
+    def _forked(self):
+        # drops the counters of the parent process; the lock must be held
+        if self._pid != os.getpid():
+            self._pid, self._started = os.getpid(), time.time()
+            self._samples.clear()
+            self._flushed_at = 0
+
+    def count(self, family, labels=None, amount=1):
+        """Add `amount` to counter `family`."""
+        with self._lock:
+            self._forked()
+            self._add(family, '', labels or {}, amount)
+
+    def observe_request(self, endpoint, method, status, seconds, size,
+                        sql_statements, sql_seconds, render_seconds):
+        endpoint = {'endpoint': endpoint or 'none'}
+        with self._lock:
+            self._forked()
+            self._add('flaskdocstore_http_requests_total', '',
+                      dict(endpoint, method=method, status=str(status)), 1)
+            self._observe('flaskdocstore_http_request_duration_seconds',
+                          endpoint, seconds, LATENCY_BUCKETS)
+            self._observe('flaskdocstore_http_response_size_bytes',
+                          endpoint, size, SIZE_BUCKETS)
+            self._add('flaskdocstore_sql_statements_total', '', endpoint,
+                      sql_statements)
+            self._add('flaskdocstore_sql_seconds_total', '', endpoint,
+                      sql_seconds)
+            self._add('flaskdocstore_template_render_seconds_total', '',
+                      endpoint, render_seconds)
+
+    def samples(self):
+        with self._lock:
+            return dict(self._samples)
+
+    def flush(self, directory, interval=0):
+        """Write this process's samples to its file in `directory`, if
+        `interval` seconds have passed since it last did.
+
+        Files are named after the pid and start time of the process, so a
+        restarted worker that is given an old pid does not overwrite the
+        counts of the one that exited.
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._flushed_at < interval:
+                return
+            self._flushed_at = now
+            name = _worker_file(self._pid, self._started)
+            samples = dict(self._samples)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        _write_samples(os.path.join(directory, name), samples)
+
+    def retire(self, directory):
+        """Fold this process's samples into the archive in `directory` and
+        remove its file; run when the worker exits.  Counting starts over
+        afterwards, so nothing is archived twice."""
+        self.flush(directory)
+        with self._lock:
+            name = _worker_file(self._pid, self._started)
+            self._samples.clear()
+        with _locked(directory):
+            _archive(directory, name)
+
+
+request_metrics = RequestMetrics()
+
+
+#################
+#### workers ####
+#################
+
+# counts of the workers that have exited, added up
+ARCHIVE = 'archive.json'
+
+_WORKER_FILE = re.compile(r'^metrics-(\d+)-(\d+)\.json$')
+
+
+def _worker_file(pid, started):
+    return 'metrics-%d-%d.json' % (pid, started)
+
+
+def _write_samples(path, samples):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump([[family, suffix, labels, value] for
+                   (family, suffix, labels), value in samples.items()], f)
+    os.rename(tmp, path)
+
+
+def _read_samples(path):
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return dict(((family, suffix, tuple(tuple(label) for label in labels)),
+                 value) for family, suffix, labels, value in stored)
+
+
+def _add_samples(total, samples):
+    for key, value in samples.items():
+        total[key] = total.get(key, 0) + value
+
+
+@contextmanager
+def _locked(directory):
+    # serialises changes to the archive between the workers
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _archive(directory, name):
+    # Adds a worker's file to the archive and removes it; the lock must
+    # be held.
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return
+    archive = os.path.join(directory, ARCHIVE)
+    samples = _read_samples(archive)
+    _add_samples(samples, _read_samples(path))
+    _write_samples(archive, samples)
+    os.remove(path)
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def collect(directory=None):
+    """The samples of every worker that has written to `directory`, added
+    together, or only this process's without one.
+
+    Files left by workers that are no longer running (killed before they
+    could retire) are folded into the archive, so the directory holds one
+    file per live worker plus the archive however often they restart.
+    """
+    if directory is None:
+        return request_metrics.samples()
+    request_metrics.flush(directory)
+    with _locked(directory):
+        for name in os.listdir(directory):
+            match = _WORKER_FILE.match(name)
+            if match and not _running(int(match.group(1))):
+                _archive(directory, name)
+        samples = {}
+        for name in os.listdir(directory):
+            if name == ARCHIVE or _WORKER_FILE.match(name):
+                _add_samples(samples,
+                             _read_samples(os.path.join(directory, name)))
+    return samples
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _number(value):
+    return '%d' % value if value == int(value) else repr(value)
+
+
+def _order(key):
+    family, suffix, labels = key
+    le = dict(labels).get('le')
+    return (tuple(label for label in labels if label[0] != 'le'),
+            _SUFFIXES.index(suffix) if suffix else 0,
+            float(le) if le else 0)
+
+
+def render(samples):
+    """`samples` in the Prometheus text exposition format."""
+    lines = []
+    for family, (kind, help) in FAMILIES.items():
+        keys = sorted((key for key in samples if key[0] == family),
+                      key=_order)
+        lines.append('# HELP %s %s' % (family, help))
+        lines.append('# TYPE %s %s' % (family, kind))
+        for key in keys:
+            family, suffix, labels = key
+            lines.append('%s%s{%s} %s' % (
+                family, suffix,
+                ','.join('%s="%s"' % (name, _escape(value))
+                         for name, value in labels),
+                _number(samples[key])))
+    return '\n'.join(lines) + '\n'
+
+
+###################
+#### recording ####
+###################
+
+def _current():
+    # the counters of the request being handled, if the middleware saw it
+    if has_request_context():
+        return request.environ.get(ENVIRON_KEY)
+    return None
+
+
+def note_endpoint():
+    """before_request hook naming the endpoint the request is counted
+    under."""
+    state = _current()
+    if state is not None:
+        state['endpoint'] = request.endpoint
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context,
+                   executemany):
+    if context is not None:
+        context._metrics_started = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context,
+                    executemany):
+    started = getattr(context, '_metrics_started', None)
+    state = _current()
+    if started is not None and state is not None:
+        state['sql_statements'] += 1
+        state['sql_seconds'] += time.time() - started
+
+
+class TimedTemplate(Template):
+    """Template counting the time it takes to render towards the request's
+    render time.  Templates rendered by another template (include, or a
+    fragment rendered from a template) are counted once, with the outer
+    one."""
+
+    def render(self, *args, **kwargs):
+        state = _current()
+        if state is None or state['rendering']:
+            return Template.render(self, *args, **kwargs)
+        state['rendering'] = True
+        started = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            state['render_seconds'] += time.time() - started
+            state['rendering'] = False
+
+
+class _Counted(object):
+    """Response body passing through the chunks of `app_iter` and calling
+    `done` with the bytes sent once it is closed."""
+
+    def __init__(self, app_iter, done):
+        self._app_iter = app_iter
+        self._done = done
+        self._size = 0
+
+    def __iter__(self):
+        for chunk in self._app_iter:
+            self._size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._app_iter, 'close'):
+                self._app_iter.close()
+        finally:
+            self._done(self._size)
+
+
+class MetricsMiddleware(object):
+    """WSGI middleware recording each request in request_metrics.
+
+    It wraps the compression middleware, so latency runs until the last
+    byte is handed to the server and sizes are those sent.  With
+    METRICS_DIR set, each worker writes its counters there at most every
+    METRICS_FLUSH_INTERVAL seconds, and folds them into the directory's
+    archive when it exits.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._exit_flush = False
+
+    def __call__(self, environ, start_response):
+        started = time.time()
+        state = environ[ENVIRON_KEY] = {
+            'endpoint': None, 'status': 500, 'sql_statements': 0,
+            'sql_seconds': 0.0, 'render_seconds': 0.0, 'rendering': False}
+
+        def capture(status, headers, exc_info=None):
+            state['status'] = int(status.split(None, 1)[0])
+            return start_response(status, headers, exc_info)
+
+        def done(size):
+            request_metrics.observe_request(
+                state['endpoint'], environ.get('REQUEST_METHOD'),
+                state['status'], time.time() - started, size,
+                state['sql_statements'], state['sql_seconds'],
+                state['render_seconds'])
+            self._flush()
+
+        try:
+            app_iter = self.wsgi_app(environ, capture)
+        except Exception:
+            done(0)
+            raise
+        return _Counted(app_iter, done)
+
+    def _flush(self):
+        directory = self.app.config['METRICS_DIR']
+        if not directory:
+            return
+        if not self._exit_flush:
+            self._exit_flush = True
+            atexit.register(request_metrics.retire, directory)
+        request_metrics.flush(directory,
+                              self.app.config['METRICS_FLUSH_INTERVAL'])
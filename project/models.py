@@ -1,8 +1,10 @@
 # project/models.py
 
 import datetime
-from project import db, bcrypt
-from hashlib import md5
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from project import db
+from project.passwords import generate_password_hash
+from project.avatars import avatar_url, avatar_size, placeholder_url
 # from sqlalchemy import Enum
 
 
@@ -65,15 +67,23 @@ class User(db.Model):
     gender_id = db.Column(db.Integer, db.ForeignKey('gender.id'))
     gender = db.relationship('Gender', backref=db.backref('human',
                                                           lazy='dynamic'))
+    # bumped, with records_updated_at, whenever the user or any of their
+    # records changes; see project.records
+    records_version = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    records_updated_at = db.Column(db.DateTime, nullable=True)
+    # identicon served by project.avatars, worked out once from the email
+    avatar_url = db.Column(db.String(60), nullable=True, index=True)
 
     def __init__(self, email, password, admin=False, confirmed=False,
                  confirmed_on=None):
         self.email = email
-        self.password = bcrypt.generate_password_hash(password)
+        self.password = generate_password_hash(password)
         self.admin = admin
         self.confirmed = confirmed
         self.confirmed_on = confirmed_on
         self.username = email
+        self.avatar_url = avatar_url(email)
 
     def is_authenticated(self):
         return True
@@ -88,8 +98,11 @@ class User(db.Model):
         return self.id
 
     def avatar(self, size):
-        return 'http://www.gravatar.com/avatar/%s?d=mm&s=%d' % (md5(
-            self.email.encode('utf-8')).hexdigest(), size)
+        # users created before the column existed have none until
+        # manage.py backfill_avatar_urls is run
+        if self.avatar_url is None:
+            return placeholder_url()
+        return '%s/%d.png' % (self.avatar_url, avatar_size(size))
 
     def __repr__(self):
         return '<email: {}'.format(self.email)
@@ -104,6 +117,9 @@ class Employment(db.Model):
     job_desc = db.Column(db.String(200), nullable=True)
     start_date = db.Column(db.DateTime, nullable=True)
     end_date = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return '<id {}'.format(self.id)
@@ -133,6 +149,9 @@ class Education(db.Model):
     educational_institution_type = db.relationship('EducationalInstitutionType',
                                                    backref=db.backref('education',
                                                                       lazy='dynamic'))
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return '<id: {}'.format(self.id)
@@ -163,6 +182,9 @@ class Publication(db.Model):
     publication_category = db.relationship('PublicationCategory',
                                            backref=db.backref('publication',
                                                               lazy='dynamic'))
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return self.id
@@ -200,6 +222,9 @@ class Patent(db.Model):
     patent_status_id = db.Column(db.Integer, db.ForeignKey('patent_status.id'))
     patent_status = db.relationship('PatentStatus', backref=db.backref('patent', lazy='dynamic'))
     patent_url = db.Column(db.String(100), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return self.status
@@ -215,6 +240,9 @@ class Certification(db.Model):
     issue_date = db.Column(db.DateTime, nullable=True)
     expiry_date = db.Column(db.DateTime, nullable=True)
     certification_url = db.Column(db.String(100), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return self.id
@@ -240,6 +268,9 @@ class Presentation(db.Model):
     presentation_date = db.Column(db.DateTime, nullable=True)
     presentation_role_id = db.Column(db.Integer, db.ForeignKey('presentation_role.id'))
     presentation_role = db.relationship('PresentationRole', backref=db.backref('presentation', lazy='dynamic'))
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return self.id
@@ -265,6 +296,105 @@ class Research(db.Model):
     end_date = db.Column(db.DateTime, nullable=True)
     research_role_id = db.Column(db.Integer, db.ForeignKey('research_role.id'))
     research_role = db.relationship('ResearchRole', backref=db.backref('research', lazy='dynamic'))
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
-        return self.id
\ No newline at end of file
+        return self.id
+
+
+# Every record table is listed per user, newest first and then by id, so
+# each gets a composite (human_id, <date> DESC, id DESC) index matching
+# that ORDER BY; keyset pages then read only the rows they show.
+RECORD_DATE_COLUMNS = (
+    (Employment, Employment.start_date),
+    (Education, Education.start_date),
+    (Publication, Publication.publication_date),
+    (Patent, Patent.issue_date),
+    (Certification, Certification.issue_date),
+    (Presentation, Presentation.presentation_date),
+    (Research, Research.start_date),
+)
+
+
+def record_index_name(model, date):
+    return 'ix_%s_human_id_%s_id' % (model.__tablename__, date.key)
+
+
+for _model, _date in RECORD_DATE_COLUMNS:
+    db.Index(record_index_name(_model, _date),
+             _model.human_id, _date.desc(), _model.id.desc())
+
+
+class OutboxMessage(db.Model):
+    """An email waiting to be delivered by the outbox worker."""
+    __tablename__ = "email_outbox"
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(254), nullable=False)
+    sender = db.Column(db.String(254), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # when the message is next due; while SENDING, when the worker's claim
+    # on it lapses
+    next_attempt_at = db.Column(db.DateTime, nullable=False,
+                                default=datetime.datetime.utcnow)
+    last_error = db.Column(db.String(400), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at',
+                 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return '<outbox {}: {}'.format(self.id, self.status)
+
+
+class SearchDocument(db.Model):
+    """One searchable record, maintained by project.search.
+
+    On Postgres `tsv` holds the weighted tsvector and is GIN indexed;
+    elsewhere it is left empty and SearchPosting rows are used instead.
+    """
+    __tablename__ = "search_document"
+    id = db.Column(db.Integer, primary_key=True)
+    record_type = db.Column(db.String(20), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    human_id = db.Column(db.Integer, nullable=False, index=True)
+    title = db.Column(db.String(200), nullable=True)
+    tsv = db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql'),
+                    nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('record_type', 'record_id',
+                            name='uq_search_document_record'),
+    )
+
+
+class SearchPosting(db.Model):
+    """Inverted index entry: `term` occurs in a record with `weight`."""
+    __tablename__ = "search_posting"
+    term = db.Column(db.String(64), primary_key=True)
+    record_type = db.Column(db.String(20), primary_key=True)
+    record_id = db.Column(db.Integer, primary_key=True)
+    weight = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_search_posting_record', 'record_type', 'record_id'),
+    )
+
+
+db.event.listen(
+    SearchDocument.__table__, 'after_create',
+    db.DDL('CREATE INDEX ix_search_document_tsv ON search_document '
+           'USING gin (tsv)').execute_if(dialect='postgresql'))
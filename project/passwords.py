@@ -0,0 +1,211 @@
+# project/passwords.py
+
+
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from flask.ext.bcrypt import Bcrypt
+
+
+class PasswordHashBusy(Exception):
+    """Raised instead of queueing a bcrypt job when the pool is saturated."""
+
+    def __init__(self, retry_after):
+        Exception.__init__(self, 'password hashing is at capacity')
+        self.retry_after = retry_after
+
+
+# Not bound to the app: the pool processes only need the hashing itself,
+# with the cost passed in explicitly.
+_bcrypt = Bcrypt()
+
+
+def _generate(password, rounds):
+    return _bcrypt.generate_password_hash(password, rounds)
+
+
+def _check(pw_hash, password):
+    return _bcrypt.check_password_hash(pw_hash, password)
+
+
+def _run_job(func, args):
+    # Runs in a pool process.  Exceptions are returned rather than raised
+    # so the completion callback fires for every job on Python 2 as well.
+    started = time.time()
+    try:
+        return True, func(*args), time.time() - started
+    except Exception as e:
+        return False, e, time.time() - started
+
+
+class PasswordPool(object):
+    """Runs bcrypt on a dedicated process pool, off the request thread.
+
+    At most PASSWORD_POOL_PROCESSES hashes run at once and at most
+    PASSWORD_POOL_QUEUE more wait for a free process; a job beyond that is
+    refused straight away with PasswordHashBusy rather than tying up the
+    request thread.  Each gunicorn worker starts its own pool on first use.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.submitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self._processes = 0
+        self._capacity = 0
+        self._latencies = deque(maxlen=1000)
+        self._hash_times = deque(maxlen=1000)
+
+    def _start(self):
+        config = current_app.config
+        self._reset()
+        self._processes = (config['PASSWORD_POOL_PROCESSES'] or
+                           multiprocessing.cpu_count())
+        self._capacity = self._processes + config['PASSWORD_POOL_QUEUE']
+        self._pool = multiprocessing.Pool(self._processes)
+        self._pid = os.getpid()
+
+    def _admit(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if self.in_flight >= self._capacity:
+                self.rejected += 1
+                raise PasswordHashBusy(
+                    current_app.config['PASSWORD_RETRY_AFTER'])
+            self.in_flight += 1
+            self.submitted += 1
+            return self._pool
+
+    def _done(self, submitted_at, result):
+        with self._lock:
+            self.in_flight -= 1
+            self._latencies.append(time.time() - submitted_at)
+            self._hash_times.append(result[2])
+
+    def run(self, func, *args):
+        pool = self._admit()
+        submitted_at = time.time()
+        job = pool.apply_async(
+            _run_job, (func, args),
+            callback=lambda result: self._done(submitted_at, result))
+        try:
+            ok, value, elapsed = job.get(
+                current_app.config['PASSWORD_HASH_TIMEOUT'])
+        except multiprocessing.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise PasswordHashBusy(current_app.config['PASSWORD_RETRY_AFTER'])
+        if not ok:
+            raise value
+        return value
+
+    def close(self):
+        """Stop the pool; the next job starts a new one with fresh stats."""
+        with self._lock:
+            pool, pid = self._pool, self._pid
+            self._pool = self._pid = None
+        if pool is not None and pid == os.getpid():
+            pool.terminate()
+            pool.join()
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            hash_times = list(self._hash_times)
+            return {
+                'processes': self._processes,
+                'in_flight': self.in_flight,
+                'queue_depth': max(0, self.in_flight - self._processes),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'latency_avg': (sum(latencies) / len(latencies)
+                                if latencies else 0.0),
+                'latency_p95': (latencies[int(len(latencies) * 0.95)]
+                                if latencies else 0.0),
+                'latency_max': latencies[-1] if latencies else 0.0,
+                'hash_time_avg': (sum(hash_times) / len(hash_times)
+                                  if hash_times else 0.0),
+            }
+
+
+password_pool = PasswordPool()
+
+
+def generate_password_hash(password):
+    """bcrypt hash of `password` at the configured BCRYPT_LOG_ROUNDS."""
+    return password_pool.run(_generate, password, policy_cost())
+
+
+def check_password_hash(pw_hash, password):
+    return password_pool.run(_check, pw_hash, password)
+
+
+##############
+#### cost ####
+##############
+
+# bcrypt accepts costs 4 to 31 and raises anything lower to 4.
+MIN_COST = 4
+MAX_COST = 31
+
+_COST = re.compile(r'^\$2[abxy]?\$(\d\d)\$')
+
+
+def policy_cost():
+    """The cost new hashes are made with, as bcrypt will actually apply it."""
+    return min(max(current_app.config['BCRYPT_LOG_ROUNDS'], MIN_COST),
+               MAX_COST)
+
+
+def hash_cost(pw_hash):
+    """The cost `pw_hash` was made with, or None if it is not bcrypt."""
+    match = _COST.match(pw_hash or '')
+    return int(match.group(1)) if match else None
+
+
+def needs_rehash(pw_hash):
+    return hash_cost(pw_hash) != policy_cost()
+
+
+def time_cost(cost, samples=3):
+    """Median seconds this host takes to hash a password at `cost`."""
+    pw_hash = _bcrypt.generate_password_hash('benchmark', cost)
+    times = []
+    for i in range(samples):
+        started = time.time()
+        _check(pw_hash, 'benchmark')
+        times.append(time.time() - started)
+    return sorted(times)[len(times) // 2]
+
+
+def tune_cost(target, min_cost, samples=3):
+    """Pick the highest cost that verifies within `target` seconds here.
+
+    Costs are timed upwards from MIN_COST until one takes longer than
+    `target`; each step doubles the work, so that is never more than one
+    slow measurement.  Returns the chosen cost, never below `min_cost`,
+    and the (cost, seconds) timings it was chosen from.
+    """
+    timings = []
+    chosen = min_cost
+    for cost in range(MIN_COST, MAX_COST + 1):
+        seconds = time_cost(cost, samples)
+        timings.append((cost, seconds))
+        if seconds > target:
+            break
+        chosen = max(cost, min_cost)
+    return chosen, timings
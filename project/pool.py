@@ -0,0 +1,246 @@
+# project/pool.py
+
+
+import atexit
+import sys
+import threading
+import time
+
+import sqlalchemy
+from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.util import get_cls_kwargs
+
+
+# upper bounds, in seconds, of the checkout latency histogram
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# create_engine options that configure the pool, by Pool argument name
+POOL_OPTIONS = {
+    'pool_size': 'pool_size',
+    'max_overflow': 'max_overflow',
+    'pool_timeout': 'timeout',
+    'pool_recycle': 'recycle',
+}
+
+
+class PoolStats(object):
+    """Counters of the connection pools of this process, by database.
+
+    Checkout latency covers waiting for a free connection, opening a new
+    one and the pre-ping, so it shows both pool exhaustion and a slow
+    database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._counters = {}
+
+    def _new_counters(self):
+        return {
+            'checkouts': 0,
+            'checkout_seconds': 0.0,
+            'checkout_seconds_max': 0.0,
+            'checkout_buckets': [0] * (len(CHECKOUT_BUCKETS) + 1),
+            'timeouts': 0,
+            'in_use': 0,
+            'connects': 0,
+            'invalidations': 0,
+            'ping_failures': 0,
+        }
+
+    def _count(self, label, name, amount=1):
+        with self._lock:
+            counters = self._counters.setdefault(label, self._new_counters())
+            counters[name] += amount
+
+    def register(self, label, pool):
+        # the latest pool for a database; disposing an engine replaces it
+        with self._lock:
+            self._pools[label] = pool
+            self._counters.setdefault(label, self._new_counters())
+
+    def checked_out(self, label, seconds):
+        with self._lock:
+            counters = self._counters.setdefault(label, self._new_counters())
+            counters['checkouts'] += 1
+            counters['in_use'] += 1
+            counters['checkout_seconds'] += seconds
+            counters['checkout_seconds_max'] = max(
+                counters['checkout_seconds_max'], seconds)
+            for index, bound in enumerate(CHECKOUT_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(CHECKOUT_BUCKETS)
+            counters['checkout_buckets'][index] += 1
+
+    def timed_out(self, label):
+        self._count(label, 'timeouts')
+
+    def in_use(self, label, change):
+        self._count(label, 'in_use', change)
+
+    def connected(self, label):
+        self._count(label, 'connects')
+
+    def invalidated(self, label):
+        self._count(label, 'invalidations')
+
+    def ping_failed(self, label):
+        self._count(label, 'ping_failures')
+
+    def clear(self):
+        with self._lock:
+            self._pools.clear()
+            self._counters.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for label, counters in self._counters.items():
+                counters = dict(counters, checkout_buckets=list(
+                    counters['checkout_buckets']))
+                checkouts = counters['checkouts']
+                counters['checkout_seconds_avg'] = (
+                    counters['checkout_seconds'] / checkouts
+                    if checkouts else 0.0)
+                pool = self._pools.get(label)
+                if pool is not None:
+                    counters['pool'] = type(pool).__name__
+                    counters['status'] = pool.status()
+                stats[label] = counters
+            return stats
+
+
+pool_stats = PoolStats()
+
+
+def report(out=None):
+    """Write a line per database with its pool counters, for the logs
+    when a worker exits."""
+    out = out or sys.stderr
+    for label, counters in sorted(pool_stats.stats().items()):
+        out.write(
+            'db pool %s: %d checkouts (avg %.1fms, max %.1fms), %d timeouts, '
+            '%d in use, %d connects, %d invalidations, %d ping failures\n' % (
+                label, counters['checkouts'],
+                counters['checkout_seconds_avg'] * 1000,
+                counters['checkout_seconds_max'] * 1000,
+                counters['timeouts'], counters['in_use'],
+                counters['connects'], counters['invalidations'],
+                counters['ping_failures']))
+
+
+_report_registered = []
+
+
+def report_at_exit():
+    """Run report() when the process exits; only registered once."""
+    if not _report_registered:
+        _report_registered.append(True)
+        atexit.register(report)
+
+
+######################
+#### instrumented ####
+######################
+
+class InstrumentedPool(object):
+    """Mixin timing checkouts of the pool class it is combined with; see
+    instrumented_pool_class."""
+
+    label = None
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedPool, self).__init__(*args, **kwargs)
+        pool_stats.register(self.label, self)
+
+    def _timed(self, checkout):
+        started = time.time()
+        try:
+            connection = checkout()
+        except sqlalchemy.exc.TimeoutError:
+            pool_stats.timed_out(self.label)
+            raise
+        pool_stats.checked_out(self.label, time.time() - started)
+        return connection
+
+    def connect(self):
+        return self._timed(super(InstrumentedPool, self).connect)
+
+    def unique_connection(self):
+        return self._timed(super(InstrumentedPool, self).unique_connection)
+
+
+def _ping(label):
+    def ping(dbapi_connection, connection_record, connection_proxy):
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            pool_stats.ping_failed(label)
+            # the pool throws the connection away and tries another
+            raise sqlalchemy.exc.DisconnectionError()
+    return ping
+
+
+def _listen(cls, label):
+    # Listeners on the class are run for each of its pools; the label
+    # is bound here, as the events are not told which pool fired them.
+    def checked_in(dbapi_connection, connection_record):
+        pool_stats.in_use(label, -1)
+
+    def connected(dbapi_connection, connection_record):
+        pool_stats.connected(label)
+
+    def invalidated(dbapi_connection, connection_record, exception):
+        pool_stats.invalidated(label)
+
+    event.listen(cls, 'checkin', checked_in)
+    event.listen(cls, 'connect', connected)
+    event.listen(cls, 'invalidate', invalidated)
+
+
+_pool_classes = {}
+_pool_classes_lock = threading.Lock()
+
+
+def instrumented_pool_class(base, label, pre_ping):
+    """Subclass of the Pool class `base` reporting to pool_stats under
+    `label` and, with `pre_ping`, checking each connection with a
+    SELECT 1 as it is checked out, so ones dropped by the server or a
+    failover are replaced before use."""
+    key = (base, label, pre_ping)
+    with _pool_classes_lock:
+        if key not in _pool_classes:
+            cls = type('Instrumented' + base.__name__,
+                       (InstrumentedPool, base), {'label': label})
+            _listen(cls, label)
+            if pre_ping:
+                event.listen(cls, 'checkout', _ping(label))
+            _pool_classes[key] = cls
+        return _pool_classes[key]
+
+
+class InstrumentedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose engines use instrumented pools configured
+    from SQLALCHEMY_POOL_* settings."""
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        base = options.get('poolclass') or \
+            info.get_dialect().get_pool_class(info)
+        options['poolclass'] = instrumented_pool_class(
+            base, info.__to_string__(hide_password=True),
+            app.config['SQLALCHEMY_POOL_PRE_PING'])
+        # Settings the pool does not take (a NullPool has no size, say)
+        # are dropped rather than rejected by create_engine.
+        accepted = get_cls_kwargs(base)
+        for option, argument in POOL_OPTIONS.items():
+            if option in options and argument not in accepted:
+                del options[option]
+        if app.config['SQLALCHEMY_POOL_REPORT_AT_EXIT']:
+            report_at_exit()
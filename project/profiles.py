@@ -0,0 +1,403 @@
+# project/profiles.py
+
+
+import copy
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+try:
+    import pymongo
+    from pymongo.errors import BulkWriteError, PyMongoError
+except ImportError:  # only the in-process store works without pymongo
+    pymongo = None
+    PyMongoError = None
+
+from project import db
+from project.cache import lookup_label
+from project.fragments import records_version
+from project.models import User, Employment, Education, Publication, Patent
+from project.records import (
+    AcademicRecord,
+    RECORD_ROWS,
+    RECORD_DATES,
+    record_columns,
+    record_labels,
+    record_row,
+    load_academic_record,
+    written_owners
+)
+
+
+# document key -> model of the records embedded under it
+PROFILE_SECTIONS = OrderedDict([
+    ('employment', Employment),
+    ('education', Education),
+    ('publications', Publication),
+    ('patents', Patent),
+])
+
+SECTION_OF = dict((model, section)
+                  for section, model in PROFILE_SECTIONS.items())
+
+# User columns copied into the document; never the password
+PROFILE_USER_FIELDS = ('id', 'email', 'username', 'firstname', 'surname',
+                       'about_me', 'birthdate', 'gender_id', 'avatar_url')
+
+COLLECTION = 'profiles'
+
+# errors from the document store that reads and writes survive
+STORE_ERRORS = (PyMongoError,) if pymongo is not None else ()
+
+
+##################
+#### building ####
+##################
+
+def build_profiles(human_ids, session=None):
+    """Profile documents of the users `human_ids`, by id.
+
+    Each holds the user's columns, their records newest first as in
+    record_rows, and every lookup resolved to its label, stamped with
+    the user's records_version.  One query for the users and one per
+    record type, however many users are asked for; ids of users that do
+    not exist are left out.
+    """
+    session = session or db.session
+    documents = OrderedDict()
+    if not human_ids:
+        return documents
+
+    columns = [getattr(User, field) for field in PROFILE_USER_FIELDS]
+    for values in session.query(User.records_version, *columns) \
+            .filter(User.id.in_(list(human_ids))).order_by(User.id):
+        user = dict(zip(PROFILE_USER_FIELDS, values[1:]))
+        user['gender'] = lookup_label('gender', user['gender_id'])
+        document = {'_id': user['id'], 'version': values[0], 'user': user}
+        for section in PROFILE_SECTIONS:
+            document[section] = []
+        documents[user['id']] = document
+    if not documents:
+        return documents
+
+    for section, model in PROFILE_SECTIONS.items():
+        date = RECORD_DATES[model]
+        query = session.query(model.human_id, *record_columns(model)) \
+            .filter(model.human_id.in_(list(documents))) \
+            .order_by(model.human_id, date.desc(), model.id.desc())
+        labels = record_labels(model)
+        for values in query:
+            row = record_row(model, values[1:], labels)
+            documents[values[0]][section].append(dict(row._asdict()))
+    return documents
+
+
+def document_rows(document, model):
+    """The `model` records of a profile document as row tuples."""
+    row_type = RECORD_ROWS[model][0]
+    return tuple(row_type(*[row.get(field) for field in row_type._fields])
+                 for row in document[SECTION_OF[model]])
+
+
+def document_user(document):
+    """A transient User holding the columns stored in a profile document,
+    for templates; it is not attached to the session."""
+    user = User.__mapper__.class_manager.new_instance()
+    for field in PROFILE_USER_FIELDS:
+        set_committed_value(user, field, document['user'].get(field))
+    return user
+
+
+################
+#### stores ####
+################
+
+class MemoryStore(object):
+    """Profile documents kept in this process, for tests and single
+    process deployments."""
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def get(self, human_id):
+        with self._lock:
+            return copy.deepcopy(self._documents.get(human_id))
+
+    def put(self, documents):
+        with self._lock:
+            for document in documents:
+                stored = self._documents.get(document['_id'])
+                if stored is None or stored['version'] <= document['version']:
+                    self._documents[document['_id']] = copy.deepcopy(document)
+
+    def delete(self, human_ids):
+        with self._lock:
+            for human_id in human_ids:
+                self._documents.pop(human_id, None)
+
+    def ids(self):
+        with self._lock:
+            return list(self._documents)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+class MongoStore(object):
+    """Profile documents in the `profiles` collection of the database
+    named in a mongodb:// URL, keyed by user id."""
+
+    def __init__(self, url):
+        if pymongo is None:
+            raise RuntimeError('PROFILE_STORE_URL points at MongoDB but '
+                               'pymongo is not installed')
+        # connect=False defers connecting until first use, after workers
+        # have forked
+        self.client = pymongo.MongoClient(url, connect=False)
+        self.collection = self.client.get_default_database()[COLLECTION]
+
+    def get(self, human_id):
+        return self.collection.find_one({'_id': human_id})
+
+    def put(self, documents):
+        # Only replace a stored document of the same or an older version,
+        # so commits reaching the store out of order cannot roll a
+        # profile back.  When a newer one is stored the upsert collides
+        # on _id instead, which is the intended no-op.
+        requests = [pymongo.ReplaceOne(
+            {'_id': document['_id'], 'version': {'$lte': document['version']}},
+            document, upsert=True) for document in documents]
+        if not requests:
+            return
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            if e.details.get('writeConcernErrors') or any(
+                    error['code'] != 11000
+                    for error in e.details.get('writeErrors', ())):
+                raise
+
+    def delete(self, human_ids):
+        self.collection.delete_many({'_id': {'$in': list(human_ids)}})
+
+    def ids(self):
+        return [document['_id'] for document in
+                self.collection.find({}, {'_id': True})]
+
+    def clear(self):
+        self.collection.delete_many({})
+
+
+class ProfileStore(object):
+    """The read model: one document per user, kept in step with every ORM
+    write and checked against the user's records_version when read.
+
+    Configured lazily from PROFILE_STORE_URL; without one it is disabled
+    and pages read from SQL.  A document that is missing, stale or cannot
+    be fetched also falls back to SQL, so the store being behind or down
+    only costs speed.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.configured = False
+        self._lock = threading.Lock()
+        self._clear_counters()
+
+    def _clear_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.writes = 0
+        self.errors = 0
+        self.last_error = None
+
+    def _configure(self):
+        url = current_app.config['PROFILE_STORE_URL']
+        if not url:
+            self.backend = None
+        elif url.startswith('memory:'):
+            self.backend = MemoryStore()
+        else:
+            self.backend = MongoStore(url)
+        self.configured = True
+
+    @property
+    def enabled(self):
+        if not self.configured:
+            self._configure()
+        return self.backend is not None
+
+    def _failed(self, error):
+        with self._lock:
+            self.errors += 1
+            self.last_error = '%s: %s' % (type(error).__name__, error)
+
+    def get(self, human_id, version):
+        """The document of `human_id` if it is at `version`, else None."""
+        if not self.enabled:
+            return None
+        try:
+            document = self.backend.get(human_id)
+        except STORE_ERRORS as e:
+            self._failed(e)
+            return None
+        with self._lock:
+            if document is None:
+                self.misses += 1
+            elif document['version'] != version:
+                self.stale += 1
+                document = None
+            else:
+                self.hits += 1
+        return document
+
+    def write(self, documents, deleted=()):
+        """Store `documents` and drop those of the users `deleted`."""
+        if not self.enabled:
+            return
+        try:
+            if documents:
+                self.backend.put(documents)
+            if deleted:
+                self.backend.delete(deleted)
+        except STORE_ERRORS as e:
+            self._failed(e)
+            return
+        with self._lock:
+            self.writes += len(documents) + len(deleted)
+
+    def reset(self):
+        """Forget the backend and counters; the next use reconfigures."""
+        with self._lock:
+            self._clear_counters()
+        self.backend = None
+        self.configured = False
+
+    def stats(self):
+        with self._lock:
+            reads = self.hits + self.misses + self.stale
+            return {
+                'enabled': self.backend is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': float(self.hits) / reads if reads else 0.0,
+                'writes': self.writes,
+                'errors': self.errors,
+                'last_error': self.last_error,
+            }
+
+
+profile_store = ProfileStore()
+
+
+def rebuild_profiles(batch_size=500):
+    """Rebuild every user's document from SQL, `batch_size` users per
+    round trip, and drop documents of users that no longer exist.
+
+    Returns the number of documents written.
+    """
+    backend = profile_store.backend if profile_store.enabled else None
+    if backend is None:
+        raise RuntimeError('PROFILE_STORE_URL is not set')
+
+    written = 0
+    seen = set()
+    last_id = 0
+    while True:
+        human_ids = [human_id for human_id, in db.session.query(User.id)
+                     .filter(User.id > last_id).order_by(User.id)
+                     .limit(batch_size)]
+        if not human_ids:
+            break
+        documents = build_profiles(human_ids)
+        backend.put(list(documents.values()))
+        written += len(documents)
+        seen.update(documents)
+        last_id = human_ids[-1]
+
+    backend.delete(set(backend.ids()) - seen)
+    return written
+
+
+#################
+#### syncing ####
+#################
+
+@event.listens_for(Session, 'after_flush')
+def _build_written_profiles(session, flush_context):
+    # Rebuild the documents of the users this flush wrote while the
+    # transaction can still read them (after records_version has been
+    # bumped); they are stored once it commits.
+    if not profile_store.enabled:
+        return
+    human_ids = written_owners(session)
+    human_ids.update(obj.id for obj in session.new if isinstance(obj, User))
+    deleted = set(obj.id for obj in session.deleted if isinstance(obj, User))
+    if not human_ids and not deleted:
+        return
+
+    pending = session.info.setdefault('profile_documents', {})
+    documents = build_profiles(human_ids - deleted, session)
+    for human_id in human_ids | deleted:
+        pending[human_id] = documents.get(human_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _store_written_profiles(session):
+    pending = session.info.pop('profile_documents', None)
+    if pending:
+        profile_store.write(
+            [document for document in pending.values() if document],
+            [human_id for human_id, document in pending.items()
+             if document is None])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written_profiles(session):
+    session.info.pop('profile_documents', None)
+
+
+#################
+#### serving ####
+#################
+
+def profile_document(human_id):
+    """The current document of `human_id`, or None when the read model is
+    off or behind; fetched at most once per request."""
+    if not profile_store.enabled:
+        return None
+    fetched = getattr(g, 'profile_documents', None)
+    if fetched is None:
+        fetched = g.profile_documents = {}
+    if human_id not in fetched:
+        fetched[human_id] = profile_store.get(human_id,
+                                              records_version(human_id))
+    return fetched[human_id]
+
+
+def forget_profile_documents(exception=None):
+    """teardown_request hook dropping the documents fetched for the
+    request, since `g` can outlive it when an app context is shared."""
+    g.profile_documents = None
+
+
+def profile_academic_record(human_id):
+    """load_academic_record(human_id), from the user's document if it is
+    current, so every section comes from the same version."""
+    document = profile_document(human_id)
+    if document is None:
+        return load_academic_record(human_id)
+    return AcademicRecord(
+        human_id=human_id,
+        education=document_rows(document, Education),
+        patents=document_rows(document, Patent),
+        publications=document_rows(document, Publication)
+    )
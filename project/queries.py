@@ -0,0 +1,123 @@
+# project/queries.py
+
+
+import threading
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# where the current request's QueryLog is kept while it is handled
+ENVIRON_KEY = 'project.queries'
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more statements than its view's query budget."""
+
+
+class QueryBudgetWarning(UserWarning):
+    """Warning counterpart of QueryBudgetExceeded."""
+
+
+class RepeatedQueryWarning(UserWarning):
+    """A request ran one statement more than QUERY_REPEAT_LIMIT times, the
+    mark of a lazy load in a loop (an N+1 query)."""
+
+
+class QueryLog(object):
+    """The SQL statements run while it was active, in order."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def add(self, statement):
+        self.statements.append(statement)
+
+    def repeated(self, limit):
+        """(statement, times) for each statement run more than `limit`
+        times, most repeated first.  Statements differing only in their
+        parameters count as the same one."""
+        return [(statement, times) for statement, times
+                in Counter(self.statements).most_common() if times > limit]
+
+    def describe(self):
+        return '\n'.join('%d. %s' % (number, ' '.join(statement.split()))
+                         for number, statement in
+                         enumerate(self.statements, 1))
+
+
+_local = threading.local()
+
+
+@contextmanager
+def capture_queries():
+    """Collect the statements this thread runs, including those of test
+    client requests, in the QueryLog it yields."""
+    log = QueryLog()
+    logs = _local.__dict__.setdefault('logs', [])
+    logs.append(log)
+    try:
+        yield log
+    finally:
+        logs.remove(log)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _log_statement(conn, cursor, statement, parameters, context,
+                   executemany):
+    for log in getattr(_local, 'logs', ()):
+        log.add(statement)
+    log = _request_log()
+    if log is not None:
+        log.add(statement)
+
+
+def _request_log():
+    if has_request_context():
+        return request.environ.get(ENVIRON_KEY)
+    return None
+
+
+##################
+#### requests ####
+##################
+
+def start_request_log():
+    """before_request hook logging the request's statements when
+    QUERY_DETECTOR is 'warn' or 'raise'."""
+    if current_app.config['QUERY_DETECTOR'] in ('warn', 'raise'):
+        request.environ[ENVIRON_KEY] = QueryLog()
+
+
+def check_request_queries(response):
+    """after_request hook warning of statements the request repeated and
+    of a view going over the budget it declares with
+    project.decorators.query_budget, which raises
+    QueryBudgetExceeded with QUERY_DETECTOR set to 'raise'.  The count is
+    sent in an X-Query-Count header."""
+    log = request.environ.pop(ENVIRON_KEY, None)
+    if log is None:
+        return response
+    config = current_app.config
+    response.headers['X-Query-Count'] = str(len(log))
+
+    for statement, times in log.repeated(config['QUERY_REPEAT_LIMIT']):
+        warnings.warn(RepeatedQueryWarning('%s ran %d times: %s' % (
+            request.endpoint, times, ' '.join(statement.split()))))
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None and len(log) > budget:
+        message = '%s ran %d statements, over its budget of %d:\n%s' % (
+            request.endpoint, len(log), budget, log.describe())
+        if config['QUERY_DETECTOR'] == 'raise':
+            raise QueryBudgetExceeded(message)
+        warnings.warn(QueryBudgetWarning(message))
+    return response
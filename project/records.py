@@ -0,0 +1,276 @@
+# project/records.py
+
+
+import datetime
+from collections import namedtuple
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, or_, false, event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from project import db
+from project.cache import lookup_labels, user_cache
+from project.models import (
+    User,
+    Employment,
+    Education,
+    Publication,
+    Patent,
+    RECORD_DATE_COLUMNS
+)
+
+
+# Read-only rows holding just the columns the record pages display.
+# Lookup fields carry the resolved label rather than the foreign key.
+EmploymentRow = namedtuple('EmploymentRow', [
+    'id', 'employer', 'position', 'job_desc', 'start_date', 'end_date'])
+
+EducationRow = namedtuple('EducationRow', [
+    'id', 'educational_institution', 'educational_institution_type',
+    'course_studied', 'start_date', 'end_date', 'accolades'])
+
+PublicationRow = namedtuple('PublicationRow', [
+    'id', 'title', 'authors', 'publication_date', 'publisher',
+    'publication_category', 'description', 'publication_url'])
+
+PatentRow = namedtuple('PatentRow', [
+    'id', 'title', 'inventors', 'patent_number', 'issue_date',
+    'patent_office', 'patent_status', 'description', 'patent_url'])
+
+# model -> (row type, row fields that are lookups stored as <field>_id)
+RECORD_ROWS = {
+    Employment: (EmploymentRow, ()),
+    Education: (EducationRow, ('educational_institution_type',)),
+    Publication: (PublicationRow, ('publication_category',)),
+    Patent: (PatentRow, ('patent_office', 'patent_status')),
+}
+
+RECORD_DATES = dict(RECORD_DATE_COLUMNS)
+
+# Everything academic_record renders, loaded in one query per record type.
+AcademicRecord = namedtuple('AcademicRecord', [
+    'human_id', 'education', 'patents', 'publications'])
+
+
+def record_columns(model):
+    """The columns _to_row builds `model`'s row tuples from."""
+    row_type, lookups = RECORD_ROWS[model]
+    return [getattr(model, field + '_id' if field in lookups else field)
+            for field in row_type._fields]
+
+
+def _record_query(model, human_id):
+    date = RECORD_DATES[model]
+    return model.query.with_entities(*record_columns(model)) \
+        .filter(model.human_id == human_id) \
+        .order_by(date.desc(), model.id.desc())
+
+
+def record_labels(model):
+    """The labels of the lookups in `model`'s rows, by field and id.
+
+    Read once per list of rows rather than per row, so a list costs no
+    extra queries even when the lookup cache misses.
+    """
+    return dict((field, lookup_labels(field))
+                for field in RECORD_ROWS[model][1])
+
+
+def _to_row(row_type, labels, values):
+    return row_type(*[labels[field].get(value, '') if field in labels
+                      else value
+                      for field, value in zip(row_type._fields, values)])
+
+
+def record_row(model, values, labels=None):
+    """`model`'s row tuple from the values of its record_columns; pass
+    record_labels(model) as `labels` when building many."""
+    if labels is None:
+        labels = record_labels(model)
+    return _to_row(RECORD_ROWS[model][0], labels, values)
+
+
+def _to_rows(model, results):
+    row_type = RECORD_ROWS[model][0]
+    labels = record_labels(model)
+    return tuple(_to_row(row_type, labels, values) for values in results)
+
+
+def record_rows(model, human_id):
+    """A user's `model` records as row tuples, newest first.
+
+    Selects only the displayed columns and resolves lookups through the
+    lookup cache, so this is a single query however many rows there are.
+    """
+    return _to_rows(model, _record_query(model, human_id))
+
+
+def iter_record_rows(model, human_id, batch_size=500):
+    """Like record_rows, but yielding the rows as they are fetched.
+
+    yield_per makes psycopg2 use a server-side cursor, so only
+    `batch_size` rows are held at a time however many the user has.
+    """
+    row_type = RECORD_ROWS[model][0]
+    labels = record_labels(model)
+    for values in _record_query(model, human_id).yield_per(batch_size):
+        yield _to_row(row_type, labels, values)
+
+
+################
+#### paging ####
+################
+
+# A page of rows plus the cursor for the page after it (None on the last).
+RecordPage = namedtuple('RecordPage', ['rows', 'next_cursor'])
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _cursor_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                             salt='record-cursor')
+
+
+def encode_cursor(date, id):
+    return _cursor_serializer().dumps(
+        [date.strftime(DATE_FORMAT) if date is not None else None, id])
+
+
+def decode_cursor(cursor):
+    """The (date, id) a cursor points at; ValueError if it is not valid."""
+    try:
+        date, id = _cursor_serializer().loads(cursor)
+        if date is not None:
+            date = datetime.datetime.strptime(date, DATE_FORMAT)
+        return date, int(id)
+    except (BadSignature, TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def _after(model, date, cursor_date, cursor_id):
+    # Rows that sort after (cursor_date, cursor_id) under
+    # ORDER BY date DESC, id DESC.  Postgres sorts NULL dates first in
+    # descending order; SQLite and MySQL sort them last.
+    nulls_first = db.engine.dialect.name == 'postgresql'
+    if cursor_date is None:
+        same_date = date.is_(None)
+        later_date = date.isnot(None) if nulls_first else false()
+    else:
+        same_date = date == cursor_date
+        later_date = date < cursor_date
+        if not nulls_first:
+            later_date = or_(later_date, date.is_(None))
+    return or_(later_date, and_(same_date, model.id < cursor_id))
+
+
+def record_page(model, human_id, cursor=None, per_page=None):
+    """One page of a user's `model` records using keyset pagination.
+
+    Pages are seeked on (date, id) rather than offset, so every page
+    costs the same however deep into the list it is.
+    """
+    per_page = min(per_page or current_app.config['RECORDS_PER_PAGE'],
+                   current_app.config['RECORDS_MAX_PER_PAGE'])
+    per_page = max(per_page, 1)
+
+    query = _record_query(model, human_id)
+    if cursor is not None:
+        date = RECORD_DATES[model]
+        query = query.filter(_after(model, date, *decode_cursor(cursor)))
+
+    results = query.limit(per_page + 1).all()
+    rows = _to_rows(model, results[:per_page])
+
+    next_cursor = None
+    if len(results) > per_page:
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            getattr(last, RECORD_DATES[model].key), last.id)
+    return RecordPage(rows, next_cursor)
+
+
+def load_academic_record(human_id):
+    return AcademicRecord(
+        human_id=human_id,
+        education=record_rows(Education, human_id),
+        patents=record_rows(Patent, human_id),
+        publications=record_rows(Publication, human_id)
+    )
+
+
+##################
+#### versions ####
+##################
+
+RECORD_MODELS = tuple(model for model, date in RECORD_DATE_COLUMNS)
+
+# A user's version stamp: what their profile and record pages depend on.
+VersionStamp = namedtuple('VersionStamp', ['id', 'version', 'updated_at'])
+
+
+def _load_previous_owner(target, value, oldvalue, initiator):
+    pass
+
+
+# active_history makes the ORM load a record's current human_id before it
+# is replaced, so a record moved between users bumps both of them.
+for _model in RECORD_MODELS:
+    event.listen(_model.human_id, 'set', _load_previous_owner,
+                 active_history=True)
+
+
+def written_owners(session):
+    """Ids of the users whose row or records the flush in progress wrote,
+    including the previous owners of records moved between users."""
+    human_ids = set()
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User) and session.is_modified(obj):
+            human_ids.add(obj.id)
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, RECORD_MODELS):
+            human_ids.add(obj.human_id)
+            human_ids.update(get_history(obj, 'human_id').deleted)
+    human_ids.discard(None)
+    return human_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_record_versions(session, flush_context):
+    # Every user whose row or records were written gets records_version
+    # bumped in the same transaction, so a page built from them can be
+    # revalidated by reading one row.
+    human_ids = written_owners(session)
+    if not human_ids:
+        return
+
+    human = User.__table__
+    session.connection().execute(
+        human.update().where(human.c.id.in_(human_ids)).values(
+            records_version=human.c.records_version + 1,
+            records_updated_at=datetime.datetime.utcnow()))
+    for human_id in human_ids:
+        user_cache.invalidate(human_id)
+    session.info.setdefault('written_user_ids', set()).update(human_ids)
+
+
+def page_stamps(key, value, viewer_id):
+    """VersionStamps of the user whose `key` column is `value` and of the
+    viewer, read in one query; the owner is None if there is no such user.
+
+    Reads the stamp columns directly rather than through the user cache,
+    which other processes do not invalidate.
+    """
+    column = getattr(User, key)
+    owner = viewer = None
+    for id, key_value, version, updated_at in db.session.query(
+            User.id, column, User.records_version, User.records_updated_at) \
+            .filter(or_(column == value, User.id == viewer_id)):
+        stamp = VersionStamp(id, version, updated_at)
+        if key_value == value:
+            owner = stamp
+        if id == viewer_id:
+            viewer = stamp
+    return owner, viewer
@@ -0,0 +1,240 @@
+# project/routing.py
+
+
+import random
+import threading
+import time
+
+import sqlalchemy
+from flask import current_app, g, has_request_context, session
+from flask.ext.sqlalchemy import SignallingSession
+from sqlalchemy import event, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session
+
+from project.metrics import request_metrics
+from project.pool import InstrumentedSQLAlchemy
+
+
+# key in the client's session holding when its last write was committed
+LAST_WRITE_KEY = '_last_write'
+
+# How far a Postgres standby is behind, in seconds: none when it has
+# replayed everything it received, else the age of the last transaction
+# it replayed.  NULL if it has replayed none yet, or is not a standby.
+POSTGRES_LAG = text(
+    'SELECT CASE WHEN pg_last_xlog_receive_location() = '
+    'pg_last_xlog_replay_location() THEN 0 ELSE '
+    'EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+# the lag query by dialect; other databases only show they are reachable
+LAG_QUERIES = {'postgresql': POSTGRES_LAG}
+NO_LAG = text('SELECT 0')
+
+
+class Replica(object):
+    """A read replica, its engine and what this process knows of it."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.engine = None
+        # seconds behind the primary when last measured; None if it could
+        # not be reached or did not know
+        self.lag = None
+        self.checked_at = 0
+        self.reads = 0
+        self.errors = 0
+
+
+class ReplicaSet(object):
+    """The replicas in SQLALCHEMY_REPLICA_URIS, configured lazily.
+
+    Each replica's lag is measured at most every
+    REPLICA_LAG_CHECK_INTERVAL seconds, when a read is routed; replicas
+    more than REPLICA_MAX_LAG seconds behind, unreachable or of unknown
+    lag are passed over until they catch up.  Lag can only be measured on
+    Postgres and counts as none elsewhere.
+    """
+
+    def __init__(self):
+        self.replicas = None
+        self._lock = threading.Lock()
+        self._clear_counters()
+
+    def _clear_counters(self):
+        self.sticky = 0
+        self.unavailable = 0
+
+    def _configure(self):
+        db = current_app.extensions['sqlalchemy'].db
+        replicas = []
+        for number, url in enumerate(
+                current_app.config['SQLALCHEMY_REPLICA_URIS']):
+            replica = Replica('replica%d' % number, url)
+            # the same pool settings and driver fixes as the primary
+            info = make_url(url)
+            options = {'convert_unicode': True}
+            db.apply_pool_defaults(current_app, options)
+            db.apply_driver_hacks(current_app, info, options)
+            replica.engine = sqlalchemy.create_engine(info, **options)
+            replicas.append(replica)
+        self.replicas = replicas
+
+    def _measure(self, replica):
+        # (lag, failed); run without the lock, as an unreachable replica
+        # can take up to the connect timeout
+        query = LAG_QUERIES.get(replica.engine.dialect.name, NO_LAG)
+        try:
+            lag = replica.engine.scalar(query)
+        except sqlalchemy.exc.DBAPIError:
+            return None, True
+        return (None if lag is None else float(lag)), False
+
+    def choose(self):
+        """A replica close enough to the primary to read from, or None."""
+        config = current_app.config
+        with self._lock:
+            if self.replicas is None:
+                self._configure()
+            replicas = self.replicas
+            now = time.time()
+            due = [replica for replica in replicas if now - replica.checked_at
+                   >= config['REPLICA_LAG_CHECK_INTERVAL']]
+            # claimed, so other threads keep using the last measurement
+            for replica in due:
+                replica.checked_at = now
+
+        measured = [(replica, self._measure(replica)) for replica in due]
+
+        with self._lock:
+            for replica, (lag, failed) in measured:
+                replica.lag = lag
+                if failed:
+                    replica.errors += 1
+                    request_metrics.count(
+                        'flaskdocstore_replica_errors_total',
+                        {'replica': replica.name})
+                replica.checked_at = time.time()
+            candidates = [replica for replica in replicas
+                          if replica.lag is not None and
+                          replica.lag <= config['REPLICA_MAX_LAG']]
+            if not candidates:
+                self.unavailable += 1
+                request_metrics.count(
+                    'flaskdocstore_replica_unavailable_total')
+                return None
+            replica = random.choice(candidates)
+            replica.reads += 1
+        request_metrics.count('flaskdocstore_replica_reads_total',
+                              {'replica': replica.name})
+        return replica
+
+    def stick(self):
+        with self._lock:
+            self.sticky += 1
+        request_metrics.count('flaskdocstore_replica_sticky_total')
+
+    def lag_samples(self):
+        """This process's last measured lag of each replica, as samples
+        for project.metrics.render."""
+        with self._lock:
+            return dict((
+                ('flaskdocstore_replica_lag_seconds', '',
+                 (('replica', replica.name),)), replica.lag)
+                for replica in self.replicas or ()
+                if replica.lag is not None)
+
+    def reset(self):
+        """Dispose of the engines; the next read reconfigures."""
+        with self._lock:
+            for replica in self.replicas or ():
+                replica.engine.dispose()
+            self.replicas = None
+            self._clear_counters()
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                'sticky': self.sticky,
+                'unavailable': self.unavailable,
+                'replicas': dict((replica.name, {
+                    'reads': replica.reads,
+                    'lag_seconds': replica.lag,
+                    'checked_seconds_ago': (now - replica.checked_at
+                                            if replica.checked_at else None),
+                    'errors': replica.errors,
+                }) for replica in self.replicas or ()),
+            }
+
+
+replica_set = ReplicaSet()
+
+
+def route_reads_to_replica():
+    """Send the rest of this request's reads to a replica, unless the
+    client wrote within READ_YOUR_WRITES_SECONDS or none is fit to use.
+
+    Returns the chosen Replica or None.
+    """
+    config = current_app.config
+    if not config['SQLALCHEMY_REPLICA_URIS']:
+        return None
+    last_write = session.get(LAST_WRITE_KEY)
+    if last_write is not None and \
+            time.time() - last_write < config['READ_YOUR_WRITES_SECONDS']:
+        replica_set.stick()
+        return None
+    g.replica = replica_set.choose()
+    return g.replica
+
+
+def forget_replica(exception=None):
+    """teardown_request hook ending the request's use of a replica, since
+    `g` can outlive it when an app context is shared."""
+    g.replica = None
+
+
+class RoutingSession(SignallingSession):
+    """Session reading from the replica chosen for the request, if any.
+
+    Flushes, and everything after the session has written, go to the
+    primary.  Queries autoflush before they pick a bind, so a read never
+    goes to a replica ahead of the session's own pending writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = getattr(g, 'replica', None) if has_request_context() \
+            else None
+        if replica is not None and not self._flushing and \
+                not self.info.get('wrote'):
+            return replica.engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(InstrumentedSQLAlchemy):
+    """Flask-SQLAlchemy with instrumented pools and sessions that can read
+    from replicas."""
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_write(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_write(db_session):
+    # The client reads from the primary until its write has had time to
+    # reach the replicas, starting with the rest of this request.
+    if db_session.info.pop('wrote', False) and has_request_context():
+        session[LAST_WRITE_KEY] = time.time()
+        g.replica = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_write(db_session):
+    db_session.info.pop('wrote', None)
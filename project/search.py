@@ -0,0 +1,290 @@
+# project/search.py
+
+
+import math
+import re
+from collections import namedtuple, OrderedDict
+
+from flask import current_app
+from sqlalchemy import event, select, func, and_, case, desc, literal
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from project import db
+from project.models import (
+    Employment,
+    Education,
+    Publication,
+    Patent,
+    SearchDocument,
+    SearchPosting
+)
+
+
+# record type -> (model, searched fields); the first field is the one
+# shown as the result title and counts most towards the rank.
+SEARCH_FIELDS = OrderedDict([
+    ('publication', (Publication, ('title', 'authors', 'description'))),
+    ('patent', (Patent, ('title', 'inventors', 'description',
+                         'patent_number'))),
+    ('employment', (Employment, ('employer', 'position'))),
+    ('education', (Education, ('educational_institution',
+                               'course_studied'))),
+])
+
+SEARCH_TYPES = dict((model, record_type) for record_type, (model, fields)
+                    in SEARCH_FIELDS.items())
+
+# weight of a term in the title field and in the rest, matching the
+# 'A' and 'B' weights given to the tsvector on Postgres
+TITLE_WEIGHT = 1.0
+BODY_WEIGHT = 0.4
+
+SearchHit = namedtuple('SearchHit', [
+    'record_type', 'record_id', 'human_id', 'title', 'score'])
+
+# A page of hits plus the number of the page after it (None on the last).
+SearchPage = namedtuple('SearchPage', ['hits', 'next_page'])
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset("""
+    a an and are as at be by for from has in is it its of on or that the
+    to was were will with
+""".split())
+
+
+def tokenize(text):
+    """Lower-cased words of `text`, without stopwords."""
+    return [word for word in _WORD.findall((text or '').lower())
+            if word not in STOPWORDS and len(word) <= 64]
+
+
+def _postgres(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+def _tsvector(title, body):
+    language = current_app.config['SEARCH_LANGUAGE']
+    return func.setweight(func.to_tsvector(language, title), 'A').op('||')(
+        func.setweight(func.to_tsvector(language, body), 'B'))
+
+
+def _postings(values):
+    weights = {}
+    for position, value in enumerate(values):
+        weight = TITLE_WEIGHT if position == 0 else BODY_WEIGHT
+        for term in tokenize(value):
+            weights[term] = weights.get(term, 0.0) + weight
+    return weights
+
+
+##################
+#### indexing ####
+##################
+
+def _remove(connection, record_type, record_ids):
+    documents = SearchDocument.__table__
+    connection.execute(documents.delete().where(and_(
+        documents.c.record_type == record_type,
+        documents.c.record_id.in_(record_ids))))
+    if not _postgres(connection):
+        postings = SearchPosting.__table__
+        connection.execute(postings.delete().where(and_(
+            postings.c.record_type == record_type,
+            postings.c.record_id.in_(record_ids))))
+
+
+def _add(connection, record_type, records):
+    """Index `records`, (id, human_id, field values...) tuples."""
+    documents = SearchDocument.__table__
+    if _postgres(connection):
+        for record in records:
+            values = [value or '' for value in record[2:]]
+            connection.execute(documents.insert().values(
+                record_type=record_type, record_id=record[0],
+                human_id=record[1], title=values[0][:200],
+                tsv=_tsvector(values[0], ' '.join(values[1:]))))
+        return
+
+    postings = []
+    rows = []
+    for record in records:
+        values = [value or '' for value in record[2:]]
+        rows.append(dict(record_type=record_type, record_id=record[0],
+                         human_id=record[1], title=values[0][:200]))
+        postings.extend(
+            dict(term=term, record_type=record_type, record_id=record[0],
+                 weight=weight)
+            for term, weight in _postings(values).items())
+    if rows:
+        connection.execute(documents.insert(), rows)
+    if postings:
+        connection.execute(SearchPosting.__table__.insert(), postings)
+
+
+def _indexed_values(record_type, record):
+    model, fields = SEARCH_FIELDS[record_type]
+    return (record.id, record.human_id) + tuple(
+        getattr(record, field) for field in fields)
+
+
+@event.listens_for(Session, 'after_flush')
+def _index_writes(session, flush_context):
+    # Keep the index in step with the records in the same transaction:
+    # new records are added, deleted ones removed and edited ones
+    # re-indexed if a searched field (or the owner) changed.
+    removed = {}
+    added = {}
+    for obj in session.new | session.dirty | session.deleted:
+        record_type = SEARCH_TYPES.get(type(obj))
+        if record_type is None:
+            continue
+        if obj in session.deleted:
+            removed.setdefault(record_type, []).append(obj.id)
+            continue
+        if obj in session.dirty:
+            fields = SEARCH_FIELDS[record_type][1] + ('human_id',)
+            if not any(get_history(obj, field).has_changes()
+                       for field in fields):
+                continue
+            removed.setdefault(record_type, []).append(obj.id)
+        added.setdefault(record_type, []).append(
+            _indexed_values(record_type, obj))
+
+    if not removed and not added:
+        return
+    connection = session.connection()
+    for record_type, record_ids in removed.items():
+        _remove(connection, record_type, record_ids)
+    for record_type, records in added.items():
+        _add(connection, record_type, records)
+
+
+def rebuild_index(batch_size=1000):
+    """Re-create the whole search index from the record tables.
+
+    Returns the number of records indexed per record type.
+    """
+    counts = OrderedDict()
+    with db.engine.begin() as connection:
+        connection.execute(SearchPosting.__table__.delete())
+        connection.execute(SearchDocument.__table__.delete())
+        for record_type, (model, fields) in SEARCH_FIELDS.items():
+            table = model.__table__
+            columns = [table.c.id, table.c.human_id] + [
+                table.c[field] for field in fields]
+
+            if _postgres(connection):
+                # One INSERT ... SELECT per table; the tsvectors are built
+                # by Postgres without the rows leaving the database.
+                coalesced = [func.coalesce(table.c[field], '')
+                             for field in fields]
+                body = coalesced[1]
+                for column in coalesced[2:]:
+                    body = body.op('||')(' ').op('||')(column)
+                result = connection.execute(
+                    SearchDocument.__table__.insert().from_select(
+                        ['record_type', 'record_id', 'human_id', 'title',
+                         'tsv'],
+                        select([literal(record_type), table.c.id,
+                                table.c.human_id,
+                                func.substr(coalesced[0], 1, 200),
+                                _tsvector(coalesced[0], body)])))
+                counts[record_type] = result.rowcount
+                continue
+
+            counts[record_type] = 0
+            last_id = 0
+            while True:
+                records = connection.execute(
+                    select(columns).where(table.c.id > last_id)
+                    .order_by(table.c.id).limit(batch_size)).fetchall()
+                if not records:
+                    break
+                _add(connection, record_type, [tuple(r) for r in records])
+                counts[record_type] += len(records)
+                last_id = records[-1][0]
+    return counts
+
+
+#################
+#### queries ####
+#################
+
+def _postgres_query(text, filters):
+    documents = SearchDocument.__table__
+    query = func.plainto_tsquery(current_app.config['SEARCH_LANGUAGE'], text)
+    score = func.ts_rank_cd(documents.c.tsv, query)
+    return select([documents.c.record_type, documents.c.record_id,
+                   documents.c.human_id, documents.c.title,
+                   score.label('score')]) \
+        .where(and_(documents.c.tsv.op('@@')(query), *filters))
+
+
+def _posting_query(text, filters):
+    terms = sorted(set(tokenize(text)))
+    if not terms:
+        return None
+    documents = SearchDocument.__table__
+    postings = SearchPosting.__table__
+
+    # Every term must match, so a term nobody uses means no hits; the
+    # rest are weighted by inverse document frequency.
+    frequencies = dict(db.session.execute(
+        select([postings.c.term, func.count()])
+        .where(postings.c.term.in_(terms))
+        .group_by(postings.c.term)).fetchall())
+    if len(frequencies) < len(terms):
+        return None
+    total = db.session.execute(
+        select([func.count()]).select_from(documents)).scalar()
+    idf = case([(postings.c.term == term,
+                 math.log(1.0 + float(total) / frequencies[term]))
+                for term in terms], else_=0.0)
+    score = func.sum(postings.c.weight * idf)
+
+    return select([documents.c.record_type, documents.c.record_id,
+                   documents.c.human_id, documents.c.title,
+                   score.label('score')]) \
+        .select_from(postings.join(documents, and_(
+            postings.c.record_type == documents.c.record_type,
+            postings.c.record_id == documents.c.record_id))) \
+        .where(and_(postings.c.term.in_(terms), *filters)) \
+        .group_by(documents.c.record_type, documents.c.record_id,
+                  documents.c.human_id, documents.c.title) \
+        .having(func.count() == len(terms))
+
+
+def search(text, record_types=None, human_id=None, page=1, per_page=None):
+    """Records matching every word of `text`, best match first.
+
+    Ranked with ts_rank_cd over the GIN-indexed tsvectors on Postgres and
+    with tf-idf over SearchPosting elsewhere.  `record_types` and
+    `human_id` narrow the search; pages are numbered from 1.
+    """
+    config = current_app.config
+    per_page = max(min(per_page or config['SEARCH_PER_PAGE'],
+                       config['SEARCH_MAX_PER_PAGE']), 1)
+    page = max(page or 1, 1)
+
+    documents = SearchDocument.__table__
+    filters = []
+    if record_types:
+        filters.append(documents.c.record_type.in_(record_types))
+    if human_id is not None:
+        filters.append(documents.c.human_id == human_id)
+
+    if _postgres(db.engine):
+        query = _postgres_query(text, filters)
+    else:
+        query = _posting_query(text, filters)
+    if query is None:
+        return SearchPage((), None)
+
+    query = query.order_by(desc('score'),
+                           documents.c.record_type, documents.c.record_id) \
+        .limit(per_page + 1).offset((page - 1) * per_page)
+    hits = [SearchHit(*row) for row in db.session.execute(query)]
+    next_page = page + 1 if len(hits) > per_page else None
+    return SearchPage(tuple(hits[:per_page]), next_page)
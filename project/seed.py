@@ -0,0 +1,117 @@
+# project/seed.py
+
+
+import csv
+import os
+from collections import OrderedDict
+
+import six
+from sqlalchemy import and_, bindparam
+
+from project import db
+from project.cache import invalidate_lookups
+from project.models import (
+    EducationalInstitutionType,
+    Gender,
+    PatentOffice,
+    PatentStatus,
+    PublicationCategory,
+    PresentationRole,
+    ResearchRole
+)
+
+
+SEED_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'seeds')
+
+# SQLite refuses statements with more bound parameters than this.
+SQLITE_MAX_VARIABLES = 999
+
+# Lookup tables in load order, each with the columns that identify a row
+# independently of its generated id.
+LOOKUP_TABLES = [
+    (EducationalInstitutionType, ('description',)),
+    (Gender, ('gender',)),
+    (PublicationCategory, ('category',)),
+    (PatentOffice, ('name',)),
+    (PatentStatus, ('status',)),
+    (PresentationRole, ('description',)),
+    (ResearchRole, ('description',)),
+]
+
+
+def read_seed_file(table_name):
+    """Rows of seeds/<table_name>.csv keyed by column; blanks become None."""
+    with open(os.path.join(SEED_DIR, table_name + '.csv')) as f:
+        return [dict((column, value or None) for column, value in row.items())
+                for row in csv.DictReader(f)]
+
+
+def _bulk_insert(connection, table, rows):
+    columns = sorted(rows[0])
+
+    if connection.dialect.name == 'postgresql':
+        buf = six.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+        buf.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH CSV' % (
+            table.name, ', '.join(columns)), buf)
+        return
+
+    # Multi-row VALUES, chunked to stay under SQLite's parameter limit.
+    chunk = max(1, SQLITE_MAX_VARIABLES // len(columns))
+    for start in range(0, len(rows), chunk):
+        connection.execute(table.insert().values(rows[start:start + chunk]))
+
+
+def seed_table(connection, model, key, rows):
+    """Upsert `rows` into `model`'s table, matching on the `key` columns.
+
+    Returns the number of rows inserted and updated.
+    """
+    table = model.__table__
+    natural_key = lambda row: tuple(row[column] for column in key)
+
+    existing = dict((natural_key(row), row)
+                    for row in connection.execute(table.select()))
+    wanted = OrderedDict((natural_key(row), row) for row in rows)
+
+    inserts = []
+    updates = []
+    for row_key, row in wanted.items():
+        current = existing.get(row_key)
+        if current is None:
+            inserts.append(row)
+        elif any(current[column] != value for column, value in row.items()):
+            updates.append(row)
+
+    if inserts:
+        _bulk_insert(connection, table, inserts)
+
+    if updates:
+        statement = table.update().where(and_(*[
+            table.c[column] == bindparam('key_' + column) for column in key]))
+        connection.execute(statement, [
+            dict(row, **dict(('key_' + column, row[column]) for column in key))
+            for row in updates])
+
+    return len(inserts), len(updates)
+
+
+def seed_lookup_tables():
+    """Bring every lookup table in line with its seed file.
+
+    Runs in a single transaction and returns a (table, inserted, updated)
+    tuple per table; re-running with unchanged seed files is a no-op.
+    """
+    report = []
+    with db.engine.begin() as connection:
+        for model, key in LOOKUP_TABLES:
+            rows = read_seed_file(model.__tablename__)
+            inserted, updated = seed_table(connection, model, key, rows)
+            report.append((model.__tablename__, inserted, updated))
+
+    invalidate_lookups()
+    return report
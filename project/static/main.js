@@ -1 +1,41 @@
-// custom javascript
\ No newline at end of file
+// custom javascript
+
+// Inline editables on the *_edit pages are created without a data-url, so
+// x-editable only records the new value locally and marks the element with
+// `editable-unsaved`.  savePendingEdits() gathers every unsaved value inside
+// `container` and sends them to the resource's PATCH endpoint in one request.
+function savePendingEdits(container, url) {
+    var $pending = $(container).find('.editable-unsaved');
+    if ($pending.length === 0) {
+        return;
+    }
+
+    var changes = $pending.editable('getValue');
+    $.ajax({
+        url: url,
+        type: 'PATCH',
+        contentType: 'application/json',
+        dataType: 'json',
+        data: JSON.stringify(changes)
+    }).done(function () {
+        $pending.removeClass('editable-unsaved');
+        $(container).find('.edit-status').text('Saved.');
+    }).fail(function (xhr) {
+        var errors = (xhr.responseJSON && xhr.responseJSON.errors) || {};
+        $(container).find('.edit-status').text(
+            'Changes could not be saved: ' + $.map(errors, function (message, field) {
+                return field + ' (' + message + ')';
+            }).join(', '));
+    });
+}
+
+function initPendingEdits(container, url) {
+    $(container).find('.editable-field').editable({
+        placement: "right",
+        send: "never"
+    });
+    $(container).find('.save-edits').on('click', function (e) {
+        e.preventDefault();
+        savePendingEdits(container, url);
+    });
+}
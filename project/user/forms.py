@@ -1,12 +1,13 @@
 # project/user/forms.py
 
 
+from operator import attrgetter
+
 from flask_wtf import Form
+from flask_wtf.file import FileField, FileRequired
 from wtforms import (
     StringField,
     PasswordField,
-    FieldList,
-    FormField,
     TextAreaField
 )
 
@@ -15,15 +16,8 @@ from wtforms.fields.html5 import DateField
 # from wtforms.widgets import HTMLString, html_params
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
 
-from project.models import (
-    User,
-    EducationalInstitutionType,
-    Gender,
-    PatentOffice,
-    PatentStatus,
-    PublicationCategory
-)
-
+from project.cache import lookup_rows
+from project.models import User
 
 
 # class DatePickerWidget(object):
@@ -97,7 +91,15 @@ class ChangePasswordForm(Form):
 
 
 def GenderSelect():
-    return Gender.query   #.all()
+    return lookup_rows('gender')
+
+
+def LookupSelectField(query_factory, **kwargs):
+    """QuerySelectField over the cached LookupRow tuples of a lookup table."""
+    return QuerySelectField(query_factory=query_factory,
+                            get_pk=attrgetter('id'),
+                            get_label=attrgetter('label'),
+                            **kwargs)
 
 
 class EditPersonalForm(Form):
@@ -105,7 +107,7 @@ class EditPersonalForm(Form):
     lastname = StringField('lastname', validators=[Optional()])
     birthdate = StringField('birthdate', validators=[Optional()])
     gender_selection = StringField('gender', validators=[Optional()])
-    gender = QuerySelectField(query_factory=GenderSelect, allow_blank=True)
+    gender = LookupSelectField(GenderSelect, allow_blank=True)
 
 
 class EmploymentForm(Form):
@@ -118,12 +120,8 @@ class EmploymentForm(Form):
     job_desc = TextAreaField('job_desc', validators=[Optional()])
 
 
-class EmploymentListForm(Form):
-    employmentlist = FieldList(FormField(EmploymentForm))
-
-
 def EducationalInstitutionTypes():
-    return EducationalInstitutionType.query   #.all()
+    return lookup_rows('educational_institution_type')
 
 
 class EducationForm(Form):
@@ -135,18 +133,12 @@ class EducationForm(Form):
     start_date = DateField('start_date', validators=[Optional()])
     end_date = DateField('end_date', validators=[Optional()])
     accolades = TextAreaField('accolades', validators=[Optional()])
-    educational_institution_type = StringField('educational_institution_type',
-                                               validators=[Optional()])
-    educational_institution_type_list = QuerySelectField(
-        query_factory=EducationalInstitutionTypes, allow_blank=True)
-
-
-class EducationFormListForm(Form):
-    educationlist = FieldList(FormField(EducationForm))
+    educational_institution_type_list = LookupSelectField(
+        EducationalInstitutionTypes, allow_blank=True)
 
 
 def PublicationCategoryList():
-    return PublicationCategory.query
+    return lookup_rows('publication_category')
 
 
 class PublicationForm(Form):
@@ -158,23 +150,20 @@ class PublicationForm(Form):
     publisher = StringField('publisher', validators=[Optional()])
     publication_url = StringField('publication_url', validators=[Optional()])
     description = TextAreaField('description', validators=[Optional()])
-    publication_category_list = QuerySelectField(query_factory=
-                                                 PublicationCategoryList,
-                                                 allow_blank=True)
-    publication_category = StringField('publication_category',
-                                       validators=[Optional()])
+    publication_category_list = LookupSelectField(PublicationCategoryList,
+                                                  allow_blank=True)
 
 
-class PublicationFormListForm(Form):
-    publicationlist = FieldList(FormField(PublicationForm))
+class PublicationImportForm(Form):
+    file = FileField('file', validators=[FileRequired()])
 
 
 def PatentOfficeList():
-    return PatentOffice.query
+    return lookup_rows('patent_office')
 
 
 def PatentStatusList():
-    return PatentStatus.query
+    return lookup_rows('patent_status')
 
 
 class PatentForm(Form):
@@ -185,19 +174,11 @@ class PatentForm(Form):
     patent_number = StringField('patent_number', validators=[Optional()])
     inventors = StringField('inventors', validators=[Optional()])
     issue_date = DateField('issue_date', validators=[Optional()])
-    patent_office = StringField('patent_office', validators=[Optional()])
-    patent_office_list = QuerySelectField(query_factory=PatentOfficeList,
-                                          allow_blank=True)
-    patent_status = StringField('patent_status', validators=[Optional()])
-    patent_status_list = QuerySelectField(query_factory=PatentStatusList,
-                                          allow_blank=True)
+    patent_office_list = LookupSelectField(PatentOfficeList, allow_blank=True)
+    patent_status_list = LookupSelectField(PatentStatusList, allow_blank=True)
     patent_url = StringField('patent_url', validators=[Optional()])
 
 
-class PatentFormListForm(Form):
-    patentlist = FieldList(FormField(PatentForm))
-
-
 class CertificationForm(Form):
     id = StringField('id', validators=[Optional()])
     human_id = StringField('human_id', validators=[Optional()])
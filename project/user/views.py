@@ -4,18 +4,58 @@
 #################
 #### imports ####
 #################
+import codecs
 import datetime
-
-from flask import render_template, Blueprint, url_for, redirect, flash, request
+import itertools
+
+import six
+from flask import (
+    render_template,
+    Blueprint,
+    url_for,
+    redirect,
+    flash,
+    request,
+    jsonify,
+    abort,
+    Response,
+    stream_with_context,
+    g
+)
 from flask.ext.login import login_user, logout_user, login_required, current_user
 
-from sqlalchemy import desc
-
-from project.token import generate_confirmation_token, confirm_token
-from project.decorators import check_confirmed
-from project.email import send_email
-from project import db, bcrypt
+from project.token import confirm_token
+from project.decorators import (
+    check_confirmed,
+    conditional_page,
+    read_replica,
+    query_budget
+)
+from project.email import send_confirmation
+from project.passwords import (
+    generate_password_hash,
+    check_password_hash,
+    needs_rehash,
+    PasswordHashBusy
+)
+from project import db
 
+from project.cache import (
+    lookup_label,
+    lookup_labels,
+    lookup_rows,
+    get_cached_user
+)
+from project.records import record_page
+from project.fragments import render_fragment
+from project.profiles import (
+    profile_document,
+    profile_academic_record,
+    document_user
+)
+from project.search import search, SEARCH_FIELDS
+from project.export import export_cv, EXPORT_FORMATS
+from project.bibliography import detect_format, import_publications
 from project.models import (
     User,
     Employment,
@@ -29,14 +69,10 @@ from .forms import (
     RegisterForm,
     ChangePasswordForm,
     EmploymentForm,
-    EmploymentListForm,
     EducationForm,
-    EducationFormListForm,
-    EditPersonalForm,
     PublicationForm,
-    PublicationFormListForm,
-    PatentForm,
-    PatentFormListForm
+    PublicationImportForm,
+    PatentForm
 )
 
 
@@ -47,6 +83,168 @@ from .forms import (
 user_blueprint = Blueprint('user', __name__,)
 
 
+#################
+#### helpers ####
+#################
+
+def _text(value):
+    if value is not None and not isinstance(value, six.string_types):
+        raise ValueError('expected a string')
+    return value
+
+
+def _required_text(value):
+    if not value:
+        raise ValueError('value is required')
+    return _text(value)
+
+
+def _date(value):
+    if value in (None, ''):
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def _lookup_id(table):
+    # converter accepting only ids of rows of lookup `table`, so a bad id
+    # is a 400 rather than an IntegrityError on commit
+    def convert(value):
+        if value in (None, ''):
+            return None
+        value = int(value)
+        if value not in lookup_labels(table):
+            raise ValueError('no %s %d' % (table, value))
+        return value
+    return convert
+
+
+# Columns each PATCH endpoint may write, mapped to the function that
+# converts the submitted JSON value into the column value.
+PATCHABLE_FIELDS = {
+    User: {
+        'firstname': _text,
+        'surname': _text,
+        'birthdate': _date,
+        'gender_id': _lookup_id('gender'),
+    },
+    Employment: {
+        'employer': _required_text,
+        'position': _required_text,
+        'job_desc': _text,
+        'start_date': _date,
+        'end_date': _date,
+    },
+    Education: {
+        'educational_institution': _required_text,
+        'educational_institution_type_id':
+            _lookup_id('educational_institution_type'),
+        'course_studied': _text,
+        'start_date': _date,
+        'end_date': _date,
+        'accolades': _text,
+    },
+    Publication: {
+        'title': _required_text,
+        'authors': _text,
+        'publication_date': _date,
+        'publisher': _text,
+        'publication_url': _text,
+        'description': _text,
+        'publication_category_id': _lookup_id('publication_category'),
+    },
+    Patent: {
+        'title': _required_text,
+        'description': _required_text,
+        'patent_number': _required_text,
+        'inventors': _required_text,
+        'issue_date': _date,
+        'patent_office_id': _lookup_id('patent_office'),
+        'patent_status_id': _lookup_id('patent_status'),
+        'patent_url': _text,
+    },
+}
+
+
+def select_source(table):
+    """Cached lookup rows as the value/text pairs an x-editable select
+    expects."""
+    return [{'value': row.id, 'text': row.label} for row in lookup_rows(table)]
+
+
+def selected_id(field):
+    """Id of the LookupRow chosen in a lookup select field, if any."""
+    return field.data.id if field.data else None
+
+
+def requested_page(model, human_id):
+    """The page of `model` records selected by the cursor and per_page
+    query arguments; aborts with 400 on a cursor that does not decode."""
+    try:
+        return record_page(model, human_id,
+                           cursor=request.args.get('cursor'),
+                           per_page=request.args.get('per_page', type=int))
+    except ValueError:
+        abort(400)
+
+
+def list_fragment(model, human_id, table, name):
+    """The rows and pager of a record list page, through the fragment
+    cache; `table` is the partial rendering the rows as `name`."""
+    def load():
+        page = requested_page(model, human_id)
+        return {name: page.rows, 'table': table, 'page': page}
+
+    return render_fragment('user/_record_page.html', human_id,
+                           variant=request.full_path, load=load)
+
+
+def rehash_password(user, password):
+    """Re-hash a just-verified password stored at a different cost from
+    BCRYPT_LOG_ROUNDS.  Skipped when hashing is at capacity; the next
+    login tries again."""
+    if not needs_rehash(user.password):
+        return
+    try:
+        user.password = generate_password_hash(password)
+    except PasswordHashBusy:
+        return
+    db.session.commit()
+
+
+def patch_record(record, owner_id):
+    """Apply the JSON body of the current request to `record`.
+
+    Every submitted field must be whitelisted in PATCHABLE_FIELDS; the
+    whole set is written in a single commit or not at all.
+    """
+    if owner_id != current_user.id and not current_user.admin:
+        abort(403)
+
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict) or not changes:
+        return jsonify(errors={'_': 'Expected a JSON object of fields.'}), 400
+
+    fields = PATCHABLE_FIELDS[type(record)]
+    values = {}
+    errors = {}
+    for name, value in changes.items():
+        if name not in fields:
+            errors[name] = 'Field cannot be edited.'
+            continue
+        try:
+            values[name] = fields[name](value)
+        except (TypeError, ValueError):
+            errors[name] = 'Invalid value.'
+    if errors:
+        return jsonify(errors=errors), 400
+
+    for name, value in values.items():
+        setattr(record, name, value)
+    db.session.commit()
+
+    return jsonify(id=record.id, updated=sorted(values))
+
+
 ################
 #### routes ####
 ################
@@ -64,11 +262,7 @@ def register():
         db.session.add(user)
         db.session.commit()
 
-        token = generate_confirmation_token(user.email)
-        confirm_url = url_for('user.confirm_email', token=token, _external=True)
-        html = render_template('user/activate.html', confirm_url=confirm_url)
-        subject = "Please confirm your email"
-        send_email(user.email, subject, html)
+        send_confirmation(user.email)
 
         login_user(user)
         flash('You registered and are now logged in. Welcome!', 'success')
@@ -85,8 +279,9 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
 
-        if user and bcrypt.check_password_hash(
+        if user and check_password_hash(
                 user.password, request.form['password']):
+            rehash_password(user, request.form['password'])
             login_user(user)
             flash('Welcome.', 'success')
             return redirect(url_for('user.profile', username=user.username))
@@ -109,16 +304,15 @@ def logout():
 @login_required
 @check_confirmed
 def changepassword():
-    user = User.query.filter_by(email=current_user.email).first()
+    user = get_cached_user(id=current_user.id)
     if not user:
         flash('Password successfully changed.', 'success')
         return redirect(url_for('user.logout'))
 
     form = ChangePasswordForm(request.form, prefix='pwd')
     if form.validate_on_submit():
-        user = User.query.filter_by(email=current_user.email).first()
         if user:
-            user.password = bcrypt.generate_password_hash(form.password.data)
+            user.password = generate_password_hash(form.password.data)
             db.session.commit()
             flash('Password successfully changed.', 'success')
             return redirect(url_for('user.profile', username=user.username))
@@ -163,69 +357,52 @@ def unconfirmed():
 @user_blueprint.route('/resend')
 @login_required
 def resend_confirmation():
-    token = generate_confirmation_token(current_user.email)
-    confirm_url = url_for('user.confirm_email', token=token, _external=True)
-    html = render_template('user/activate.html', confirm_url=confirm_url)
-    subject = "Please confirm your email"
-    send_email(current_user.email, subject, html)
+    send_confirmation(current_user.email)
     flash('A new confirmation email has been sent.', 'success')
     return redirect(url_for('user.unconfirmed'))
 
 
 @user_blueprint.route('/user/<username>')
 @login_required
+@query_budget(5)
+@read_replica
+@conditional_page('username', 'username')
 def profile(username):
-    user = User.query.filter_by(username=username).first()
+    # With the read model on, the owner's document carries everything the
+    # page shows; conditional_page has already looked up their id.
+    owner = g.page_owner
+    document = profile_document(owner.id) if owner is not None else None
+    if document is not None:
+        user = document_user(document)
+    else:
+        user = get_cached_user(username=username)
     if user == None:
         flash('User %s not found.' % username, 'danger')
         return redirect(url_for('main.home'))
+    # the document carries the label resolved when it was written
+    if document is not None:
+        gender = document['user'].get('gender', '')
+    else:
+        gender = lookup_label('gender', user.gender_id)
 
-    form = EditPersonalForm(request.form)
-
-    return render_template('user/profile.html', user=user, form=form)
-
-
-@user_blueprint.route('/user_edit_firstname', methods=['POST'])
-@login_required
-def user_edit_firstname():
-    user = User.query.filter_by(email=current_user.email).first()
-    user.firstname = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.profile', username=user.username))
-
-
-@user_blueprint.route('/user_edit_lasttname', methods=['POST'])
-@login_required
-def user_edit_lastname():
-    user = User.query.filter_by(email=current_user.email).first()
-    user.surname = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.profile', username=user.username))
-
+    genders = select_source('gender')
 
-@user_blueprint.route('/user_edit_dob', methods=['POST'])
-@login_required
-def user_edit_dob():
-    user = User.query.filter_by(email=current_user.email).first()
-    user.birthdate = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.profile', username=user.username))
+    return render_template('user/profile.html', user=user, genders=genders,
+                           gender=gender)
 
 
-@user_blueprint.route('/user_edit_gender', methods=['POST'])
+@user_blueprint.route('/user_patch', methods=['PATCH'])
 @login_required
-def user_edit_gender():
-    user = User.query.filter_by(email=current_user.email).first()
-    user.gender = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.profile', username=user.username))
+def user_patch():
+    user = get_cached_user(id=current_user.id)
+    return patch_record(user, user.id)
 
 
-@user_blueprint.route('/user/employment_add/<human_id>',
+@user_blueprint.route('/user/employment_add/<int:human_id>',
                       methods=['GET', 'POST'])
 @login_required
 def employment_add(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found.', 'danger')
         return redirect(url_for('main.home'))
@@ -262,29 +439,27 @@ def employment_add(human_id):
                            email=user.email, form=form, human_id=human_id)
 
 
-@user_blueprint.route('/employment_list/<human_id>', methods=['GET'])
+@user_blueprint.route('/employment_list/<int:human_id>', methods=['GET'])
 @login_required
+@query_budget(6)
+@read_replica
+@conditional_page('id', 'human_id')
 def employment_list(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found', 'danger')
         return redirect(url_for('main.home'))
 
-    emp = Employment.query.filter_by(human_id=user.id).order_by(
-        desc(Employment.start_date))
-
-    if emp == None:
-        flash('No employment details saved', 'danger')
-
-    data = {'employmentlist': emp}
-    form = EmploymentListForm(data=data)
+    content = list_fragment(Employment, user.id,
+                            'user/_employment_table.html', 'employment')
 
-    return render_template('user/employment_list.html', form=form,
-                           human_id=user.id)
+    return render_template('user/employment_list.html', content=content)
 
 
 @user_blueprint.route('/employment_edit/<emp_id>', methods=['GET'])
 @login_required
+@query_budget(6)
+@read_replica
 def employment_edit(emp_id):
     emp = Employment.query.filter_by(id=emp_id).first()
     if emp == None:
@@ -295,58 +470,18 @@ def employment_edit(emp_id):
     return render_template('user/employment_edit.html', emp=emp)
 
 
-@user_blueprint.route('/employment_edit_employer/<emp_id>', methods=['POST'])
+@user_blueprint.route('/employment_patch/<int:emp_id>', methods=['PATCH'])
 @login_required
-def employment_edit_employer(emp_id):
-    emp = Employment.query.filter_by(id=emp_id).first()
-    emp.employer = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.employment_list', human_id=emp.human_id))
+def employment_patch(emp_id):
+    emp = Employment.query.get_or_404(emp_id)
+    return patch_record(emp, emp.human_id)
 
 
-@user_blueprint.route('/employment_edit_position/<emp_id>', methods=['POST'])
-@login_required
-def employment_edit_position(emp_id):
-    emp = Employment.query.filter_by(id=emp_id).first()
-    emp.position = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.employment_list', human_id=emp.human_id))
-
-
-@user_blueprint.route('/employment_edit_description/<emp_id>',
-                      methods=['POST'])
-@login_required
-def employment_edit_description(emp_id):
-    emp = Employment.query.filter_by(id=emp_id).first()
-    emp.job_desc = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.employment_list', human_id=emp.human_id))
-
-
-@user_blueprint.route('/employment_edit_start_date/<emp_id>',
-                      methods=['POST'])
-@login_required
-def employment_edit_start_date(emp_id):
-    emp = Employment.query.filter_by(id=emp_id).first()
-    emp.start_date = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.employment_list', human_id=emp.human_id))
-
-
-@user_blueprint.route('/employment_edit_end_date/<emp_id>', methods=['POST'])
-@login_required
-def employment_edit_end_date(emp_id):
-    emp = Employment.query.filter_by(id=emp_id).first()
-    emp.end_date = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.employment_list', human_id=emp.human_id))
-
-
-@user_blueprint.route('/user/education_add/<human_id>',
+@user_blueprint.route('/user/education_add/<int:human_id>',
                       methods=['GET', 'POST'])
 @login_required
 def education_add(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found.', 'danger')
         return redirect(url_for('main.home'))
@@ -370,7 +505,8 @@ def education_add(human_id):
             start_date=start_date,
             end_date=end_date,
             accolades=form.accolades.data,
-            educational_institution_type=form.educational_institution_type_list.data
+            educational_institution_type_id=selected_id(
+                form.educational_institution_type_list)
         )
         db.session.add(ed)
         db.session.commit()
@@ -382,30 +518,27 @@ def education_add(human_id):
                            email=user.email, form=form)
 
 
-@user_blueprint.route('/education_list/<human_id>', methods=['GET'])
+@user_blueprint.route('/education_list/<int:human_id>', methods=['GET'])
 @login_required
+@query_budget(6)
+@read_replica
+@conditional_page('id', 'human_id')
 def education_list(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found', 'danger')
         return redirect(url_for('main.home'))
 
-    ed = Education.query.filter_by(human_id=user.id).order_by(
-        desc(Education.start_date))
-
-    if ed == None:
-        flash('No educational details saved', 'danger')
-
-    ed_data = {'educationlist': ed}
-
-    ed_form = EducationFormListForm(data=ed_data)
+    content = list_fragment(Education, user.id,
+                            'user/_education_table.html', 'education')
 
-    return render_template('user/education_list.html', human_id=human_id,
-                           ed_form=ed_form)
+    return render_template('user/education_list.html', content=content)
 
 
 @user_blueprint.route('/education_edit/<id>', methods=['GET'])
 @login_required
+@query_budget(6)
+@read_replica
 def education_edit(id):
     ed = Education.query.filter_by(id=id).first()
     if ed == None:
@@ -415,48 +548,18 @@ def education_edit(id):
     return render_template('user/education_edit.html', ed=ed)
 
 
-@user_blueprint.route('/education_edit_educational_institution/<id>',
-                      methods=['POST'])
-@login_required
-def education_edit_educational_institution(id):
-    ed = Education.query.filter_by(id=id).first()
-    ed.educational_institution = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.education_list', human_id=ed.human_id))
-
-
-@user_blueprint.route('/education_edit_course_studied/<id>', methods=['POST'])
-@login_required
-def education_edit_course_studied(id):
-    ed = Education.query.filter_by(id=id).first()
-    ed.course_studied = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.education_list', human_id=ed.human_id))
-
-
-@user_blueprint.route('/education_edit_start_date/<id>', methods=['POST'])
-@login_required
-def education_edit_start_date(id):
-    ed = Education.query.filter_by(id=id).first()
-    ed.start_date = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.education_list', human_id=ed.human_id))
-
-
-@user_blueprint.route('/education_edit_end_date/<id>', methods=['POST'])
+@user_blueprint.route('/education_patch/<int:id>', methods=['PATCH'])
 @login_required
-def education_end_start_date(id):
-    ed = Education.query.filter_by(id=id).first()
-    ed.end_date = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.education_list', human_id=ed.human_id))
+def education_patch(id):
+    ed = Education.query.get_or_404(id)
+    return patch_record(ed, ed.human_id)
 
 
-@user_blueprint.route('/user/publication_add/<human_id>',
+@user_blueprint.route('/user/publication_add/<int:human_id>',
                       methods=['GET', 'POST'])
 @login_required
 def publication_add(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found.', 'danger')
         return redirect(url_for('main.home'))
@@ -476,7 +579,8 @@ def publication_add(human_id):
             publisher=form.publisher.data,
             publication_url=form.publication_url.data,
             description=form.description.data,
-            publication_category=form.publication_category_list.data
+            publication_category_id=selected_id(
+                form.publication_category_list)
         )
         db.session.add(pub)
         db.session.commit()
@@ -488,110 +592,92 @@ def publication_add(human_id):
                            form=form)
 
 
-@user_blueprint.route('/user/publication_list/<human_id>', methods=['GET'])
+@user_blueprint.route('/user/publication_import/<int:human_id>',
+                      methods=['GET', 'POST'])
 @login_required
-def publication_list(human_id):
-    user = User.query.filter_by(id=human_id).first()
+def publication_import(human_id):
+    """Add the publications in an uploaded BibTeX or RIS file."""
+    user = get_cached_user(id=human_id)
     if user == None:
-        flash('User not found', 'danger')
+        flash('User not found.', 'danger')
         return redirect(url_for('main.home'))
+    if human_id != current_user.id and not current_user.admin:
+        abort(403)
 
-    pub = Publication.query.filter_by(human_id=human_id).order_by(
-        desc(Publication.publication_date))
+    form = PublicationImportForm()
 
-    if pub == None:
-        flash('No publication details saved', 'danger')
+    if form.validate_on_submit():
+        upload = form.file.data
+        lines = codecs.getreader('utf-8')(upload.stream, errors='replace')
+        first_line = next(lines, '')
+        format = detect_format(upload.filename, first_line)
+        if format is None:
+            flash('Please upload a BibTeX (.bib) or RIS (.ris) file.',
+                  'danger')
+            return render_template('user/publication_import.html',
+                                   human_id=human_id, form=form)
+
+        report = import_publications(
+            human_id, itertools.chain([first_line], lines), format)
+        flash('%d publications imported, %d duplicates and %d entries '
+              'without a title skipped.' % (report.imported,
+                                            report.duplicates,
+                                            report.invalid), 'success')
+        if report.error:
+            flash('The import stopped at a malformed entry: %s.'
+                  % report.error, 'danger')
 
-    pub_data = {'publicationlist': pub}
-    pub_form = PublicationFormListForm(data=pub_data)
+        return redirect(url_for('user.publication_list', human_id=human_id))
 
-    return render_template('user/publication_list.html', human_id=human_id,
-                           pub_form=pub_form)
+    return render_template('user/publication_import.html', human_id=human_id,
+                           form=form)
 
 
-@user_blueprint.route('/publication_edit/<id>', methods=['GET'])
+@user_blueprint.route('/user/publication_list/<int:human_id>', methods=['GET'])
 @login_required
-def publication_edit(id):
-    pub = Publication.query.filter_by(id=id).first()
-    if pub == None:
-        flash('No Publication Details.  Please add', 'danger')
+@query_budget(6)
+@read_replica
+@conditional_page('id', 'human_id')
+def publication_list(human_id):
+    user = get_cached_user(id=human_id)
+    if user == None:
+        flash('User not found', 'danger')
         return redirect(url_for('main.home'))
 
-    form = PublicationFormListForm(pub=pub)
-
-    return render_template('user/publication_edit.html', pub=pub, form=form)
-
-
-@user_blueprint.route('/publication_edit_title/<id>', methods=['POST'])
-@login_required
-def publication_edit_title(id):
-    pub = Publication.query.filter_by(id=id).first()
-    pub.title = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
-
-
-@user_blueprint.route('/publication_edit_authors/<id>', methods=['POST'])
-@login_required
-def publication_edit_authors(id):
-    pub = Publication.query.filter_by(id=id).first()
-    pub.authors = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
-
-
-@user_blueprint.route('/publication_edit_publisher/<id>', methods=['POST'])
-@login_required
-def publication_edit_publisher(id):
-    pub = Publication.query.filter_by(id=id).first()
-    pub.publisher = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
-
+    content = list_fragment(Publication, user.id,
+                            'user/_publication_table.html', 'publications')
 
-@user_blueprint.route('/publication_edit_publication_date/<id>',
-                      methods=['POST'])
-@login_required
-def publication_edit_publication_date(id):
-    pub = Publication.query.filter_by(id=id).first()
-    pub.publication_date = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
+    return render_template('user/publication_list.html', content=content)
 
 
-@user_blueprint.route('/publication_edit_description/<id>', methods=['POST'])
+@user_blueprint.route('/publication_edit/<id>', methods=['GET'])
 @login_required
-def publication_edit_description(id):
+@query_budget(6)
+@read_replica
+def publication_edit(id):
     pub = Publication.query.filter_by(id=id).first()
-    pub.description = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
+    if pub == None:
+        flash('No Publication Details.  Please add', 'danger')
+        return redirect(url_for('main.home'))
 
+    categories = select_source('publication_category')
 
-@user_blueprint.route('/publication_edit_publication_url/<id>',
-                      methods=['POST'])
-@login_required
-def publication_edit_publication_url(id):
-    pub = Publication.query.filter_by(id=id).first()
-    pub.publication_url = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
+    return render_template('user/publication_edit.html', pub=pub,
+                           categories=categories)
 
 
-@user_blueprint.route('/publication_edit_publication_category/<id>',
-                      methods=['POST'])
+@user_blueprint.route('/publication_patch/<int:id>', methods=['PATCH'])
 @login_required
-def publication_edit_publication_category(id):
-    pub = Publication.query.filter_by(id=id).first()
-    pub.publication_category = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.publication_list', human_id=pub.human_id))
+def publication_patch(id):
+    pub = Publication.query.get_or_404(id)
+    return patch_record(pub, pub.human_id)
 
 
-@user_blueprint.route('/user/patent_add/<human_id>', methods=['GET', 'POST'])
+@user_blueprint.route('/user/patent_add/<int:human_id>',
+                      methods=['GET', 'POST'])
 @login_required
 def patent_add(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found.', 'danger')
         return redirect(url_for('main.home'))
@@ -611,8 +697,8 @@ def patent_add(human_id):
             patent_number=form.patent_number.data,
             inventors=form.inventors.data,
             issue_date=issue_date,
-            patent_office=form.patent_office_list.data,
-            patent_status=form.patent_status_list.data,
+            patent_office_id=selected_id(form.patent_office_list),
+            patent_status_id=selected_id(form.patent_status_list),
             patent_url=form.patent_url.data
         )
         db.session.add(pat)
@@ -625,115 +711,130 @@ def patent_add(human_id):
                            form=form)
 
 
-@user_blueprint.route('/user/patent_list/<human_id>', methods=['GET'])
+@user_blueprint.route('/user/patent_list/<int:human_id>', methods=['GET'])
 @login_required
+@query_budget(6)
+@read_replica
+@conditional_page('id', 'human_id')
 def patent_list(human_id):
-    user = User.query.filter_by(id=human_id).first()
+    user = get_cached_user(id=human_id)
     if user == None:
         flash('User not found', 'danger')
         return redirect(url_for('main.home'))
 
-    pat = Patent.query.filter_by(human_id=human_id).order_by(desc(Patent.issue_date))
-    if pat == None:
-        flash('No patent details saved')
+    content = list_fragment(Patent, user.id,
+                            'user/_patent_table.html', 'patents')
 
-    pat_data = {'patentlist': pat}
-    pat_form = PatentFormListForm(data=pat_data)
-
-    return render_template('user/patent_list.html', human_id=human_id,
-                           pat_form=pat_form)
+    return render_template('user/patent_list.html', content=content)
 
 @user_blueprint.route('/patent_edit/<id>', methods=['GET'])
 @login_required
+@query_budget(6)
+@read_replica
 def patent_edit(id):
     pat = Patent.query.filter_by(id=id).first()
     if pat == None:
         flash('No Patent Details.  Please add', 'danger')
         return redirect(url_for('main.home'))
 
-    return render_template('user/patent_edit.html', pat=pat)
-
-
-@user_blueprint.route('/patent_edit_title/<id>', methods=['POST'])
-@login_required
-def patent_edit_title(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.title = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
-
-
-@user_blueprint.route('/patent_edit_authors/<id>', methods=['POST'])
-@login_required
-def patent_edit_authors(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.authors = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
-
+    offices = select_source('patent_office')
+    statuses = select_source('patent_status')
 
-@user_blueprint.route('/patent_edit_publisher/<id>', methods=['POST'])
-@login_required
-def patent_edit_publisher(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.publisher = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
-
-
-@user_blueprint.route('/patent_edit_patent_date/<id>', methods=['POST'])
-@login_required
-def patent_edit_patent_date(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.patent_date = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
-
-
-@user_blueprint.route('/patent_edit_description/<id>', methods=['POST'])
-@login_required
-def patent_edit_description(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.description = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
-
-
-@user_blueprint.route('/patent_edit_patent_url/<id>', methods=['POST'])
-@login_required
-def patent_edit_patent_url(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.patent_url = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
+    return render_template('user/patent_edit.html', pat=pat, offices=offices,
+                           statuses=statuses)
 
 
-@user_blueprint.route('/patent_edit_patent_category/<id>', methods=['POST'])
+@user_blueprint.route('/patent_patch/<int:id>', methods=['PATCH'])
 @login_required
-def patent_edit_patent_category(id):
-    pat = Patent.query.filter_by(id=id).first()
-    pat.patent_category = request.form['value']
-    db.session.commit()
-    return redirect(url_for('user.patent_list', human_id=pat.human_id))
+def patent_patch(id):
+    pat = Patent.query.get_or_404(id)
+    return patch_record(pat, pat.human_id)
 
 
-@user_blueprint.route('/user/academic_record/<human_id>', methods=['GET'])
+@user_blueprint.route('/user/academic_record/<int:human_id>', methods=['GET'])
 @login_required
+@query_budget(10)
+@read_replica
+@conditional_page('id', 'human_id')
 def academic_record(human_id):
-    ed = Education.query.filter_by(human_id=human_id).order_by(desc(Education.start_date))
-    ed_data = {'educationlist': ed}
-    ed_form = EducationFormListForm(data=ed_data)
-
-    pat = Patent.query.filter_by(human_id=human_id).order_by(desc(Patent.issue_date))
-    pat_data = {'patentlist': pat}
-    pat_form = PatentFormListForm(data=pat_data)
-
-    pub = Publication.query.filter_by(human_id=human_id).order_by(desc(Publication.publication_date))
-    pub_data = {'publicationlist': pub}
-    pub_form = PublicationFormListForm(data=pub_data)
-
-    return render_template('user/academic_record.html',
-                           human_id=human_id,
-                           ed_form=ed_form,
-                           pat_form=pat_form,
-                           pub_form=pub_form)
+    # One snapshot rendered as one fragment, so the sections cannot come
+    # from different versions of the user's records.
+    def load():
+        record = profile_academic_record(human_id)
+        return {'education': record.education, 'patents': record.patents,
+                'publications': record.publications}
+
+    content = render_fragment('user/_academic_record.html', human_id,
+                              load=load)
+
+    return render_template('user/academic_record.html', content=content)
+
+
+# Record types served by the JSON list endpoint, by URL name.
+RECORD_TYPES = {
+    'employment': Employment,
+    'education': Education,
+    'publication': Publication,
+    'patent': Patent,
+}
+
+
+@user_blueprint.route('/records/<record_type>/<int:human_id>',
+                      methods=['GET'])
+@login_required
+@query_budget(5)
+@read_replica
+def record_list_json(record_type, human_id):
+    model = RECORD_TYPES.get(record_type)
+    if model is None:
+        abort(404)
+
+    page = requested_page(model, human_id)
+    records = [dict((field, value.isoformat()
+                     if isinstance(value, datetime.date) else value)
+                    for field, value in row._asdict().items())
+               for row in page.rows]
+
+    return jsonify(records=records, next_cursor=page.next_cursor)
+
+
+@user_blueprint.route('/user/export/<int:human_id>.<format>', methods=['GET'])
+@login_required
+@read_replica
+def export(human_id, format):
+    """A user's CV as JSON Lines, CSV or HTML, streamed as it is read."""
+    if format not in EXPORT_FORMATS:
+        abort(404)
+    chunks = export_cv(human_id, format)
+    if chunks is None:
+        abort(404)
+
+    response = Response(stream_with_context(chunks),
+                        mimetype=EXPORT_FORMATS[format][1])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="cv-%d.%s"' % (human_id, format)
+    return response
+
+
+@user_blueprint.route('/search', methods=['GET'])
+@login_required
+@query_budget(5)
+def search_records():
+    """Ranked full-text search over every user's records, as JSON.
+
+    Takes the words to look for in `q`, optionally narrowed to record
+    types (`type`, repeatable) and one user (`human_id`), plus `page`
+    and `per_page`.
+    """
+    record_types = request.args.getlist('type')
+    if any(record_type not in SEARCH_FIELDS for record_type in record_types):
+        abort(400)
+
+    results = search(request.args.get('q', ''),
+                     record_types=record_types,
+                     human_id=request.args.get('human_id', type=int),
+                     page=request.args.get('page', 1, type=int),
+                     per_page=request.args.get('per_page', type=int))
+
+    return jsonify(results=[hit._asdict() for hit in results.hits],
+                   next_page=results.next_page)
@@ -1,10 +1,20 @@
 # project/util.py
 
 
+import asyncore
+import smtpd
+import threading
+from contextlib import contextmanager
+
 from flask.ext.testing import TestCase
 
 from project import app, db
+from project.cache import user_cache
+from project.email import mail_pool
+from project.fragments import fragment_cache
+from project.profiles import profile_store
 from project.models import User
+from project.queries import capture_queries
 
 
 class BaseTestCase(TestCase):
@@ -22,3 +32,73 @@ class BaseTestCase(TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        user_cache.clear()
+        fragment_cache.reset()
+        profile_store.reset()
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fail if the block, test client requests included, runs more
+        than `limit` SQL statements."""
+        with capture_queries() as log:
+            yield log
+        if len(log) > limit:
+            self.fail('%d statements run, %d allowed:\n%s' % (
+                len(log), limit, log.describe()))
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """SMTP server on a free localhost port that keeps what it receives.
+
+    Used as a context manager it runs in a background thread and points
+    the app's mail settings at itself, restoring them on exit.  Set
+    `reject` to an SMTP reply such as '451 try later' to refuse messages.
+    """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        self.reject = None
+        self._running = False
+        self._thread = None
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if self.reject:
+            return self.reject
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.01, count=1)
+
+    def __enter__(self):
+        state = app.extensions['mail']
+        self._saved = dict((name, getattr(state, name)) for name in (
+            'server', 'port', 'use_tls', 'use_ssl', 'username', 'password',
+            'suppress', 'debug'))
+        state.server, state.port = '127.0.0.1', self.port
+        state.use_tls = state.use_ssl = state.suppress = False
+        state.username = state.password = None
+        state.debug = 0
+        mail_pool.close_all()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        mail_pool.close_all()
+        self._running = False
+        self._thread.join()
+        self.close()
+        asyncore.close_all()
+        for name, value in self._saved.items():
+            setattr(app.extensions['mail'], name, value)
@@ -0,0 +1,131 @@
+# tests/test_assets.py
+
+
+import gzip
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from project import app
+from project.assets import (
+    build,
+    manifest_cache,
+    minify_css,
+    minify_js,
+    brotli
+)
+from project.util import BaseTestCase
+
+
+class TestMinify(unittest.TestCase):
+
+    def test_minify_js_keeps_literals(self):
+        # Ensure strings and regexes survive while comments go.
+        source = (
+            "/*! license */\n"
+            "// note\n"
+            "var a = 'x  // y', b = /[/]\\/*/g; /* gone */\n"
+            "return a  /  2;\n")
+        self.assertEqual(
+            minify_js(source),
+            "/*! license */\n"
+            "var a='x  // y',b=/[/]\\/*/g;return a/2;")
+
+    def test_minify_js_keeps_needed_breaks_and_spaces(self):
+        # Ensure semicolon-less lines and `+ +` stay apart.
+        self.assertEqual(minify_js("a = b\n++c\nx = y + +z"),
+                         "a=b\n++c\nx=y+ +z")
+        self.assertEqual(minify_js("var   x\nin  y"), "var x\nin y")
+
+    def test_minify_css(self):
+        # Ensure whitespace goes but selectors and strings keep theirs.
+        self.assertEqual(
+            minify_css("a :hover ,b > c {\n  color: red ;\n"
+                       "  content: 'a, b';\n}\n/* x */"),
+            "a :hover,b > c{color:red;content:'a, b'}\n")
+
+
+class TestAssets(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Minifying takes a while, so the bundles are built once.
+        cls.folder = tempfile.mkdtemp()
+        for name in os.listdir(app.static_folder):
+            shutil.copy(os.path.join(app.static_folder, name), cls.folder)
+        with app.app_context():
+            cls.manifest = build(cls.folder)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def setUp(self):
+        super(TestAssets, self).setUp()
+        self.static_folder = app.static_folder
+        app.static_folder = self.folder
+        manifest_cache.reset()
+
+    def tearDown(self):
+        app.static_folder = self.static_folder
+        manifest_cache.reset()
+        super(TestAssets, self).tearDown()
+
+    def bundle_url(self, name):
+        html = self.client.get('/login').data.decode('utf-8')
+        return re.search(r'/static/dist/%s\.\w+\.%s' % tuple(
+            name.split('.')), html).group()
+
+    def test_build_is_reproducible(self):
+        # Ensure the same sources build the same fingerprinted files.
+        self.assertEqual(build(self.folder), self.manifest)
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.folder, self.manifest['app.js'] + '.gz')))
+
+    def test_pages_link_fingerprinted_bundles(self):
+        # Ensure pages load the bundles and url_for maps single files.
+        html = self.client.get('/login').data.decode('utf-8')
+        self.assertIn('/static/' + self.manifest['app.js'], html)
+        self.assertIn('/static/' + self.manifest['app.css'], html)
+        self.assertNotIn('bootstrap-editable.js', html)
+        with app.test_request_context():
+            from flask import url_for
+            self.assertEqual(url_for('static', filename='main.js'),
+                             '/static/' + self.manifest['main.js'])
+
+    def test_gzip_is_negotiated(self):
+        # Ensure a client accepting gzip gets the precompressed file.
+        url = self.bundle_url('app.js')
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertTrue(response.mimetype.endswith('javascript'))
+        plain = self.client.get(url)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=io.BytesIO(response.data)).read(),
+            plain.data)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        # Ensure brotli wins when the client accepts both encodings.
+        url = self.bundle_url('app.css')
+        response = self.client.get(
+            url, headers={'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.data),
+                         self.client.get(url).data)
+
+    def test_unbuilt_files_are_served_as_before(self):
+        # Ensure source files keep the default static caching.
+        response = self.client.get('/static/main.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+
+if __name__ == '__main__':
+    unittest.main()
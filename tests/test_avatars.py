@@ -0,0 +1,83 @@
+# tests/test_avatars.py
+
+
+import shutil
+import struct
+import tempfile
+import unittest
+
+from project import app, db
+from project.avatars import avatar_key, identicon
+from project.models import User
+from project.util import BaseTestCase
+
+
+class TestAvatars(BaseTestCase):
+
+    def setUp(self):
+        super(TestAvatars, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.avatar_dir = app.config['AVATAR_DIR']
+        app.config['AVATAR_DIR'] = self.folder
+
+    def tearDown(self):
+        app.config['AVATAR_DIR'] = self.avatar_dir
+        shutil.rmtree(self.folder)
+        super(TestAvatars, self).tearDown()
+
+    def test_identicon_is_a_deterministic_png(self):
+        # Ensure the same key always draws the same image.
+        key = avatar_key('ad1@min.com')
+        image = identicon(key, 64)
+        self.assertTrue(image.startswith(b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(struct.unpack('>II', image[16:24]), (64, 64))
+        self.assertEqual(identicon(key, 64), image)
+        self.assertNotEqual(identicon(avatar_key('other@min.com'), 64), image)
+
+    def test_url_is_stored_and_local(self):
+        # Ensure users get a stored local URL, snapped to a served size.
+        user = User.query.get(1)
+        self.assertEqual(user.avatar_url,
+                         '/avatar/' + avatar_key('ad1@min.com'))
+        self.assertEqual(user.avatar(128), user.avatar_url + '/128.png')
+        self.assertEqual(user.avatar(40), user.avatar_url + '/50.png')
+        self.assertEqual(user.avatar(1000), user.avatar_url + '/256.png')
+
+    def test_url_without_stored_one(self):
+        # Ensure users from before the column existed get an image that
+        # is served until their URL is backfilled.
+        db.session.execute(User.__table__.update().values(avatar_url=None))
+        db.session.commit()
+        user = User.query.get(1)
+        self.assertIsNone(user.avatar_url)
+        url = user.avatar(50)
+        self.assertEqual(url, '/static/avatar-placeholder.png')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+
+    def test_avatar_is_served_with_immutable_caching(self):
+        # Ensure an avatar is generated once and cached for good.
+        url = User.query.get(1).avatar(50)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.data, identicon(url.split('/')[2], 50))
+
+        db.session.delete(User.query.get(1))
+        db.session.commit()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_unknown_avatars_are_not_generated(self):
+        # Ensure only users' avatars in configured sizes are served.
+        url = User.query.get(1).avatar_url
+        self.assertEqual(self.client.get(url + '/51.png').status_code, 404)
+        self.assertEqual(self.client.get(
+            '/avatar/0123456789abcdef0123/50.png').status_code, 404)
+        self.assertEqual(self.client.get(
+            '/avatar/not-a-key/50.png').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+# tests/test_bibliography.py
+
+
+import datetime
+import io
+import unittest
+
+from project import db
+from project.bibliography import (
+    parse_bibtex,
+    parse_ris,
+    from_bibtex,
+    from_ris,
+    detect_format,
+    title_key,
+    import_publications
+)
+from project.cache import invalidate_lookups, lookup_label
+from project.models import Publication, User
+from project.search import search
+from project.seed import seed_lookup_tables
+from project.util import BaseTestCase
+
+
+BIBTEX = u'''
+@string{acm = "Communications of the {ACM}"}
+@comment{exported from a reference manager}
+
+@article{knuth74,
+  author = {Donald E. Knuth and Ole-Johan Dahl},
+  title = {Structured Programming with {\\tt go to} Statements},
+  journal = acm # " (CACM)",
+  year = 1974,
+  month = dec,
+  doi = {10.1145/356635.356640}
+}
+
+@book{proceedings,
+  editor = "Andr{\\'e} Weil",
+  title = "Collected Papers",
+  year = "1979"
+}
+'''
+
+RIS = u'''TY  - JOUR
+AU  - Hopper, Grace
+AU  - Mauchly, John
+TI  - The Education of a Computer
+T2  - Proceedings of the ACM
+PY  - 1952/05/02
+AB  - On compiling
+  routines.
+ER  -
+
+TY  - EDBOOK
+TI  - Readings
+ER  -
+'''
+
+
+class TestParsing(unittest.TestCase):
+
+    # Ensure BibTeX entries are read with macros, accents and braces resolved
+    def test_parse_bibtex(self):
+        entries = list(parse_bibtex(io.StringIO(BIBTEX)))
+        self.assertEqual([kind for kind, fields in entries],
+                         ['article', 'book'])
+        article = entries[0][1]
+        self.assertEqual(article['title'],
+                         'Structured Programming with go to Statements')
+        self.assertEqual(article['journal'],
+                         'Communications of the ACM (CACM)')
+        self.assertEqual(article['month'], '12')
+        self.assertEqual(entries[1][1]['editor'], u'Andr\xe9 Weil')
+
+    # Ensure RIS entries collect repeated tags and continuation lines
+    def test_parse_ris(self):
+        entries = list(parse_ris(io.StringIO(RIS)))
+        self.assertEqual([kind for kind, fields in entries],
+                         ['JOUR', 'EDBOOK'])
+        fields = entries[0][1]
+        self.assertEqual(fields['AU'], ['Hopper, Grace', 'Mauchly, John'])
+        self.assertEqual(fields['AB'], 'On compiling routines.')
+
+    # Ensure a truncated BibTeX file is reported rather than half-read
+    def test_parse_bibtex_unterminated(self):
+        with self.assertRaises(ValueError):
+            list(parse_bibtex(io.StringIO(u'@article{a, title={Open')))
+
+    # Ensure entries map onto Publication columns and categories
+    def test_mapping(self):
+        article, book = [from_bibtex(*entry) for entry in
+                         parse_bibtex(io.StringIO(BIBTEX))]
+        self.assertEqual(article['authors'],
+                         'Donald E. Knuth, Ole-Johan Dahl')
+        self.assertEqual(article['publication_date'],
+                         datetime.datetime(1974, 12, 1))
+        self.assertEqual(article['publication_url'],
+                         'https://doi.org/10.1145/356635.356640')
+        self.assertEqual(article['category'], 'Peer-reviewed publications')
+        self.assertEqual(book['category'], 'Books - edited')
+
+        journal, edited = [from_ris(*entry) for entry in
+                           parse_ris(io.StringIO(RIS))]
+        self.assertEqual(journal['publication_date'],
+                         datetime.datetime(1952, 5, 2))
+        self.assertEqual(journal['publisher'], 'Proceedings of the ACM')
+        self.assertEqual(edited['category'], 'Books - edited')
+
+    # Ensure the format is told from the file name, then the first line
+    def test_detect_format(self):
+        self.assertEqual(detect_format('refs.bib'), 'bibtex')
+        self.assertEqual(detect_format('refs.RIS'), 'ris')
+        self.assertEqual(detect_format('refs.txt', '@article{a,'), 'bibtex')
+        self.assertEqual(detect_format('refs.txt', 'TY  - JOUR'), 'ris')
+        self.assertEqual(detect_format('refs.txt', 'hello'), None)
+
+    # Ensure title keys ignore case, accents and punctuation but not year
+    def test_title_key(self):
+        date = datetime.datetime(2001, 1, 1)
+        self.assertEqual(title_key(u'Caf\xe9: A Study.', date),
+                         title_key(u'cafe a study', date))
+        self.assertNotEqual(title_key(u'Cafe', date),
+                            title_key(u'Cafe', datetime.datetime(2002, 1, 1)))
+
+
+class TestImport(BaseTestCase):
+
+    def setUp(self):
+        super(TestImport, self).setUp()
+        seed_lookup_tables()
+
+    def tearDown(self):
+        super(TestImport, self).tearDown()
+        invalidate_lookups()
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def titles(self):
+        return sorted(title for title, in db.session.query(Publication.title)
+                      .filter(Publication.human_id == 1))
+
+    # Ensure entries are inserted with their category, indexed and versioned
+    def test_import(self):
+        version = User.query.get(1).records_version
+        report = import_publications(1, io.StringIO(BIBTEX), 'bibtex')
+        self.assertEqual((report.imported, report.duplicates,
+                          report.invalid, report.error), (2, 0, 0, None))
+
+        article = Publication.query.filter_by(
+            title='Structured Programming with go to Statements').one()
+        self.assertEqual(lookup_label('publication_category',
+                                      article.publication_category_id),
+                         'Peer-reviewed publications')
+        db.session.expire_all()
+        self.assertNotEqual(User.query.get(1).records_version, version)
+        self.assertEqual(len(search('structured').hits), 1)
+
+    # Ensure entries the user already has, or repeats, are skipped
+    def test_duplicates(self):
+        db.session.add(Publication(
+            human_id=1, title='The education of a computer!',
+            publication_date=datetime.datetime(1952, 1, 1)))
+        db.session.commit()
+
+        report = import_publications(1, io.StringIO(RIS + RIS), 'ris')
+        self.assertEqual((report.imported, report.duplicates),
+                         (1, 3))
+        self.assertEqual(self.titles(),
+                         ['Readings', 'The education of a computer!'])
+
+    # Ensure entries are committed in batches of the given size
+    def test_batches(self):
+        commits = []
+        original = db.session.commit
+
+        def commit():
+            commits.append(Publication.query.count())
+            original()
+
+        entries = u''.join(u'@misc{e%d, title={Entry %d}}\n' % (n, n)
+                           for n in range(5))
+        db.session.commit = commit
+        try:
+            report = import_publications(1, io.StringIO(entries), 'bibtex',
+                                         batch_size=2)
+        finally:
+            del db.session.commit
+        self.assertEqual(report.imported, 5)
+        self.assertEqual(commits, [2, 4, 5])
+
+    # Ensure a malformed entry stops the import, keeping what came before
+    def test_malformed_entry(self):
+        entries = u'@misc{a, title={Kept}}\n@misc{b, title {Lost}}\n'
+        report = import_publications(1, io.StringIO(entries), 'bibtex')
+        self.assertEqual(report.imported, 1)
+        self.assertTrue(report.error)
+        self.assertEqual(self.titles(), ['Kept'])
+
+    # Ensure the upload form imports the file into the user's publications
+    def test_upload(self):
+        self.login()
+        response = self.client.post(
+            '/user/publication_import/1',
+            data=dict(file=(io.BytesIO(RIS.encode('utf-8')), 'refs.txt')),
+            follow_redirects=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'2 publications imported', response.data)
+        self.assertEqual(self.titles(),
+                         ['Readings', 'The Education of a Computer'])
+
+    # Ensure a file that is neither BibTeX nor RIS is refused
+    def test_upload_unknown_format(self):
+        self.login()
+        response = self.client.post(
+            '/user/publication_import/1',
+            data=dict(file=(io.BytesIO(b'hello'), 'refs.txt')),
+            follow_redirects=True
+        )
+        self.assertIn(b'Please upload a BibTeX', response.data)
+        self.assertEqual(self.titles(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
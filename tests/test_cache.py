@@ -0,0 +1,136 @@
+# tests/test_cache.py
+
+
+import unittest
+
+from project import db
+from project.cache import (
+    TTLCache,
+    lookup_cache,
+    lookup_rows,
+    lookup_label,
+    user_cache,
+    get_cached_user
+)
+from project.models import PatentStatus, User
+from project.util import BaseTestCase
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_get_loads_once_until_expiry(self):
+        # Ensure the loader only runs on a miss
+        cache = TTLCache(ttl=60)
+        calls = []
+        loader = lambda: calls.append(1) or 'value'
+        self.assertEqual(cache.get('key', loader), 'value')
+        self.assertEqual(cache.get('key', loader), 'value')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_expired_entries_are_reloaded(self):
+        # Ensure a zero ttl never serves a cached value
+        cache = TTLCache(ttl=0)
+        calls = []
+        loader = lambda: calls.append(1) or 'value'
+        cache.get('key', loader)
+        cache.get('key', loader)
+        self.assertEqual(len(calls), 2)
+
+    def test_invalidate(self):
+        # Ensure invalidated keys are reloaded
+        cache = TTLCache(ttl=60)
+        cache.get('key', lambda: 'old')
+        cache.invalidate('key')
+        self.assertEqual(cache.get('key', lambda: 'new'), 'new')
+
+
+class TestLookupCache(BaseTestCase):
+
+    def setUp(self):
+        super(TestLookupCache, self).setUp()
+        self.app.config['LOOKUP_CACHE_TTL'] = 60
+        lookup_cache.invalidate()
+        db.session.add(PatentStatus(status='Patent Issued'))
+        db.session.commit()
+
+    def tearDown(self):
+        lookup_cache.invalidate()
+        self.app.config['LOOKUP_CACHE_TTL'] = 0
+        super(TestLookupCache, self).tearDown()
+
+    def test_lookup_rows_are_cached(self):
+        # Ensure lookup rows are served from the cache until invalidated
+        rows = lookup_rows('patent_status')
+        self.assertEqual([row.label for row in rows], ['Patent Issued'])
+        db.session.add(PatentStatus(status='Patent Pending'))
+        db.session.commit()
+        self.assertEqual(len(lookup_rows('patent_status')), 1)
+        lookup_cache.invalidate()
+        self.assertEqual(len(lookup_rows('patent_status')), 2)
+
+    def test_lookup_label(self):
+        # Ensure labels resolve by id and unknown ids render blank
+        row = lookup_rows('patent_status')[0]
+        self.assertEqual(lookup_label('patent_status', row.id),
+                         'Patent Issued')
+        self.assertEqual(lookup_label('patent_status', None), '')
+
+
+class TestUserCache(BaseTestCase):
+
+    def test_repeat_lookups_hit_the_cache(self):
+        # Ensure the same user is found by id, email and username
+        user = get_cached_user(email='ad1@min.com')
+        db.session.remove()
+        self.assertEqual(get_cached_user(id=user.id).email, 'ad1@min.com')
+        self.assertEqual(get_cached_user(username='ad1@min.com').id, user.id)
+        self.assertEqual(user_cache.stats()['hits'], 2)
+
+    def test_writes_invalidate_the_cache(self):
+        # Ensure a committed change is visible to the next lookup
+        user = get_cached_user(email='ad1@min.com')
+        user_id = user.id
+        user.firstname = 'Ada'
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(get_cached_user(id=user_id).firstname, 'Ada')
+
+    def test_auth_fields_are_not_cached(self):
+        # Ensure a flag another process changed is seen on a cache hit
+        user_id = get_cached_user(email='ad1@min.com').id
+        db.session.execute(User.__table__.update().values(
+            admin=True, confirmed=True))
+        db.session.commit()
+        db.session.remove()
+        user = get_cached_user(id=user_id)
+        self.assertEqual(user_cache.stats()['hits'], 1)
+        self.assertTrue(user.admin)
+        self.assertTrue(user.confirmed)
+
+    def test_entries_expire(self):
+        # Ensure a user is re-read once its entry is older than the ttl
+        user_cache.ttl = 0
+        try:
+            get_cached_user(email='ad1@min.com')
+            get_cached_user(email='ad1@min.com')
+            self.assertEqual(user_cache.stats()['hits'], 0)
+            self.assertEqual(user_cache.stats()['misses'], 2)
+        finally:
+            user_cache.ttl = self.app.config['USER_CACHE_TTL']
+
+    def test_cache_is_bounded(self):
+        # Ensure least recently used users are evicted
+        user_cache.maxsize = 1
+        try:
+            user_cache.put({'id': 1, 'email': 'a', 'username': 'a'})
+            user_cache.put({'id': 2, 'email': 'b', 'username': 'b'})
+            self.assertIsNone(user_cache.get('email', 'a'))
+            self.assertEqual(user_cache.get('email', 'b')['id'], 2)
+        finally:
+            user_cache.maxsize = self.app.config['USER_CACHE_SIZE']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# tests/test_compression.py
+
+
+import gzip
+import io
+import unittest
+
+from flask import Flask, Response
+
+from project import app, db
+from project.compression import (
+    CompressionMiddleware,
+    compression_stats,
+    brotli
+)
+from project.models import Employment
+from project.util import BaseTestCase
+
+
+class TestCompression(BaseTestCase):
+
+    def setUp(self):
+        super(TestCompression, self).setUp()
+        compression_stats.clear()
+        db.session.add_all([
+            Employment(human_id=1, employer='Employer %d' % i,
+                       position='Position %d' % i) for i in range(20)])
+        db.session.commit()
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def get(self, url, encoding='gzip', **headers):
+        headers['Accept-Encoding'] = encoding
+        return self.client.get(url, headers=headers)
+
+    def test_html_is_gzipped(self):
+        # Ensure a large page is gzipped for a client that accepts it.
+        with self.client:
+            self.login()
+            plain = self.get('/employment_list/1', encoding='identity')
+            response = self.get('/employment_list/1')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        body = gzip.GzipFile(fileobj=io.BytesIO(response.data)).read()
+        self.assertEqual(body, plain.data)
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.data))
+
+        stats = compression_stats.stats()
+        self.assertEqual(stats['compressed'], {'gzip': 1})
+        self.assertEqual(stats['bytes_in'], len(plain.data))
+        self.assertEqual(stats['bytes_saved'],
+                         len(plain.data) - len(response.data))
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        # Ensure brotli is used when the client accepts it.
+        with self.client:
+            self.login()
+            response = self.get('/employment_list/1', encoding='gzip, br')
+            plain = self.get('/employment_list/1', encoding='identity')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.data), plain.data)
+
+    def test_small_responses_are_not_compressed(self):
+        # Ensure bodies below COMPRESS_MIN_SIZE go out as they are.
+        app.config['COMPRESS_MIN_SIZE'] = 10 ** 6
+        with self.client:
+            self.login()
+            response = self.get('/employment_list/1')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(compression_stats.stats()['compressed'], {})
+        app.config['COMPRESS_MIN_SIZE'] = 500
+
+    def test_streamed_responses_pass_through(self):
+        # Ensure a streamed response is neither buffered nor compressed.
+        streaming = Flask(__name__)
+        streaming.config.update(app.config)
+
+        @streaming.route('/')
+        def stream():
+            return Response((b'x' * 1000 for i in range(3)),
+                            mimetype='text/plain')
+
+        streaming.wsgi_app = CompressionMiddleware(streaming)
+        response = streaming.test_client().get(
+            '/', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(len(response.data), 3000)
+
+    def test_compressed_etag_still_revalidates(self):
+        # Ensure the weakened ETag of a gzipped page still answers 304.
+        with self.client:
+            self.login()
+            self.get('/employment_list/1')
+            etag = self.get('/employment_list/1').headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            response = self.get('/employment_list/1',
+                                **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
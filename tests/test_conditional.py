@@ -0,0 +1,171 @@
+# tests/test_conditional.py
+
+
+import datetime
+import unittest
+
+from werkzeug.http import http_date
+
+from project import db
+from project.models import User, Employment, Publication
+from project.util import BaseTestCase
+
+
+class TestRecordVersions(BaseTestCase):
+
+    def version(self, human_id=1):
+        return db.session.query(User.records_version) \
+            .filter_by(id=human_id).scalar()
+
+    def test_record_writes_bump_owner_version(self):
+        # Ensure adding, editing and deleting a record bump its owner.
+        employment = Employment(human_id=1, employer='Acme', position='Dev')
+        db.session.add(employment)
+        db.session.commit()
+        self.assertEqual(self.version(), 1)
+        self.assertIsNotNone(employment.updated_at)
+
+        employment.position = 'Lead'
+        db.session.commit()
+        self.assertEqual(self.version(), 2)
+
+        db.session.delete(employment)
+        db.session.commit()
+        self.assertEqual(self.version(), 3)
+
+    def test_moving_a_record_bumps_both_users(self):
+        # Ensure a record moved to another user bumps both of them.
+        other = User(email='other@example.com', password='password')
+        employment = Employment(human_id=1, employer='Acme', position='Dev')
+        db.session.add_all([other, employment])
+        db.session.commit()
+        before = self.version(), self.version(other.id)
+
+        employment.human_id = other.id
+        db.session.commit()
+        self.assertEqual(self.version(), before[0] + 1)
+        self.assertEqual(self.version(other.id), before[1] + 1)
+
+    def test_user_edits_bump_version(self):
+        # Ensure a change to the user's own row bumps their version.
+        User.query.get(1).firstname = 'Ada'
+        db.session.commit()
+        self.assertEqual(self.version(), 1)
+
+    def test_unchanged_flush_does_not_bump(self):
+        # Ensure a commit without changes leaves the version alone.
+        User.query.get(1)
+        db.session.commit()
+        self.assertEqual(self.version(), 0)
+
+    def test_updated_at_follows_edits(self):
+        # Ensure updated_at moves forward when a record is edited.
+        publication = Publication(human_id=1, title='Draft')
+        db.session.add(publication)
+        db.session.commit()
+        created = publication.updated_at
+        publication.updated_at = created - datetime.timedelta(days=1)
+        db.session.commit()
+        publication.title = 'Final'
+        db.session.commit()
+        self.assertGreaterEqual(publication.updated_at, created)
+
+
+class TestConditionalPages(BaseTestCase):
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_unchanged_pages_answer_304(self):
+        # Ensure every versioned page revalidates with If-None-Match.
+        for url in ['/user/ad1@min.com', '/employment_list/1',
+                    '/education_list/1', '/user/publication_list/1',
+                    '/user/patent_list/1', '/user/academic_record/1']:
+            with self.client:
+                self.login()
+                self.get(url)
+                first = self.get(url)
+                self.assertEqual(first.status_code, 200, url)
+                etag = first.headers['ETag']
+                self.assertTrue(etag.startswith('"'), url)
+                self.assertIn('no-cache', first.headers['Cache-Control'])
+
+                second = self.get(url, **{'If-None-Match': etag})
+                self.assertEqual(second.status_code, 304, url)
+                self.assertEqual(second.data, b'')
+                self.assertEqual(second.headers['ETag'], etag)
+
+    def test_record_change_invalidates_etag(self):
+        # Ensure a new record changes the list page's ETag.
+        with self.client:
+            self.login()
+            self.get('/employment_list/1')
+            etag = self.get('/employment_list/1').headers['ETag']
+            db.session.add(Employment(human_id=1, employer='Acme',
+                                      position='Dev'))
+            db.session.commit()
+            response = self.get('/employment_list/1',
+                                **{'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Acme', response.data)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_etag_depends_on_viewer(self):
+        # Ensure two viewers of the same page get different ETags.
+        other = User(email='other@example.com', password='password')
+        db.session.add(other)
+        db.session.commit()
+        with self.client:
+            self.login()
+            self.get('/employment_list/1')
+            mine = self.get('/employment_list/1').headers['ETag']
+            self.client.get('/logout')
+            self.client.post('/login', data=dict(
+                email='other@example.com', password='password'))
+            self.get('/employment_list/1')
+            theirs = self.get('/employment_list/1').headers['ETag']
+        self.assertNotEqual(mine, theirs)
+
+    def test_etag_depends_on_query_string(self):
+        # Ensure each page of a list has its own ETag.
+        with self.client:
+            self.login()
+            self.get('/employment_list/1')
+            first = self.get('/employment_list/1').headers['ETag']
+            second = self.get('/employment_list/1?per_page=1')
+            self.assertNotEqual(second.headers['ETag'], first)
+
+    def test_if_modified_since(self):
+        # Ensure Last-Modified is honoured when no ETag is sent.
+        with self.client:
+            self.login()
+            self.get('/employment_list/1')
+            response = self.get('/employment_list/1')
+            last_modified = response.headers['Last-Modified']
+            self.assertEqual(self.get(
+                '/employment_list/1',
+                **{'If-Modified-Since': last_modified}).status_code, 304)
+            self.assertEqual(self.get(
+                '/employment_list/1',
+                **{'If-Modified-Since': http_date(0)}).status_code, 200)
+
+    def test_pages_with_flashes_are_not_cached(self):
+        # Ensure a page showing a flashed message is always rendered.
+        with self.client:
+            response = self.client.post(
+                '/login', data=dict(email="ad1@min.com",
+                                    password="admin_user"),
+                follow_redirects=True)
+            self.assertIn(b'Welcome', response.data)
+            self.assertNotIn('ETag', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
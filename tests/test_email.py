@@ -0,0 +1,238 @@
+# tests/test_email.py
+
+
+import datetime
+import time
+import unittest
+
+from project import app, db
+from project.email import (
+    send_email,
+    deliver_batch,
+    deliver_confirmations,
+    claim_batch,
+    backoff,
+    mail_pool,
+    RateLimiter,
+    SMTPPool
+)
+from project.models import OutboxMessage
+from project.util import BaseTestCase, LocalSMTPServer
+
+
+class TestOutbox(BaseTestCase):
+
+    def queue(self, count=1):
+        for i in range(count):
+            send_email('user%d@example.com' % i, 'Subject %d' % i,
+                       '<p>Hello %d</p>' % i)
+
+    def test_send_email_only_enqueues(self):
+        # Ensure send_email stores the message instead of sending it.
+        with LocalSMTPServer() as smtp:
+            self.queue()
+        self.assertEqual(smtp.messages, [])
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.recipient, 'user0@example.com')
+        self.assertEqual(message.attempts, 0)
+
+    def test_registration_enqueues_confirmation(self):
+        # Ensure registering does not talk to the mail server.
+        with LocalSMTPServer() as smtp:
+            self.client.post('/register', data=dict(
+                email='new@example.com', password='newpassword',
+                confirm='newpassword'), follow_redirects=True)
+        self.assertEqual(smtp.messages, [])
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.recipient, 'new@example.com')
+        self.assertIn('confirm', message.html)
+
+    def test_worker_delivers_batch_over_one_connection(self):
+        # Ensure a batch is sent over a single SMTP connection.
+        self.queue(3)
+        with LocalSMTPServer() as smtp:
+            report = deliver_batch()
+        self.assertEqual(report, (3, 0, 0))
+        self.assertEqual(len(smtp.messages), 3)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual(smtp.messages[0][1], ['user0@example.com'])
+        for message in OutboxMessage.query:
+            self.assertEqual(message.status, OutboxMessage.SENT)
+            self.assertEqual(message.attempts, 1)
+            self.assertIsNotNone(message.sent_at)
+
+    def test_worker_respects_batch_size(self):
+        # Ensure one pass claims at most batch_size messages.
+        self.queue(3)
+        with LocalSMTPServer() as smtp:
+            self.assertEqual(deliver_batch(2), (2, 0, 0))
+            self.assertEqual(deliver_batch(2), (1, 0, 0))
+            self.assertEqual(deliver_batch(2), (0, 0, 0))
+        self.assertEqual(len(smtp.messages), 3)
+
+    def test_rejected_message_is_retried_with_backoff(self):
+        # Ensure a refused message goes back in the queue for later.
+        self.queue()
+        with LocalSMTPServer() as smtp:
+            smtp.reject = '451 try again later'
+            before = datetime.datetime.utcnow()
+            self.assertEqual(deliver_batch(), (0, 1, 0))
+            self.assertEqual(deliver_batch(), (0, 0, 0))
+
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('try again later', message.last_error)
+        self.assertGreaterEqual(
+            message.next_attempt_at,
+            before + datetime.timedelta(seconds=backoff(1)))
+
+    def test_retry_succeeds_once_due(self):
+        # Ensure a retried message is sent when its next attempt is due.
+        self.queue()
+        with LocalSMTPServer() as smtp:
+            smtp.reject = '451 try again later'
+            deliver_batch()
+            smtp.reject = None
+            OutboxMessage.query.update(
+                {OutboxMessage.next_attempt_at: datetime.datetime.utcnow()})
+            db.session.commit()
+            self.assertEqual(deliver_batch(), (1, 0, 0))
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.status, OutboxMessage.SENT)
+        self.assertEqual(message.attempts, 2)
+        self.assertIsNone(message.last_error)
+
+    def test_message_fails_after_max_attempts(self):
+        # Ensure a message stops being retried after MAIL_OUTBOX_MAX_ATTEMPTS.
+        self.queue()
+        max_attempts = app.config['MAIL_OUTBOX_MAX_ATTEMPTS']
+        with LocalSMTPServer() as smtp:
+            smtp.reject = '550 no such user'
+            for attempt in range(max_attempts):
+                OutboxMessage.query.update({
+                    OutboxMessage.next_attempt_at: datetime.datetime.utcnow()
+                })
+                db.session.commit()
+                report = deliver_batch()
+        self.assertEqual(report, (0, 0, 1))
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.status, OutboxMessage.FAILED)
+        self.assertEqual(message.attempts, max_attempts)
+
+    def test_unreachable_server_requeues_batch(self):
+        # Ensure a connection failure puts the whole batch back.
+        self.queue(2)
+        with LocalSMTPServer() as smtp:
+            pass
+        state = app.extensions['mail']
+        saved = state.server, state.port, state.suppress, state.use_tls
+        state.server, state.port = '127.0.0.1', smtp.port
+        state.suppress = state.use_tls = False
+        try:
+            self.assertEqual(deliver_batch(), (0, 2, 0))
+        finally:
+            state.server, state.port, state.suppress, state.use_tls = saved
+        for message in OutboxMessage.query:
+            self.assertEqual(message.status, OutboxMessage.PENDING)
+            self.assertIsNotNone(message.last_error)
+
+    def test_claimed_messages_are_not_claimed_twice(self):
+        # Ensure a message leased to one worker is skipped by another.
+        self.queue(2)
+        self.assertEqual(len(claim_batch(10)), 2)
+        self.assertEqual(claim_batch(10), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        # Ensure a message abandoned mid-send becomes due again.
+        self.queue()
+        claim_batch(10)
+        OutboxMessage.query.update(
+            {OutboxMessage.next_attempt_at: datetime.datetime.utcnow()})
+        db.session.commit()
+        claimed = claim_batch(10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].attempts, 2)
+
+    def test_backoff_is_exponential_and_capped(self):
+        # Ensure retry delays double up to MAIL_OUTBOX_BACKOFF_MAX.
+        base = app.config['MAIL_OUTBOX_BACKOFF']
+        self.assertEqual(backoff(1), base)
+        self.assertEqual(backoff(2), base * 2)
+        self.assertEqual(backoff(3), base * 4)
+        self.assertEqual(backoff(50), app.config['MAIL_OUTBOX_BACKOFF_MAX'])
+
+
+class TestSMTPPool(BaseTestCase):
+
+    def test_batches_reuse_one_session(self):
+        # Ensure consecutive batches share a pooled SMTP connection.
+        for i in range(4):
+            send_email('user%d@example.com' % i, 'Subject', '<p>Hi</p>')
+        with LocalSMTPServer() as smtp:
+            deliver_batch(2)
+            deliver_batch(2)
+            stats = mail_pool.stats()
+        self.assertEqual(len(smtp.messages), 4)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_pool_keeps_at_most_size_connections(self):
+        # Ensure connections beyond the pool size are closed on release.
+        pool = SMTPPool(size=1)
+        with LocalSMTPServer() as smtp:
+            with pool.connection() as first:
+                with pool.connection() as second:
+                    self.assertIsNot(first, second)
+            self.assertEqual(pool.stats()['idle'], 1)
+            with pool.connection():
+                pass
+            self.assertEqual(pool.stats()['reused'], 1)
+            pool.close_all()
+        self.assertEqual(smtp.connections, 2)
+
+    def test_stale_connection_is_replaced(self):
+        # Ensure an idle connection that no longer answers NOOP is dropped.
+        pool = SMTPPool(size=1, max_idle=0)
+        with LocalSMTPServer() as smtp:
+            with pool.connection() as connection:
+                pass
+            connection.host.close()
+            with pool.connection() as replacement:
+                self.assertIsNot(replacement, connection)
+            pool.close_all()
+        self.assertEqual(smtp.connections, 2)
+
+    def test_broken_connection_is_not_returned(self):
+        # Ensure a connection that raised is closed rather than pooled.
+        pool = SMTPPool(size=1)
+        with LocalSMTPServer():
+            with self.assertRaises(IOError):
+                with pool.connection():
+                    raise IOError('connection reset')
+            self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_rate_limiter_spaces_calls(self):
+        # Ensure RateLimiter lets through at most `rate` calls a second.
+        limiter = RateLimiter(50)
+        started = time.time()
+        for i in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - started, 0.1)
+
+    def test_deliver_confirmations(self):
+        # Ensure the bulk resend sends one activation email per address.
+        emails = ['user%d@example.com' % i for i in range(5)]
+        with LocalSMTPServer() as smtp:
+            reports = list(deliver_confirmations(emails, batch_size=2))
+        self.assertEqual(sum(report.sent for report in reports), 5)
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in smtp.messages),
+                         emails)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual(OutboxMessage.query.filter_by(
+            status=OutboxMessage.SENT).count(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# tests/test_export.py
+
+
+import csv
+import datetime
+import io
+import json
+import unittest
+
+from project import db
+from project.export import export_cv, CSV_FIELDS
+from project.models import Employment, Education, Publication, Patent
+from project.util import BaseTestCase
+
+
+class TestExport(BaseTestCase):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        db.session.add_all([
+            Employment(human_id=1, employer='Acme', position='Dev',
+                       start_date=datetime.datetime(2010, 1, 1)),
+            Employment(human_id=1, employer='Initech', position='Lead',
+                       start_date=datetime.datetime(2014, 1, 1)),
+            Education(human_id=1, educational_institution='MIT',
+                      course_studied='Physics'),
+            Publication(human_id=1, title='On "quotes", commas'),
+            Patent(human_id=1, title='Widget', patent_number='US-1',
+                   inventors='Ada', description='A widget'),
+        ])
+        db.session.commit()
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def test_jsonl(self):
+        # Ensure each record is a JSON object on its own line, in order.
+        lines = [json.loads(line)
+                 for line in ''.join(export_cv(1, 'jsonl')).splitlines()]
+        self.assertEqual(lines[0]['section'], 'user')
+        self.assertEqual(lines[0]['email'], 'ad1@min.com')
+        self.assertEqual([line['section'] for line in lines[1:]],
+                         ['employment', 'employment', 'education',
+                          'publication', 'patent'])
+        self.assertEqual(lines[1]['employer'], 'Initech')
+        self.assertEqual(lines[1]['start_date'], '2014-01-01T00:00:00')
+
+    def test_csv(self):
+        # Ensure the CSV has one row per record under a shared header.
+        rows = list(csv.reader(io.StringIO(
+            u''.join(export_cv(1, 'csv')))))
+        self.assertEqual(rows[0], CSV_FIELDS)
+        self.assertEqual(len(rows), 6)
+        publication = dict(zip(rows[0], rows[4]))
+        self.assertEqual(publication['section'], 'publication')
+        self.assertEqual(publication['title'], 'On "quotes", commas')
+
+    def test_exports_are_generated_lazily(self):
+        # Ensure nothing is read until the export is iterated.
+        chunks = export_cv(1, 'jsonl')
+        self.assertFalse(isinstance(chunks, (list, tuple)))
+        self.assertIn('"user"', next(chunks))
+        self.assertIsNone(export_cv(99, 'jsonl'))
+
+    def test_endpoint_streams_html(self):
+        # Ensure the endpoint streams a standalone HTML CV.
+        # Outside `with self.client`, whose kept request context would
+        # clash with the one the stream holds on to.
+        self.login()
+        response = self.client.get('/user/export/1.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        html = response.data.decode('utf-8')
+        self.assertIn('<h2>Employment</h2>', html)
+        self.assertIn('Initech', html)
+        self.assertIn('On &#34;quotes&#34;, commas', html)
+        self.assertNotIn('_base', html)
+
+    def test_endpoint_rejects_unknown_formats_and_users(self):
+        # Ensure unknown formats and users are not found.
+        with self.client:
+            self.login()
+            self.assertEqual(
+                self.client.get('/user/export/1.pdf').status_code, 404)
+            self.assertEqual(
+                self.client.get('/user/export/99.csv').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
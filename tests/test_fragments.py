@@ -0,0 +1,168 @@
+# tests/test_fragments.py
+
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from project import app, db
+from project.models import Employment, Patent, PatentOffice, PatentStatus
+from project.fragments import MemoryStore, DiskStore, fragment_cache
+from project.util import BaseTestCase
+
+
+class TestFragmentStores(unittest.TestCase):
+
+    def test_memory_store_keeps_to_budget(self):
+        # Ensure the least recently used fragments go first.
+        store = MemoryStore(10)
+        store.put(('a', 1, 0, ''), 'aaaa')
+        store.put(('b', 1, 0, ''), 'bbbb')
+        store.get(('a', 1, 0, ''))
+        store.put(('c', 1, 0, ''), 'cccc')
+        self.assertIsNone(store.get(('b', 1, 0, '')))
+        self.assertEqual(store.get(('a', 1, 0, '')), 'aaaa')
+        self.assertEqual(store.stats()['bytes'], 8)
+        self.assertEqual(store.stats()['evictions'], 1)
+
+    def test_memory_store_drops_older_versions(self):
+        # Ensure a new version of a fragment replaces the old one.
+        store = MemoryStore(100)
+        store.put(('a', 1, 0, ''), 'old')
+        store.put(('a', 1, 1, ''), 'new')
+        self.assertIsNone(store.get(('a', 1, 0, '')))
+        self.assertEqual(store.stats()['entries'], 1)
+
+    def test_memory_store_skips_oversized_fragments(self):
+        # Ensure a fragment bigger than the budget is not stored.
+        store = MemoryStore(2)
+        store.put(('a', 1, 0, ''), 'aaaa')
+        self.assertEqual(store.stats()['entries'], 0)
+
+    def test_memory_store_counts_bytes(self):
+        # Ensure the budget is in encoded bytes, not characters.
+        store = MemoryStore(100)
+        store.put(('a', 1, 0, ''), u'caf\xe9')
+        self.assertEqual(store.stats()['bytes'], 5)
+
+    def test_disk_store_is_shared_and_bounded(self):
+        # Ensure fragments written by one store are read by another and
+        # the directory is trimmed to its budget.
+        directory = tempfile.mkdtemp()
+        try:
+            DiskStore(directory, 1000).put(('a', 1, 0, ''), u'caf\xe9')
+            store = DiskStore(directory, 1000)
+            self.assertEqual(store.get(('a', 1, 0, '')), u'caf\xe9')
+            self.assertIsNone(store.get(('a', 1, 1, '')))
+
+            store.max_bytes = 10
+            store.put(('b', 1, 0, ''), u'x' * 8)
+            self.assertLessEqual(store.stats()['bytes'], 9)
+            self.assertEqual(len(os.listdir(directory)), 1)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestFragmentCache(BaseTestCase):
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def test_list_page_is_served_from_cache(self):
+        # Ensure a repeated list page is a hit and shows the same rows.
+        db.session.add(Employment(human_id=1, employer='Acme',
+                                  position='Dev'))
+        db.session.commit()
+        with self.client:
+            self.login()
+            first = self.client.get('/employment_list/1')
+            second = self.client.get('/employment_list/1')
+        self.assertIn(b'Acme', second.data)
+        self.assertEqual(first.data, second.data)
+        stats = fragment_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_record_writes_invalidate(self):
+        # Ensure a written record shows up on the next page load.
+        with self.client:
+            self.login()
+            self.client.get('/employment_list/1')
+            self.client.get('/user/academic_record/1')
+            db.session.add(Employment(human_id=1, employer='Acme',
+                                      position='Dev'))
+            db.session.commit()
+            response = self.client.get('/employment_list/1')
+            self.assertIn(b'Acme', response.data)
+        self.assertEqual(fragment_cache.stats()['hits'], 0)
+
+    def test_lookup_edits_invalidate(self):
+        # Ensure a renamed lookup row shows up on the next page load.
+        office = PatentOffice(name='EPO')
+        db.session.add(Patent(human_id=1, title='Widget', description='d',
+                              patent_number='1', inventors='Ada',
+                              issue_date=datetime.datetime(2010, 1, 1),
+                              patent_office=office,
+                              patent_status=PatentStatus(status='Granted')))
+        db.session.commit()
+        with self.client:
+            self.login()
+            self.client.get('/user/patent_list/1')
+            db.session.execute(PatentOffice.__table__.update().values(
+                name='European Patent Office'))
+            db.session.commit()
+            response = self.client.get('/user/patent_list/1')
+        self.assertIn(b'European Patent Office', response.data)
+        self.assertEqual(fragment_cache.stats()['misses'], 2)
+
+    def test_academic_record_is_one_fragment(self):
+        # Ensure every section of the academic record is rendered and
+        # cached together, from one snapshot.
+        with self.client:
+            self.login()
+            first = self.client.get('/user/academic_record/1')
+            second = self.client.get('/user/academic_record/1')
+        self.assertEqual(first.data, second.data)
+        stats = fragment_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_pages_are_cached_apart(self):
+        # Ensure each page of a list is its own fragment.
+        db.session.add_all([
+            Employment(human_id=1, employer='Acme', position='Dev'),
+            Employment(human_id=1, employer='Initech', position='Dev'),
+        ])
+        db.session.commit()
+        with self.client:
+            self.login()
+            full = self.client.get('/employment_list/1')
+            short = self.client.get('/employment_list/1?per_page=1')
+        self.assertIn(b'Older entries', short.data)
+        self.assertNotIn(b'Older entries', full.data)
+
+    def test_disk_store_serves_other_workers(self):
+        # Ensure a fragment rendered by one worker is read from disk by
+        # another with an empty memory store.
+        directory = tempfile.mkdtemp()
+        app.config['FRAGMENT_CACHE_DIR'] = directory
+        try:
+            with self.client:
+                self.login()
+                first = self.client.get('/user/academic_record/1')
+                fragment_cache.memory.clear()
+                second = self.client.get('/user/academic_record/1')
+            self.assertEqual(first.data, second.data)
+            self.assertEqual(fragment_cache.stats()['disk_hits'], 1)
+        finally:
+            fragment_cache.reset()
+            app.config['FRAGMENT_CACHE_DIR'] = None
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
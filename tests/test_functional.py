@@ -1,10 +1,13 @@
 # tests/test_functional.py
 
 
+import json
 import unittest
 
 from flask.ext.login import current_user
 
+from project import db
+from project.models import User, Employment, Gender
 from project.util import BaseTestCase
 
 
@@ -50,5 +53,118 @@ class TestLoggingInOut(BaseTestCase):
             self.assertFalse(current_user.is_active())
 
 
+class TestPatchRecords(BaseTestCase):
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def add_employment(self, human_id=1):
+        emp = Employment(human_id=human_id, employer='Acme', position='Dev')
+        db.session.add(emp)
+        db.session.commit()
+        return emp.id
+
+    def patch(self, url, data):
+        return self.client.open(url, method='PATCH',
+                                data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_patch_applies_all_fields_at_once(self):
+        # Ensure several whitelisted fields are written in one request
+        emp_id = self.add_employment()
+        with self.client:
+            self.login()
+            response = self.patch('/employment_patch/%d' % emp_id, {
+                'employer': 'Initech',
+                'position': 'Lead',
+                'start_date': '2014-02-01'
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data.decode())['updated'],
+                             ['employer', 'position', 'start_date'])
+        emp = Employment.query.get(emp_id)
+        self.assertEqual(emp.employer, 'Initech')
+        self.assertEqual(emp.position, 'Lead')
+        self.assertEqual(emp.start_date.year, 2014)
+
+    def test_patch_rejects_unknown_fields(self):
+        # Ensure nothing is written when any field is not whitelisted
+        emp_id = self.add_employment()
+        with self.client:
+            self.login()
+            response = self.patch('/employment_patch/%d' % emp_id, {
+                'employer': 'Initech',
+                'human_id': 2
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('human_id',
+                          json.loads(response.data.decode())['errors'])
+        self.assertEqual(Employment.query.get(emp_id).employer, 'Acme')
+
+    def test_patch_rejects_unknown_lookup_ids(self):
+        # Ensure a lookup id with no row is refused rather than written
+        db.session.add(Gender(gender='Female'))
+        db.session.commit()
+        gender_id = Gender.query.one().id
+        with self.client:
+            self.login()
+            response = self.patch('/user_patch', {'gender_id': gender_id + 1})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('gender_id',
+                          json.loads(response.data.decode())['errors'])
+            response = self.patch('/user_patch', {'gender_id': gender_id})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.query.get(1).gender_id, gender_id)
+
+    def test_patch_requires_owner(self):
+        # Ensure users cannot edit records belonging to someone else
+        other = User(email="other@user.com", password="other_user")
+        db.session.add(other)
+        db.session.commit()
+        emp_id = self.add_employment(human_id=other.id)
+        with self.client:
+            self.login()
+            response = self.patch('/employment_patch/%d' % emp_id,
+                                  {'employer': 'Initech'})
+            self.assertEqual(response.status_code, 403)
+
+
+class TestStats(BaseTestCase):
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def test_stats_requires_admin(self):
+        # Ensure only admins can read the process stats
+        with self.client:
+            self.login()
+            response = self.client.get('/stats')
+            self.assertEqual(response.status_code, 403)
+
+    def test_stats_reports_pools(self):
+        # Ensure the stats include password pool queue depth and latency
+        User.query.get(1).admin = True
+        db.session.commit()
+        with self.client:
+            self.login()
+            response = self.client.get('/stats')
+            self.assertEqual(response.status_code, 200)
+            stats = json.loads(response.data.decode('utf-8'))
+            self.assertIn('queue_depth', stats['password_pool'])
+            self.assertGreater(stats['password_pool']['latency_max'], 0)
+            self.assertIn('hit_rate', stats['user_cache'])
+            self.assertIn('hit_rate', stats['fragment_cache'])
+            self.assertIn('bytes_saved', stats['compression'])
+            self.assertTrue(stats['db_pool'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+# tests/test_metrics.py
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from project import app
+from project.metrics import ARCHIVE, request_metrics, collect, render
+from project.util import BaseTestCase
+
+
+class TestMetrics(BaseTestCase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        request_metrics.clear()
+        app.config['METRICS_TOKEN'] = 'scraper'
+
+    def tearDown(self):
+        super(TestMetrics, self).tearDown()
+        app.config['METRICS_DIR'] = None
+        app.config['METRICS_TOKEN'] = None
+
+    def login(self):
+        # buffered, so the middleware sees each response closed
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True,
+            buffered=True
+        )
+
+    def sample(self, samples, family, suffix='', **labels):
+        return samples.get((family, suffix, tuple(sorted(labels.items()))))
+
+    # Ensure requests are counted with their SQL and render time
+    def test_request_is_recorded(self):
+        with self.client:
+            self.login()
+            response = self.client.get('/employment_list/1', buffered=True)
+        samples = collect()
+        endpoint = 'user.employment_list'
+        self.assertEqual(self.sample(
+            samples, 'flaskdocstore_http_requests_total',
+            endpoint=endpoint, method='GET', status='200'), 1)
+        self.assertEqual(self.sample(
+            samples, 'flaskdocstore_http_request_duration_seconds',
+            '_bucket', endpoint=endpoint, le='+Inf'), 1)
+        self.assertEqual(self.sample(
+            samples, 'flaskdocstore_http_response_size_bytes', '_sum',
+            endpoint=endpoint), len(response.data))
+        self.assertGreater(self.sample(
+            samples, 'flaskdocstore_sql_statements_total',
+            endpoint=endpoint), 0)
+        self.assertGreater(self.sample(
+            samples, 'flaskdocstore_template_render_seconds_total',
+            endpoint=endpoint), 0)
+
+    # Ensure /metrics serves the Prometheus text format
+    def test_metrics_endpoint(self):
+        with self.client:
+            self.login()
+        response = self.client.get(
+            '/metrics', headers={'Authorization': 'Bearer scraper'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        body = response.data.decode('utf-8')
+        self.assertIn('# TYPE flaskdocstore_http_request_duration_seconds '
+                      'histogram', body)
+        self.assertIn('flaskdocstore_http_requests_total{endpoint="user.login"'
+                      ',method="POST",status="302"} 1', body)
+
+    # Ensure /metrics requires the token, and is off without one
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get(
+            '/metrics', headers={'Authorization': 'Bearer scraper'})
+        self.assertEqual(response.status_code, 200)
+        app.config['METRICS_TOKEN'] = None
+        response = self.client.get(
+            '/metrics', headers={'Authorization': 'Bearer '})
+        self.assertEqual(response.status_code, 403)
+
+    # Ensure the counters of every worker writing to the directory add up
+    def test_workers_are_aggregated(self):
+        directory = tempfile.mkdtemp()
+        try:
+            app.config['METRICS_DIR'] = directory
+            with self.client:
+                self.login()
+            with open(os.path.join(directory, 'metrics-1-1.json'), 'w') as f:
+                json.dump([['flaskdocstore_http_requests_total', '', [
+                    ['endpoint', 'user.login'], ['method', 'POST'],
+                    ['status', '302']], 2]], f)
+            samples = collect(directory)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(self.sample(
+            samples, 'flaskdocstore_http_requests_total',
+            endpoint='user.login', method='POST', status='302'), 3)
+
+    # Ensure exited workers' files are folded into the archive
+    def test_exited_workers_are_archived(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with self.client:
+                self.login()
+            request_metrics.retire(directory)
+            # a worker that was killed before it could retire
+            with open(os.path.join(directory, 'metrics-99999999-1.json'),
+                      'w') as f:
+                json.dump([['flaskdocstore_http_requests_total', '', [
+                    ['endpoint', 'user.login'], ['method', 'POST'],
+                    ['status', '302']], 2]], f)
+            samples = collect(directory)
+            names = sorted(name for name in os.listdir(directory)
+                           if not name.startswith('.'))
+        finally:
+            shutil.rmtree(directory)
+        # the archive, and this process's file written again by collect
+        self.assertEqual(len(names), 2)
+        self.assertIn(ARCHIVE, names)
+        self.assertEqual(self.sample(
+            samples, 'flaskdocstore_http_requests_total',
+            endpoint='user.login', method='POST', status='302'), 3)
+
+
+class TestRender(unittest.TestCase):
+
+    # Ensure histogram samples are ordered by bucket and labels escaped
+    def test_render(self):
+        family = 'flaskdocstore_http_request_duration_seconds'
+        labels = (('endpoint', 'a"b'),)
+        text = render({
+            (family, '_count', labels): 2,
+            (family, '_bucket', labels + (('le', '+Inf'),)): 2,
+            (family, '_bucket', labels + (('le', '10.0'),)): 2,
+            (family, '_bucket', labels + (('le', '0.5'),)): 1,
+            (family, '_sum', labels): 1.5,
+        })
+        lines = [line for line in text.splitlines()
+                 if line.startswith(family)]
+        self.assertEqual(lines, [
+            family + '_bucket{endpoint="a\\"b",le="0.5"} 1',
+            family + '_bucket{endpoint="a\\"b",le="10.0"} 2',
+            family + '_bucket{endpoint="a\\"b",le="+Inf"} 2',
+            family + '_sum{endpoint="a\\"b"} 1.5',
+            family + '_count{endpoint="a\\"b"} 2',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
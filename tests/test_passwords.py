@@ -0,0 +1,157 @@
+# tests/test_passwords.py
+
+
+import threading
+import time
+import unittest
+
+from project import app, db, bcrypt
+from project.models import User
+from project.passwords import (
+    generate_password_hash,
+    check_password_hash,
+    password_pool,
+    PasswordHashBusy,
+    hash_cost,
+    policy_cost,
+    needs_rehash,
+    tune_cost
+)
+from project.util import BaseTestCase
+
+
+class TestPasswordPool(BaseTestCase):
+
+    def tearDown(self):
+        password_pool.close()
+        super(TestPasswordPool, self).tearDown()
+
+    def saturate(self, seconds=0.5):
+        # Occupy every slot of a one-process, no-queue pool with a sleep.
+        app.config['PASSWORD_POOL_PROCESSES'] = 1
+        app.config['PASSWORD_POOL_QUEUE'] = 0
+        password_pool.close()
+
+        def sleep():
+            with app.app_context():
+                password_pool.run(time.sleep, seconds)
+
+        thread = threading.Thread(target=sleep)
+        thread.start()
+        while password_pool.stats()['in_flight'] == 0:
+            time.sleep(0.01)
+        return thread
+
+    def test_hash_and_check(self):
+        # Ensure hashes made on the pool verify on the pool.
+        pw_hash = generate_password_hash('secret')
+        self.assertTrue(pw_hash.startswith('$2a$'))
+        self.assertTrue(check_password_hash(pw_hash, 'secret'))
+        self.assertFalse(check_password_hash(pw_hash, 'not secret'))
+
+    def test_errors_are_raised_in_the_caller(self):
+        # Ensure an exception in the pool process reaches the caller.
+        self.assertRaises(ValueError, generate_password_hash, '')
+
+    def test_saturated_pool_refuses_work(self):
+        # Ensure jobs beyond the concurrency cap and queue are refused.
+        thread = self.saturate()
+        with self.assertRaises(PasswordHashBusy) as busy:
+            generate_password_hash('secret')
+        self.assertEqual(busy.exception.retry_after,
+                         app.config['PASSWORD_RETRY_AFTER'])
+        thread.join()
+        self.assertEqual(password_pool.stats()['rejected'], 1)
+        self.assertTrue(generate_password_hash('secret'))
+
+    def test_slow_job_times_out(self):
+        # Ensure a caller stops waiting after PASSWORD_HASH_TIMEOUT.
+        app.config['PASSWORD_HASH_TIMEOUT'] = 0.05
+        self.assertRaises(PasswordHashBusy, password_pool.run, time.sleep, 0.3)
+        self.assertEqual(password_pool.stats()['timeouts'], 1)
+
+    def test_login_returns_503_when_saturated(self):
+        # Ensure login fails fast with Retry-After when the pool is full.
+        thread = self.saturate()
+        response = self.client.post('/login', data=dict(
+            email='ad1@min.com', password='admin_user'))
+        thread.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'],
+                         str(app.config['PASSWORD_RETRY_AFTER']))
+
+    def test_stats(self):
+        # Ensure queue depth and latency are reported.
+        password_pool.close()
+        generate_password_hash('secret')
+        stats = password_pool.stats()
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['submitted'], 1)
+        self.assertGreater(stats['latency_max'], 0)
+        self.assertGreaterEqual(stats['latency_max'], stats['hash_time_avg'])
+
+
+class TestPasswordCost(BaseTestCase):
+
+    def login(self):
+        return self.client.post('/login', data=dict(
+            email='ad1@min.com', password='admin_user'))
+
+    def test_hash_cost(self):
+        # Ensure the cost is read back from a bcrypt hash.
+        self.assertEqual(hash_cost(bcrypt.generate_password_hash('x', 5)), 5)
+        self.assertIsNone(hash_cost('plaintext'))
+        self.assertIsNone(hash_cost(None))
+
+    def test_policy_cost_is_what_bcrypt_applies(self):
+        # Ensure a configured cost below bcrypt's minimum is read as 4.
+        self.assertEqual(app.config['BCRYPT_LOG_ROUNDS'], 1)
+        self.assertEqual(policy_cost(), 4)
+        self.assertFalse(needs_rehash(generate_password_hash('secret')))
+
+    def test_login_rehashes_at_policy_cost(self):
+        # Ensure a password stored at another cost is upgraded on login.
+        user = User.query.get(1)
+        user.password = bcrypt.generate_password_hash('admin_user', 5)
+        db.session.commit()
+        self.assertTrue(needs_rehash(user.password))
+
+        with self.client:
+            self.login()
+        user = User.query.get(1)
+        self.assertEqual(hash_cost(user.password), policy_cost())
+        self.assertTrue(check_password_hash(user.password, 'admin_user'))
+
+    def test_login_keeps_hash_at_policy_cost(self):
+        # Ensure a password already at the policy cost is not rewritten.
+        stored = User.query.get(1).password
+        with self.client:
+            self.login()
+        self.assertEqual(User.query.get(1).password, stored)
+
+    def test_failed_login_does_not_rehash(self):
+        # Ensure a wrong password never triggers a rehash.
+        user = User.query.get(1)
+        user.password = stored = bcrypt.generate_password_hash('admin_user', 5)
+        db.session.commit()
+        self.client.post('/login', data=dict(
+            email='ad1@min.com', password='wrong_password'))
+        self.assertEqual(User.query.get(1).password, stored)
+
+    def test_tune_cost_picks_highest_cost_under_target(self):
+        # Ensure the tuned cost is the last one timed within the target.
+        cost, timings = tune_cost(0.005, 4, samples=1)
+        within = [c for c, seconds in timings if seconds <= 0.005]
+        self.assertEqual(cost, max(within) if within else 4)
+        self.assertGreater(timings[-1][1], 0.005)
+
+    def test_tune_cost_respects_minimum(self):
+        # Ensure the tuned cost never drops below the configured floor.
+        cost, timings = tune_cost(0, 10, samples=1)
+        self.assertEqual(cost, 10)
+        self.assertEqual(len(timings), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# tests/test_pool.py
+
+
+import os
+import tempfile
+import unittest
+
+import six
+import sqlalchemy
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, NullPool
+
+from project import app, db
+from project.pool import instrumented_pool_class, pool_stats, report
+
+
+class TestInstrumentedPool(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        pool_stats.clear()
+
+    def tearDown(self):
+        os.remove(self.path)
+        pool_stats.clear()
+
+    def engine(self, label, pre_ping=False, **options):
+        return sqlalchemy.create_engine(
+            'sqlite:///' + self.path,
+            poolclass=instrumented_pool_class(QueuePool, label, pre_ping),
+            **options)
+
+    # Ensure checkouts are timed and connections in use counted
+    def test_checkouts(self):
+        engine = self.engine('checkouts')
+        connection = engine.connect()
+        stats = pool_stats.stats()['checkouts']
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(sum(stats['checkout_buckets']), 1)
+        self.assertEqual(stats['pool'], 'InstrumentedQueuePool')
+
+        connection.close()
+        engine.connect().close()
+        stats = pool_stats.stats()['checkouts']
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['connects'], 1)
+
+    # Ensure an exhausted pool's timeouts are counted
+    def test_timeouts(self):
+        engine = self.engine('timeouts', pool_size=1, max_overflow=0,
+                             pool_timeout=0.05)
+        connection = engine.connect()
+        with self.assertRaises(sqlalchemy.exc.TimeoutError):
+            engine.connect()
+        connection.close()
+        self.assertEqual(pool_stats.stats()['timeouts']['timeouts'], 1)
+
+    # Ensure a dead pooled connection is replaced when pre-pinged
+    def test_pre_ping_replaces_dead_connections(self):
+        engine = self.engine('ping', pre_ping=True)
+        connection = engine.connect()
+        dbapi_connection = connection.connection.connection
+        connection.close()
+        dbapi_connection.close()
+
+        self.assertEqual(engine.scalar('SELECT 1'), 1)
+        stats = pool_stats.stats()['ping']
+        self.assertEqual(stats['ping_failures'], 1)
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(stats['connects'], 2)
+
+    # Ensure the exit report has a line per database
+    def test_report(self):
+        self.engine('report').connect().close()
+        out = six.StringIO()
+        report(out)
+        self.assertIn('db pool report: 1 checkouts', out.getvalue())
+
+
+class TestPoolConfig(unittest.TestCase):
+
+    # Ensure pool settings the pool class does not take are dropped
+    def test_options_follow_pool_class(self):
+        options = {'pool_size': None, 'pool_timeout': 10,
+                   'pool_recycle': 1800}
+        options.pop('pool_size')
+        db.apply_driver_hacks(app, make_url('sqlite:////tmp/x.db'), options)
+        self.assertTrue(issubclass(options['poolclass'], NullPool))
+        self.assertNotIn('pool_timeout', options)
+        self.assertEqual(options['pool_recycle'], 1800)
+
+        options = {'pool_size': 3, 'pool_timeout': 10}
+        db.apply_driver_hacks(app, make_url('postgresql://u:secret@db/x'),
+                              options)
+        self.assertTrue(issubclass(options['poolclass'], QueuePool))
+        self.assertEqual(options['pool_timeout'], 10)
+        self.assertNotIn('secret', options['poolclass'].label)
+
+
+if __name__ == '__main__':
+    unittest.main()
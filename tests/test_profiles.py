@@ -0,0 +1,180 @@
+# tests/test_profiles.py
+
+
+import datetime
+import unittest
+
+from project import app, db
+from project.models import User, Education, Publication
+from project.profiles import (
+    MemoryStore,
+    build_profiles,
+    document_rows,
+    profile_store,
+    rebuild_profiles
+)
+from project.records import record_rows
+from project.util import BaseTestCase
+
+
+class TestMemoryStore(unittest.TestCase):
+
+    # Ensure an older version never replaces a newer one
+    def test_put_keeps_newest_version(self):
+        store = MemoryStore()
+        store.put([{'_id': 1, 'version': 2, 'user': {'firstname': 'new'}}])
+        store.put([{'_id': 1, 'version': 1, 'user': {'firstname': 'old'}}])
+        self.assertEqual(store.get(1)['user']['firstname'], 'new')
+
+    # Ensure callers cannot change stored documents in place
+    def test_get_returns_copies(self):
+        store = MemoryStore()
+        store.put([{'_id': 1, 'version': 0, 'user': {}}])
+        store.get(1)['user']['firstname'] = 'changed'
+        self.assertEqual(store.get(1)['user'], {})
+
+
+class TestProfiles(BaseTestCase):
+
+    def setUp(self):
+        app.config['PROFILE_STORE_URL'] = 'memory://'
+        profile_store.reset()
+        super(TestProfiles, self).setUp()
+        db.session.add_all([
+            Education(human_id=1, educational_institution='MIT',
+                      course_studied='Physics',
+                      start_date=datetime.datetime(2001, 1, 1)),
+            Education(human_id=1, educational_institution='Caltech',
+                      course_studied='Maths',
+                      start_date=datetime.datetime(2005, 1, 1)),
+            Publication(human_id=1, title='On Widgets'),
+        ])
+        db.session.commit()
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def stored(self, human_id=1):
+        return profile_store.backend.get(human_id)
+
+    # Ensure a document embeds the user's records as record_rows has them
+    def test_build_profiles(self):
+        document = build_profiles([1, 99])[1]
+        self.assertEqual(list(build_profiles([1, 99])), [1])
+        self.assertEqual(document['user']['email'], 'ad1@min.com')
+        self.assertNotIn('password', document['user'])
+        self.assertEqual(document['version'],
+                         User.query.get(1).records_version)
+        self.assertEqual(document_rows(document, Education),
+                         record_rows(Education, 1))
+        self.assertEqual(document['employment'], [])
+
+    # Ensure committed writes are copied into the user's document
+    def test_writes_are_synced(self):
+        self.assertEqual(
+            [row['educational_institution']
+             for row in self.stored()['education']], ['Caltech', 'MIT'])
+
+        user = User.query.get(1)
+        user.firstname = 'Ada'
+        db.session.delete(
+            Publication.query.filter_by(title='On Widgets').one())
+        db.session.add(Publication(human_id=1, title='On Gadgets'))
+        db.session.commit()
+
+        document = self.stored()
+        self.assertEqual(document['user']['firstname'], 'Ada')
+        self.assertEqual([row['title'] for row in document['publications']],
+                         ['On Gadgets'])
+        db.session.expire_all()
+        self.assertEqual(document['version'],
+                         User.query.get(1).records_version)
+
+    # Ensure rolled back writes never reach the store
+    def test_rollback_is_not_synced(self):
+        version = self.stored()['version']
+        db.session.add(Publication(human_id=1, title='Draft'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.stored()['version'], version)
+        self.assertEqual(len(self.stored()['publications']), 1)
+
+    # Ensure deleting a user deletes their document
+    def test_deleted_user(self):
+        user = User(email='gone@example.com', password='secret')
+        db.session.add(user)
+        db.session.commit()
+        self.assertIsNotNone(self.stored(user.id))
+
+        db.session.delete(user)
+        db.session.commit()
+        self.assertIsNone(self.stored(user.id))
+
+    # Ensure the academic record is served from a current document
+    def test_academic_record_from_document(self):
+        document = self.stored()
+        document['education'][0]['educational_institution'] = 'From Mongo'
+        profile_store.backend.put([document])
+
+        self.login()
+        hits = profile_store.stats()['hits']
+        response = self.client.get('/user/academic_record/1')
+        self.assertIn(b'From Mongo', response.data)
+        self.assertEqual(profile_store.stats()['hits'], hits + 1)
+
+    # Ensure a document behind the user's version is not served
+    def test_stale_document_falls_back_to_sql(self):
+        document = self.stored()
+        document['education'][0]['educational_institution'] = 'From Mongo'
+        profile_store.backend.clear()
+        document['version'] -= 1
+        profile_store.backend.put([document])
+
+        self.login()
+        stale = profile_store.stats()['stale']
+        response = self.client.get('/user/academic_record/1')
+        self.assertNotIn(b'From Mongo', response.data)
+        self.assertIn(b'Caltech', response.data)
+        self.assertEqual(profile_store.stats()['stale'], stale + 1)
+
+    # Ensure the profile page is served from the document
+    def test_profile_from_document(self):
+        document = self.stored()
+        document['user']['firstname'] = 'Mongo'
+        document['user']['gender'] = 'Stored Gender'
+        profile_store.backend.put([document])
+
+        self.login()
+        response = self.client.get('/user/ad1@min.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Mongo', response.data)
+        self.assertIn(b'Stored Gender', response.data)
+
+    # Ensure a rebuild restores every document and drops orphans
+    def test_rebuild_profiles(self):
+        db.session.add(User(email='two@example.com', password='secret'))
+        db.session.commit()
+        profile_store.backend.clear()
+        profile_store.backend.put([{'_id': 42, 'version': 0, 'user': {}}])
+
+        self.assertEqual(rebuild_profiles(batch_size=1), 2)
+        self.assertEqual(sorted(profile_store.backend.ids()), [1, 2])
+        self.assertEqual(len(self.stored()['education']), 2)
+
+
+class TestProfilesDisabled(BaseTestCase):
+
+    # Ensure nothing is built or stored without PROFILE_STORE_URL
+    def test_disabled(self):
+        db.session.add(Publication(human_id=1, title='On Widgets'))
+        db.session.commit()
+        self.assertFalse(profile_store.enabled)
+        self.assertEqual(profile_store.stats()['writes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
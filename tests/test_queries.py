@@ -0,0 +1,106 @@
+# tests/test_queries.py
+
+
+import datetime
+import unittest
+import warnings
+
+from project import app, db
+from project.models import (
+    Education,
+    Patent,
+    PatentOffice,
+    PatentStatus,
+    Publication
+)
+from project.queries import QueryBudgetExceeded, RepeatedQueryWarning
+from project.records import load_academic_record
+from project.util import BaseTestCase
+
+
+class TestQueryDetector(BaseTestCase):
+
+    def setUp(self):
+        super(TestQueryDetector, self).setUp()
+        office = PatentOffice(name='EPO')
+        status = PatentStatus(status='Granted')
+        date = datetime.datetime(2010, 1, 1)
+        for number in range(30):
+            db.session.add_all([
+                Patent(human_id=1, title='Patent %d' % number,
+                       description='d', patent_number=str(number),
+                       inventors='Ada', issue_date=date,
+                       patent_office=office, patent_status=status),
+                Publication(human_id=1, title='Paper %d' % number,
+                            publication_date=date),
+                Education(human_id=1, educational_institution='School %d'
+                          % number, start_date=date),
+            ])
+        db.session.commit()
+
+    def tearDown(self):
+        super(TestQueryDetector, self).tearDown()
+        app.config['QUERY_DETECTOR'] = 'raise'
+        app.config['QUERY_REPEAT_LIMIT'] = 2
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    # Ensure lookups are read once per list, not once per row
+    def test_lists_do_not_query_per_row(self):
+        with self.assertMaxQueries(8):
+            record = load_academic_record(1)
+        self.assertEqual(record.patents[0].patent_office, 'EPO')
+        self.assertEqual(record.patents[0].patent_status, 'Granted')
+
+    # Ensure list pages stay within their budgets however many rows
+    def test_pages_within_budget(self):
+        with self.client:
+            self.login()
+            for url in ['/user/academic_record/1', '/user/patent_list/1',
+                        '/user/publication_list/1', '/education_list/1',
+                        '/records/patent/1']:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('X-Query-Count', response.headers)
+
+    # Ensure a view going over its budget fails the request
+    def test_budget_exceeded(self):
+        view = app.view_functions['user.patent_list']
+        budget = view.query_budget
+        view.query_budget = 0
+        try:
+            with self.client:
+                self.login()
+                with self.assertRaises(QueryBudgetExceeded):
+                    self.client.get('/user/patent_list/1')
+        finally:
+            view.query_budget = budget
+
+    # Ensure repeated statements are warned of
+    def test_repeated_statements_warn(self):
+        with self.client:
+            self.login()
+            app.config['QUERY_REPEAT_LIMIT'] = 0
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.client.get('/user/patent_list/1')
+        self.assertTrue(any(issubclass(warning.category,
+                                       RepeatedQueryWarning)
+                            for warning in caught))
+
+    # Ensure nothing is logged with the detector off
+    def test_detector_off(self):
+        app.config['QUERY_DETECTOR'] = 'off'
+        with self.client:
+            self.login()
+            response = self.client.get('/user/patent_list/1')
+        self.assertNotIn('X-Query-Count', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# tests/test_records.py
+
+
+import datetime
+import json
+import unittest
+
+from project import db
+from project.models import Employment, Patent, PatentStatus, Publication
+from project.records import (
+    EmploymentRow,
+    load_academic_record,
+    record_page,
+    record_rows
+)
+from project.util import BaseTestCase
+
+
+class TestAcademicRecord(BaseTestCase):
+
+    def setUp(self):
+        super(TestAcademicRecord, self).setUp()
+        status = PatentStatus(status='Patent Pending')
+        db.session.add(status)
+        db.session.add(Patent(human_id=1, title='Widget', description='d',
+                              patent_number='42', inventors='Ada',
+                              patent_status=status))
+        db.session.add(Publication(
+            human_id=1, title='Older',
+            publication_date=datetime.datetime(2001, 1, 1)))
+        db.session.add(Publication(
+            human_id=1, title='Newer',
+            publication_date=datetime.datetime(2011, 1, 1)))
+        db.session.commit()
+
+    def test_snapshot_rows(self):
+        # Ensure rows are ordered newest first with lookups resolved
+        record = load_academic_record(1)
+        self.assertEqual(record.education, ())
+        self.assertEqual([pub.title for pub in record.publications],
+                         ['Newer', 'Older'])
+        self.assertEqual(record.patents[0].patent_status, 'Patent Pending')
+        self.assertEqual(record.patents[0].patent_office, '')
+
+    def test_academic_record_page(self):
+        # Ensure the page renders every section from the snapshot
+        with self.client:
+            self.client.post('/login', data=dict(
+                email='ad1@min.com', password='admin_user'
+            ), follow_redirects=True)
+            response = self.client.get('/user/academic_record/1')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Educational History', response.data)
+            self.assertIn(b'Widget', response.data)
+            self.assertIn(b'Patent Pending', response.data)
+            self.assertIn(b'Newer', response.data)
+
+
+class TestRecordRows(BaseTestCase):
+
+    def test_rows_hold_only_displayed_columns(self):
+        # Ensure list rows are plain tuples rather than ORM objects
+        db.session.add(Employment(human_id=1, employer='Acme',
+                                  position='Dev'))
+        db.session.commit()
+        rows = record_rows(Employment, 1)
+        self.assertIsInstance(rows[0], EmploymentRow)
+        self.assertEqual(rows[0].employer, 'Acme')
+
+    def test_list_pages_render_rows(self):
+        # Ensure each list page renders from row tuples
+        db.session.add(Employment(human_id=1, employer='Acme',
+                                  position='Dev'))
+        db.session.commit()
+        with self.client:
+            self.client.post('/login', data=dict(
+                email='ad1@min.com', password='admin_user'
+            ), follow_redirects=True)
+            response = self.client.get('/employment_list/1')
+            self.assertIn(b'Acme', response.data)
+            for url in ('/education_list/1', '/user/publication_list/1',
+                        '/user/patent_list/1'):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class TestRecordPages(BaseTestCase):
+
+    def setUp(self):
+        super(TestRecordPages, self).setUp()
+        dates = [datetime.datetime(2010, 1, 1), datetime.datetime(2012, 1, 1),
+                 datetime.datetime(2012, 1, 1), None,
+                 datetime.datetime(2008, 1, 1), None]
+        for number, date in enumerate(dates):
+            db.session.add(Employment(human_id=1, employer='E%d' % number,
+                                      position='Dev', start_date=date))
+        db.session.commit()
+
+    def test_pages_cover_every_row_once_in_order(self):
+        # Ensure walking the cursors yields the same order as one query
+        expected = [row.id for row in record_rows(Employment, 1)]
+        seen = []
+        cursor = None
+        while True:
+            page = record_page(Employment, 1, cursor=cursor, per_page=2)
+            self.assertLessEqual(len(page.rows), 2)
+            seen.extend(row.id for row in page.rows)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        # Ensure per_page cannot exceed the configured maximum
+        self.app.config['RECORDS_MAX_PER_PAGE'] = 3
+        try:
+            page = record_page(Employment, 1, per_page=50)
+        finally:
+            self.app.config['RECORDS_MAX_PER_PAGE'] = 100
+        self.assertEqual(len(page.rows), 3)
+        self.assertIsNotNone(page.next_cursor)
+
+    def test_tampered_cursor_is_rejected(self):
+        # Ensure cursors cannot be forged
+        with self.assertRaises(ValueError):
+            record_page(Employment, 1, cursor='not-a-cursor')
+
+    def test_json_endpoint(self):
+        # Ensure the JSON endpoint returns rows and an opaque cursor
+        with self.client:
+            self.client.post('/login', data=dict(
+                email='ad1@min.com', password='admin_user'
+            ), follow_redirects=True)
+            response = self.client.get('/records/employment/1?per_page=4')
+            data = json.loads(response.data.decode())
+            self.assertEqual(len(data['records']), 4)
+            self.assertIn('employer', data['records'][0])
+            response = self.client.get(
+                '/records/employment/1?per_page=4&cursor=%s'
+                % data['next_cursor'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(len(data['records']), 2)
+            self.assertIsNone(data['next_cursor'])
+            response = self.client.get('/records/employment/1?cursor=bad')
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
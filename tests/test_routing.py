@@ -0,0 +1,150 @@
+# tests/test_routing.py
+
+
+import os
+import tempfile
+import time
+import unittest
+
+import sqlalchemy
+
+from project import app, db
+from project.models import User, Employment
+from project.metrics import request_metrics
+from project.routing import LAG_QUERIES, LAST_WRITE_KEY, replica_set
+from project.util import BaseTestCase
+
+
+class TestReplicaRouting(BaseTestCase):
+
+    def setUp(self):
+        super(TestReplicaRouting, self).setUp()
+        # A replica holding the same user but a different employment, so
+        # pages show which database they were read from.
+        fd, self.replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        replica = sqlalchemy.create_engine('sqlite:///' + self.replica_path)
+        db.metadata.create_all(replica)
+        users = db.session.execute(User.__table__.select()).fetchall()
+        replica.execute(User.__table__.insert(), [dict(row) for row in users])
+        replica.execute(Employment.__table__.insert(),
+                        human_id=1, employer='Replica Corp', position='Dev')
+        replica.dispose()
+
+        db.session.add(Employment(human_id=1, employer='Primary Inc',
+                                  position='Dev'))
+        db.session.commit()
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [
+            'sqlite:///' + self.replica_path]
+        replica_set.reset()
+
+    def tearDown(self):
+        replica_set.reset()
+        os.remove(self.replica_path)
+        super(TestReplicaRouting, self).tearDown()
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    # Ensure read-only views read from the replica
+    def test_reads_go_to_replica(self):
+        self.login()
+        response = self.client.get('/employment_list/1')
+        self.assertIn(b'Replica Corp', response.data)
+        self.assertNotIn(b'Primary Inc', response.data)
+        self.assertTrue(replica_set.stats()['replicas']['replica0']['reads'])
+
+    # Ensure exports are streamed from the replica
+    def test_export_reads_from_replica(self):
+        self.login()
+        response = self.client.get('/user/export/1.csv')
+        self.assertIn(b'Replica Corp', response.data)
+        self.assertNotIn(b'Primary Inc', response.data)
+
+    # Ensure a client reads its own writes from the primary for a while
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.login()
+        self.client.post('/user/employment_add/1', data=dict(
+            human_id='1', employer='New Employer', position='Lead',
+            start_date='', end_date='', job_desc=''))
+        response = self.client.get('/employment_list/1')
+        self.assertIn(b'New Employer', response.data)
+        self.assertIn(b'Primary Inc', response.data)
+        self.assertTrue(replica_set.stats()['sticky'])
+
+        with self.client.session_transaction() as session:
+            session[LAST_WRITE_KEY] = time.time() - \
+                app.config['READ_YOUR_WRITES_SECONDS']
+        response = self.client.get('/employment_list/1')
+        self.assertIn(b'Replica Corp', response.data)
+
+    # Ensure views that are not marked read-only use the primary
+    def test_other_views_use_primary(self):
+        self.login()
+        response = self.client.get('/records/employment/1')
+        self.assertIn(b'Replica Corp', response.data)
+        response = self.client.get('/search?q=primary')
+        self.assertIn(b'Primary Inc', response.data)
+
+    # Ensure replicas too far behind are skipped
+    def test_lagging_replica_is_skipped(self):
+        app.config['REPLICA_MAX_LAG'] = -1
+        self.login()
+        response = self.client.get('/employment_list/1')
+        self.assertIn(b'Primary Inc', response.data)
+        stats = replica_set.stats()
+        self.assertTrue(stats['unavailable'])
+        self.assertEqual(stats['replicas']['replica0']['lag_seconds'], 0.0)
+
+    # Ensure replicas that cannot tell their lag are skipped
+    def test_unknown_lag_is_skipped(self):
+        LAG_QUERIES['sqlite'] = sqlalchemy.text('SELECT NULL')
+        try:
+            self.login()
+            response = self.client.get('/employment_list/1')
+        finally:
+            del LAG_QUERIES['sqlite']
+        self.assertIn(b'Primary Inc', response.data)
+        stats = replica_set.stats()
+        self.assertTrue(stats['unavailable'])
+        self.assertIsNone(stats['replicas']['replica0']['lag_seconds'])
+        self.assertEqual(stats['replicas']['replica0']['errors'], 0)
+
+    # Ensure replica lag and routing are exported in /metrics
+    def test_metrics(self):
+        request_metrics.clear()
+        app.config['METRICS_TOKEN'] = 'scraper'
+        try:
+            self.login()
+            self.client.get('/employment_list/1')
+            response = self.client.get(
+                '/metrics', headers={'Authorization': 'Bearer scraper'})
+        finally:
+            app.config['METRICS_TOKEN'] = None
+        body = response.data.decode('utf-8')
+        reads = replica_set.stats()['replicas']['replica0']['reads']
+        self.assertTrue(reads)
+        self.assertIn('flaskdocstore_replica_lag_seconds{replica="replica0"} '
+                      '0\n', body)
+        self.assertIn('flaskdocstore_replica_reads_total{replica="replica0"} '
+                      '%d\n' % reads, body)
+        self.assertIn('# TYPE flaskdocstore_replica_unavailable_total '
+                      'counter', body)
+
+    # Ensure nothing is routed without replicas
+    def test_no_replicas(self):
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        replica_set.reset()
+        self.login()
+        response = self.client.get('/employment_list/1')
+        self.assertIn(b'Primary Inc', response.data)
+        self.assertEqual(replica_set.stats()['replicas'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
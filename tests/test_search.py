@@ -0,0 +1,170 @@
+# tests/test_search.py
+
+
+import json
+import unittest
+
+from project import db
+from project.models import (
+    User,
+    Employment,
+    Education,
+    Publication,
+    Patent,
+    SearchDocument,
+    SearchPosting
+)
+from project.search import search, rebuild_index, tokenize
+from project.util import BaseTestCase
+
+
+class TestSearch(BaseTestCase):
+
+    def setUp(self):
+        super(TestSearch, self).setUp()
+        db.session.add_all([
+            Publication(human_id=1, title='Graph databases in practice',
+                        authors='Ada Lovelace', description='Neo4j notes'),
+            Publication(human_id=1, title='Notes on compilers',
+                        authors='Grace Hopper',
+                        description='graph colouring for registers'),
+            Patent(human_id=1, title='Graph storage engine',
+                   inventors='Ada Lovelace', description='A storage engine',
+                   patent_number='US-1234'),
+            Employment(human_id=1, employer='Acme', position='Engineer'),
+            Education(human_id=1, educational_institution='MIT',
+                      course_studied='Computer Science'),
+        ])
+        db.session.commit()
+
+    def record_ids(self, page):
+        return [(hit.record_type, hit.title) for hit in page.hits]
+
+    def test_tokenize(self):
+        # Ensure text is split into lower-cased words without stopwords.
+        self.assertEqual(tokenize('The Art of Computer-Programming'),
+                         ['art', 'computer', 'programming'])
+        self.assertEqual(tokenize(None), [])
+
+    def test_new_records_are_indexed(self):
+        # Ensure records are searchable as soon as they are committed.
+        page = search('engineer')
+        self.assertEqual(self.record_ids(page), [('employment', 'Acme')])
+        self.assertEqual(SearchDocument.query.count(), 5)
+
+    def test_title_matches_rank_first(self):
+        # Ensure a match in the title outranks one in the description.
+        titles = [hit.title for hit in search('graph').hits]
+        self.assertEqual(len(titles), 3)
+        self.assertEqual(titles[-1], 'Notes on compilers')
+
+    def test_all_words_must_match(self):
+        # Ensure every word of the query has to occur in a hit.
+        page = search('graph lovelace')
+        self.assertEqual(sorted(hit.record_type for hit in page.hits),
+                         ['patent', 'publication'])
+        self.assertEqual(search('graph nonexistentword').hits, ())
+        self.assertEqual(search('the').hits, ())
+
+    def test_filters(self):
+        # Ensure results can be narrowed by record type and user.
+        page = search('graph', record_types=['patent'])
+        self.assertEqual(self.record_ids(page),
+                         [('patent', 'Graph storage engine')])
+        self.assertEqual(search('graph', human_id=2).hits, ())
+
+    def test_pagination(self):
+        # Ensure hits are paged in rank order.
+        first = search('graph', per_page=2)
+        self.assertEqual(len(first.hits), 2)
+        self.assertEqual(first.next_page, 2)
+        second = search('graph', page=2, per_page=2)
+        self.assertEqual(len(second.hits), 1)
+        self.assertIsNone(second.next_page)
+        self.assertEqual(search('graph').hits, first.hits + second.hits)
+
+    def test_edits_reindex(self):
+        # Ensure an edited record is found by its new text only.
+        employment = Employment.query.one()
+        employment.position = 'Astronaut'
+        db.session.commit()
+        self.assertEqual(search('engineer').hits, ())
+        self.assertEqual(len(search('astronaut').hits), 1)
+
+    def test_unsearched_edits_leave_index_alone(self):
+        # Ensure editing a field that is not searched does not re-index.
+        before = [(p.term, p.weight) for p in SearchPosting.query.order_by(
+            SearchPosting.term, SearchPosting.record_id)]
+        employment = Employment.query.one()
+        employment.job_desc = 'Rockets'
+        db.session.commit()
+        after = [(p.term, p.weight) for p in SearchPosting.query.order_by(
+            SearchPosting.term, SearchPosting.record_id)]
+        self.assertEqual(before, after)
+
+    def test_deletes_unindex(self):
+        # Ensure deleted records disappear from the index.
+        db.session.delete(Patent.query.one())
+        db.session.commit()
+        self.assertEqual(search('graph', record_types=['patent']).hits, ())
+        self.assertEqual(SearchPosting.query.filter_by(
+            record_type='patent').count(), 0)
+
+    def test_rollback_discards_index_changes(self):
+        # Ensure an index update is rolled back with its record.
+        db.session.add(Employment(human_id=1, employer='Initech',
+                                  position='Engineer'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(search('initech').hits, ())
+
+    def test_rebuild_index(self):
+        # Ensure a rebuild recreates the same index from the tables.
+        before = search('graph')
+        SearchPosting.query.delete()
+        SearchDocument.query.delete()
+        db.session.commit()
+        self.assertEqual(search('graph').hits, ())
+
+        counts = rebuild_index(batch_size=1)
+        self.assertEqual(counts, {'publication': 2, 'patent': 1,
+                                  'employment': 1, 'education': 1})
+        self.assertEqual(search('graph'), before)
+
+
+class TestSearchView(BaseTestCase):
+
+    def login(self):
+        self.client.post(
+            '/login',
+            data=dict(email="ad1@min.com", password="admin_user"),
+            follow_redirects=True
+        )
+
+    def test_search_returns_ranked_json(self):
+        # Ensure the search endpoint returns hits and the next page.
+        db.session.add_all([
+            Publication(human_id=1, title='Graph theory'),
+            Publication(human_id=1, title='Applied graph theory'),
+        ])
+        db.session.commit()
+        with self.client:
+            self.login()
+            response = self.client.get('/search?q=graph&per_page=1')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode('utf-8'))
+            self.assertEqual(len(data['results']), 1)
+            self.assertEqual(data['results'][0]['record_type'],
+                             'publication')
+            self.assertEqual(data['next_page'], 2)
+
+    def test_search_rejects_unknown_type(self):
+        # Ensure an unknown record type is a bad request.
+        with self.client:
+            self.login()
+            response = self.client.get('/search?q=graph&type=nope')
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# tests/test_seed.py
+
+
+import unittest
+
+from project import db
+from project.models import PatentOffice, PublicationCategory
+from project.seed import read_seed_file, seed_lookup_tables
+from project.util import BaseTestCase
+
+
+class TestSeedLookupTables(BaseTestCase):
+
+    def test_seed_inserts_every_row(self):
+        # Ensure an empty database receives every seed row
+        report = dict((table, (inserted, updated))
+                      for table, inserted, updated in seed_lookup_tables())
+        expected = len(read_seed_file('patent_office'))
+        self.assertEqual(report['patent_office'], (expected, 0))
+        self.assertEqual(PatentOffice.query.count(), expected)
+
+    def test_reseeding_is_a_no_op(self):
+        # Ensure a second run neither inserts nor updates
+        seed_lookup_tables()
+        for table, inserted, updated in seed_lookup_tables():
+            self.assertEqual((inserted, updated), (0, 0))
+
+    def test_changed_rows_are_updated(self):
+        # Ensure rows are matched on their natural key and brought up to date
+        seed_lookup_tables()
+        category = PublicationCategory.query.filter_by(
+            category='Books - edited').first()
+        category.description = 'stale'
+        db.session.commit()
+        report = dict((table, (inserted, updated))
+                      for table, inserted, updated in seed_lookup_tables())
+        self.assertEqual(report['publication_category'], (0, 1))
+        db.session.expire_all()
+        self.assertEqual(category.description, 'books edited')
+
+
+if __name__ == '__main__':
+    unittest.main()